@@ -1,73 +1,2469 @@
 import json
-import boto3
 import uuid
 import decimal
 import hashlib
+import hmac
 import base64
 import re
-from datetime import datetime
+import time
+import unicodedata
+import gzip
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.request import urlopen
 from botocore.exceptions import ClientError
 import os
+import threading
+from TicketTelemetry import instrument, in_request, start_request, set_route, finish_request, log_event
+from TicketThrottle import client_config, install, start_budget, is_throttle_error, retry_after
 # --- 設定區 ---
-SQS_QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/463414760499/TicketQueue' # <--- 貼上你的 SQS URL
 TABLE_NAME = 'TicketTable'
 S3_BUCKET_NAME = 'repair-work-order-system' # <--- 請替換成您的 S3 Bucket 名稱
+
+# GSI 名稱 (需在 DynamoDB 建立，Sort Key 皆為 created_at)
+TYPE_INDEX_NAME = 'type-created_at-index'     # Partition Key: type
+STATUS_INDEX_NAME = 'status-created_at-index' # Partition Key: status
+SYNC_INDEX_NAME = 'type-updated_at-index'     # Partition Key: type，Sort Key: updated_at
+SEARCH_INDEX_NAME = 'search_term-posting-index' # Partition Key: search_term，Sort Key: posting (KEYS_ONLY)
+
+# 單表設計 TicketStore (PK / SK)：使用者與工單是不同實體，搬移期間由 DATA_MODEL 決定讀寫哪張表
+# - legacy：只用 TicketTable (預設)
+# - dual：使用者兩邊都寫，先讀 TicketStore 找不到再讀 TicketTable；工單同步寫入 TicketStore，列表仍讀 TicketTable
+# - store：使用者只存在 TicketStore，列表改讀 TicketStore；工單仍寫入 TicketTable (更新、刪除、搜尋尚未搬移)
+# dual / store 的工單建立、更新、刪除都以同一個 TransactWriteItems 寫入兩張表
+STORE_TABLE_NAME = os.environ.get('STORE_TABLE_NAME', 'TicketStore')
+DATA_MODEL = os.environ.get('DATA_MODEL', 'legacy')
+OWNER_INDEX_NAME = 'GSI1'          # GSI1PK = OWNER#{email}，Sort Key: created_at (某人的工單)
+STORE_STATUS_INDEX_NAME = 'GSI2'   # GSI2PK = STATUS#{status}，Sort Key: created_at (某狀態的工單)
+ENTITY_INDEX_NAME = 'GSI3'         # GSI3PK = 實體類型，Sort Key: created_at (所有工單)
+USER_SK = 'PROFILE'
+TICKET_SK = 'TICKET'
+STORE_KEY_ATTRIBUTES = ('PK', 'SK', 'entity', 'GSI1PK', 'GSI2PK', 'GSI3PK')
+STORE_WRITE_ATTEMPTS = 3       # 更新 / 刪除工單時，讀取後又被其他請求修改的重試次數 (DATA_MODEL 不是 legacy)
+
+# 列表分頁設定
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+# fields= 可以指定的欄位 (對應 DynamoDB ProjectionExpression)
+TICKET_FIELDS = (
+    'ticket_id', 'title', 'description', 'priority', 'status', 'created_at', 'updated_at',
+    'user_email', 'user_name', 'images', 'image_keys', 'thumbnails', 'tags', 'type', 'version'
+)
+
+# 批次匯入設定
+MAX_BULK_TICKETS = 5000        # 單次請求最多筆數
+DYNAMODB_BATCH_SIZE = 25       # BatchWriteItem 上限
+TRANSACTION_MAX_ITEMS = 100    # TransactWriteItems 上限
+BULK_MAX_RETRIES = 3           # 未處理項目的重試次數
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson')
+
+# 封存 (TicketArchiveJob 把舊的 Closed 工單移到 S3，這裡負責讀取)
+ARCHIVE_PREFIX = 'archive/tickets/'     # gzip NDJSON Segment 與 manifest
+ARCHIVE_INDEX_PREFIX = 'archive/index/' # ticket_id -> Segment 位置，依 ticket_id 前兩碼分片
+ARCHIVE_INDEX_TTL = 300                 # 分片快取秒數
+
+# Outbox：建立工單時與工單一起寫入，由 TicketOutboxRelay 送到 SQS
+OUTBOX_PREFIX = 'OUTBOX#'
+
+# 搜尋索引 (倒排索引存在 TicketTable：每個詞的每張工單一筆 INDEX#{詞}#{posting}，透過 SEARCH_INDEX_NAME 依詞查詢)
+SEARCH_INDEX_PREFIX = 'INDEX#'
+SEARCH_MAX_TERMS = 20          # 單次搜尋最多詞數
+SEARCH_INDEX_WORKERS = 8       # 同時寫入 / 查詢索引的執行緒上限
+SEARCH_CURSOR_NAME = 'search'  # 搜尋結果的 next_cursor 與 GSI 游標區分
+SEARCH_POSTING_PAGE = 1000     # 每個詞每次讀取的 posting 數，各詞輪流讀，最先讀完的就是最少的詞
+SEARCH_CHECK_LIMIT = 100       # 其他詞還沒讀到的候選不超過這個數量時，改以 BatchGetItem 直接檢查 posting
+
+# 批次上傳圖片設定 (Presigned POST Policy 由 S3 檢查大小與類型)
+MAX_UPLOAD_FILES = 10          # 單次請求最多檔案數
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024 # 單一檔案上限 5MB (與前端限制相同)
+ALLOWED_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+UPLOAD_URL_EXPIRES = 300       # 上傳連結有效期 5 分鐘
+
+# 縮圖 (由 TicketThumbnailWorker 產生，命名規則需與 Worker 相同)
+S3_PUBLIC_URL = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/"
+THUMBNAIL_PREFIX = 'thumbnails/'
+THUMBNAIL_SIZES = ('small', 'medium')
+LIST_THUMBNAIL_SIZE = 'small'  # 工單的 thumbnails 欄位 (列表預設顯示) 使用的尺寸
+
+# Container 內快取 (Lambda 熱啟動時重複使用)
+CHANGE_VERSION_TTL = 2         # change_version 快取秒數，也是跨 Container 資料最久的延遲
+LIST_CACHE_SIZE = 200          # 列表頁快取筆數
+LIST_CACHE_TTL = 30
+TICKET_CACHE_SIZE = 1000       # 單筆工單快取筆數
+TICKET_CACHE_TTL = 60
+USER_CACHE_SIZE = 500          # USER# 使用者資料快取筆數
+USER_CACHE_TTL = 60
+
+# 回應壓縮：Accept-Encoding 含 gzip 且 body 超過門檻才壓縮
+GZIP_MIN_BYTES = 1024
+
+# 差異同步設定
+TOMBSTONE_TTL_SECONDS = 7 * 86400 # 刪除紀錄保留 7 天 (需開啟 TTL，屬性名稱 expires_at)
+SYNC_MAX_CHANGES = 500            # 單次同步最多回傳筆數
+SYNC_SETTLE_SECONDS = 2           # GSI 為最終一致，最近幾秒的變動下次同步會再回傳一次
+
+# 統計計數器 (存在 TicketTable，分散在 STATS_SHARDS 個項目 STATS#GLOBAL#{n}，讀取時加總，也記錄整張表的 change_version)
+# 每個 Container 固定寫入依 Container ID 選出的分片，所有寫入不會集中在同一個熱點項目；STATS#GLOBAL 本身是分片前的舊項目，讀取時一起加總
+STATS_ITEM_ID = 'STATS#GLOBAL'
+STATS_SHARDS = 8
+STATS_FLUSH_ATTEMPTS = 3       # 寫入被節流時改寫下一個分片的次數 (同一個請求內完成，不留到下一個請求)
+STATS_REBUILD_SEGMENTS = 4     # 重建時平行 Scan 的 Segment 數
+
+# Cognito ID Token 驗證 (RS256)，本機測試可用環境變數指到自己產生的金鑰
+COGNITO_REGION = os.environ.get('COGNITO_REGION', 'us-east-1')
+COGNITO_USER_POOL_ID = os.environ.get('COGNITO_USER_POOL_ID', 'us-east-1_M33EMjkq9')
+COGNITO_APP_CLIENT_ID = os.environ.get('COGNITO_APP_CLIENT_ID', '6cq6sr2ji1q4ebvsm9174qiphi') # ID Token 的 aud
+JWT_ISSUER = os.environ.get('JWT_ISSUER', f'https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_USER_POOL_ID}')
+JWKS_URL = os.environ.get('JWKS_URL', f'{JWT_ISSUER}/.well-known/jwks.json')
+JWKS_FILE = os.environ.get('JWKS_FILE')  # 有設定時改從本機檔案讀取 JWKS
+JWKS_REFRESH_INTERVAL = 60     # 遇到未知 kid 時最短重新下載間隔 (秒)，避免偽造 kid 一直打 JWKS 端點
+JWT_LEEWAY_SECONDS = 30        # exp / nbf 容許的時鐘誤差
+CLAIMS_CACHE_SIZE = 1000       # 已驗證 Token 的 claims 快取筆數 (存到 Token 過期為止)
 # -----------------------------------
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(TABLE_NAME)
-sqs = boto3.client('sqs')
-s3 = boto3.client('s3')
+# AWS Client 延遲到第一次使用才建立 (OPTIONS、login 等請求不需要 S3 / DynamoDB)
+# 建立後存在模組變數，同一個 Container 的後續請求都重複使用；每個 client 都掛上 TicketTelemetry 追蹤
+# DynamoDB 另外由 TicketThrottle 處理節流 (Client 端限速、有預算的退避重試)
+_clients = {}
+
+def get_dynamodb():
+    if 'dynamodb' not in _clients:
+        import boto3
+        _clients['dynamodb'] = boto3.resource('dynamodb', config=client_config())
+        instrument(install(_clients['dynamodb'].meta.client))
+    return _clients['dynamodb']
 
-# 處理 DynamoDB Decimal 轉 JSON 的輔助類別
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, decimal.Decimal):
-            return float(o)
-        return super(DecimalEncoder, self).default(o)
+def get_table():
+    if 'table' not in _clients:
+        _clients['table'] = get_dynamodb().Table(TABLE_NAME)
+    return _clients['table']
+
+def get_store_table():
+    if 'store_table' not in _clients:
+        _clients['store_table'] = get_dynamodb().Table(STORE_TABLE_NAME)
+    return _clients['store_table']
+
+def get_s3():
+    if 's3' not in _clients:
+        import boto3
+        _clients['s3'] = instrument(boto3.client('s3'))
+    return _clients['s3']
+
+# 處理 DynamoDB Decimal / Set 轉 JSON
+def json_default(o):
+    """
+    只有遇到 JSON 不支援的型別時才會被 C encoder 呼叫
+    整數的 Decimal 轉 int (version 不會變成 3.0)，其餘轉 float；Set 轉成排序後的 list
+    """
+    if isinstance(o, decimal.Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    if isinstance(o, (set, frozenset)):
+        return sorted(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+# 重複使用同一個 encoder，並省略分隔符號後的空白以減少回應大小
+json_encoder = json.JSONEncoder(default=json_default, separators=(',', ':'))
+
+def to_json(obj):
+    return json_encoder.encode(obj)
+
+class TTLCache:
+    """
+    Container 內的 TTL + LRU 快取，超過 maxsize 時淘汰最久沒用到的項目
+    記錄 hits / misses / evictions / expirations 方便觀察命中率
+    """
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        # ttl 可以逐筆指定 (例如 JWT 到 exp 為止)，預設用建立時的 ttl
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def metrics(self):
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+list_cache = TTLCache('list', LIST_CACHE_SIZE, LIST_CACHE_TTL)
+ticket_cache = TTLCache('ticket', TICKET_CACHE_SIZE, TICKET_CACHE_TTL)
+user_cache = TTLCache('user', USER_CACHE_SIZE, USER_CACHE_TTL)
+change_version_cache = TTLCache('change_version', 1, CHANGE_VERSION_TTL)
+claims_cache = TTLCache('claims', CLAIMS_CACHE_SIZE, 0)
+archive_index_cache = TTLCache('archive_index', 256, ARCHIVE_INDEX_TTL)
+
+# --- JWT 驗證 ---
+# RS256 = RSASSA-PKCS1-v1_5 + SHA-256，以 Python 內建的 pow 驗證，Lambda 不需要額外打包密碼學套件
+SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')
+
+# kid -> (n, e)，每個 Container 只下載一次，遇到未知 kid 才重新下載 (Cognito 輪替金鑰)
+_jwks = {'keys': {}, 'loaded_at': None}
+
+def b64url_decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+def load_jwks():
+    """
+    讀取 JWKS (JWKS_FILE 優先，否則從 Cognito 下載)，只保留 RSA 公鑰
+    """
+    if JWKS_FILE:
+        with open(JWKS_FILE, encoding='utf-8') as f:
+            jwks = json.load(f)
+    else:
+        with urlopen(JWKS_URL, timeout=3) as response:
+            jwks = json.loads(response.read())
+
+    keys = {}
+    for jwk in jwks.get('keys', []):
+        if jwk.get('kty') == 'RSA' and 'kid' in jwk:
+            keys[jwk['kid']] = (
+                int.from_bytes(b64url_decode(jwk['n']), 'big'),
+                int.from_bytes(b64url_decode(jwk['e']), 'big')
+            )
+    _jwks['keys'] = keys
+    _jwks['loaded_at'] = time.monotonic()
+
+def get_signing_key(kid):
+    key = _jwks['keys'].get(kid)
+    if key is not None:
+        return key
+    loaded_at = _jwks['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at >= JWKS_REFRESH_INTERVAL:
+        load_jwks()
+    return _jwks['keys'].get(kid)
+
+def rsa_sha256_verify(public_key, message, signature):
+    """
+    驗證 RSASSA-PKCS1-v1_5 SHA-256 簽章 (RFC 8017 8.2.2)
+    """
+    n, e = public_key
+    key_size = (n.bit_length() + 7) // 8
+    if len(signature) != key_size:
+        return False
+    s = int.from_bytes(signature, 'big')
+    if s >= n:
+        return False
+    encoded = pow(s, e, n).to_bytes(key_size, 'big')
+    digest = hashlib.sha256(message).digest()
+    padding = key_size - 3 - len(SHA256_DIGEST_INFO) - len(digest)
+    if padding < 8:
+        return False
+    expected = b'\x00\x01' + b'\xff' * padding + b'\x00' + SHA256_DIGEST_INFO + digest
+    return hmac.compare_digest(encoded, expected)
+
+def verify_jwt(token):
+    """
+    驗證 Cognito ID Token 的簽章、exp、nbf、iss、aud，成功回傳 claims
+    驗證失敗丟出 ValueError
+    """
+    parts = token.split('.')
+    if len(parts) != 3:
+        raise ValueError('Malformed token')
+    try:
+        header = json.loads(b64url_decode(parts[0]))
+        claims = json.loads(b64url_decode(parts[1]))
+        signature = b64url_decode(parts[2])
+    except ValueError:
+        raise ValueError('Malformed token')
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise ValueError('Malformed token')
+
+    if header.get('alg') != 'RS256':
+        raise ValueError(f"Unsupported alg: {header.get('alg')}")
+    public_key = get_signing_key(header.get('kid'))
+    if public_key is None:
+        raise ValueError(f"Unknown kid: {header.get('kid')}")
+    if not rsa_sha256_verify(public_key, f'{parts[0]}.{parts[1]}'.encode('ascii'), signature):
+        raise ValueError('Invalid signature')
+
+    now = time.time()
+    exp = claims.get('exp')
+    if not isinstance(exp, (int, float)) or exp + JWT_LEEWAY_SECONDS <= now:
+        raise ValueError('Token expired')
+    nbf = claims.get('nbf')
+    if isinstance(nbf, (int, float)) and nbf - JWT_LEEWAY_SECONDS > now:
+        raise ValueError('Token not yet valid')
+    if claims.get('iss') != JWT_ISSUER:
+        raise ValueError('Invalid issuer')
+    aud = claims.get('aud')
+    if COGNITO_APP_CLIENT_ID not in (aud if isinstance(aud, list) else [aud]):
+        raise ValueError('Invalid audience')
+    return claims
 
 def get_user_claims(headers):
     """
-    從 Authorization Header 解析 JWT Token (簡單解碼)
-    注意：在生產環境中，應該驗證簽章 (Signature)
+    從 Authorization Header 取出 JWT Token 並驗證，驗證失敗視為未登入 (回傳空 dict)
+    驗證過的 claims 以 Token 的 SHA-256 為 key 快取到 exp 為止，同一個 Token 之後只需查表
     """
-    auth = headers.get('Authorization') or headers.get('authorization')
+    auth = get_header(headers, 'Authorization')
     if not auth:
         return {}
-    
-    try:
-        # Token 格式通常是 "Bearer <token>" 或直接 "<token>"
-        token = auth.replace('Bearer ', '')
-        # JWT 是 header.payload.signature
-        parts = token.split('.')
-        if len(parts) < 2:
-            return {}
-            
-        payload_part = parts[1]
-        # Base64 padding
-        payload_part += '=' * (-len(payload_part) % 4)
-        claims = json.loads(base64.b64decode(payload_part))
+
+    # Token 格式通常是 "Bearer <token>" 或直接 "<token>"
+    token = auth.replace('Bearer ', '')
+    cache_key = hashlib.sha256(token.encode('utf-8')).digest()
+    claims = claims_cache.get(cache_key)
+    if claims is not None:
         return claims
+
+    try:
+        claims = verify_jwt(token)
     except Exception as e:
-        print(f"Token decode error: {e}")
+        print(f"Token rejected: {e}")
         return {}
+    claims_cache.set(cache_key, claims, ttl=claims['exp'] + JWT_LEEWAY_SECONDS - time.time())
+    return claims
 
-def lambda_handler(event, context):
-    print("Received event:", json.dumps(event)) # Debug 用
+def get_header(request_headers, name):
+    """
+    不分大小寫讀取 Request Header (API Gateway 會保留前端送來的大小寫)
+    """
+    if not request_headers:
+        return None
+    target = name.lower()
+    for key, value in request_headers.items():
+        if key.lower() == target:
+            return value
+    return None
+
+def parse_expected_version(request_headers, body):
+    """
+    從 If-Match Header 或 body 的 expected_version 取得預期版本
+    沒有指定 (或 If-Match: *) 時回傳 None，格式錯誤時丟出 ValueError
+    """
+    raw = get_header(request_headers, 'If-Match')
+    if raw is None:
+        raw = body.get('expected_version')
+    if raw is None:
+        return None
+
+    raw = str(raw).strip()
+    if raw == '*':
+        return None
+    # 支援 "3"、W/"3" 與 3 三種寫法
+    if raw.startswith('W/'):
+        raw = raw[2:]
+    raw = raw.strip('"')
+    try:
+        version = int(raw)
+    except ValueError:
+        raise ValueError('Invalid version in If-Match or expected_version')
+    if version < 0:
+        raise ValueError('Invalid version in If-Match or expected_version')
+    return version
+
+def build_mutation_condition(caller_email, require_owner, expected_version):
+    """
+    組出更新/刪除共用的 ConditionExpression，讓權限與版本檢查在同一次 DynamoDB 呼叫內完成
+    回傳 (condition_expression, attribute_names, attribute_values)
+    """
+    # 已刪除的工單會留下 type=tombstone 的紀錄，視同不存在
+    conditions = ['attribute_exists(ticket_id)', '(attribute_not_exists(#type) OR #type <> :tombstone)']
+    names = {'#type': 'type'}
+    values = {':tombstone': 'tombstone'}
+
+    if require_owner:
+        conditions.append('#owner = :caller')
+        names['#owner'] = 'user_email'
+        values[':caller'] = caller_email
+
+    if expected_version is not None:
+        names['#v'] = 'version'
+        values[':ev'] = expected_version
+        # 舊資料沒有 version 欄位，視為版本 0
+        if expected_version == 0:
+            conditions.append('(attribute_not_exists(#v) OR #v = :ev)')
+        else:
+            conditions.append('#v = :ev')
+
+    return ' AND '.join(conditions), names, values
+
+def is_condition_failure(error):
+    """
+    ConditionExpression 不符：單筆寫入的 ConditionalCheckFailedException，或交易內有項目條件不符而取消
+    """
+    code = error.response['Error']['Code']
+    if code == 'TransactionCanceledException':
+        return any(reason.get('Code') == 'ConditionalCheckFailed' for reason in error.response.get('CancellationReasons', []))
+    return code == 'ConditionalCheckFailedException'
+
+def condition_failure_item(error):
+    """
+    條件不符時帶回的舊資料 (ReturnValuesOnConditionCheckFailure=ALL_OLD)，已轉成 Python 值；沒有資料時回傳 None
+    交易取消時取第一個條件不符的項目
+    """
+    raw_item = error.response.get('Item')
+    for reason in error.response.get('CancellationReasons', []):
+        if reason.get('Code') == 'ConditionalCheckFailed':
+            raw_item = reason.get('Item')
+            break
+    if not raw_item:
+        return None
+
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {k: deserializer.deserialize(v) for k, v in raw_item.items()}
+
+def explain_condition_failure(error, caller_email, require_owner, forbidden_message):
+    """
+    條件不符時會帶回舊資料 (ReturnValuesOnConditionCheckFailure=ALL_OLD)
+    依舊資料判斷失敗原因並轉成 (statusCode, body)，不用再多讀一次
+    """
+    old_item = condition_failure_item(error)
+    if old_item is None:
+        return 404, {'error': 'Ticket not found'}
+    if old_item.get('type') == 'tombstone':
+        return 404, {'error': 'Ticket not found'}
+    if require_owner and old_item.get('user_email') != caller_email:
+        return 403, {'error': forbidden_message}
+
+    return 409, {
+        'error': 'Version conflict: ticket was modified by someone else',
+        'current_version': int(old_item.get('version', 0))
+    }
+
+def describe_images(images):
+    """
+    依圖片 URL 算出原圖 key 與縮圖 key (縮圖命名是固定規則，不用等 Worker 完成)
+    回傳 (image_keys, thumbnails)：
+    - image_keys：本系統 Bucket 內的圖片 [{'original': key, 'small': key, 'medium': key}]
+    - thumbnails：與 images 順序相同的縮圖 URL，外部圖片沿用原本的 URL
+    """
+    image_keys = []
+    thumbnails = []
+    for url in images if isinstance(images, list) else []:
+        if not isinstance(url, str):
+            continue
+        key = url[len(S3_PUBLIC_URL):] if url.startswith(S3_PUBLIC_URL) else None
+        if not key or not key.startswith('tickets/'):
+            thumbnails.append(url)
+            continue
+        entry = {'original': key}
+        for size_name in THUMBNAIL_SIZES:
+            entry[size_name] = f"{THUMBNAIL_PREFIX}{size_name}/{key}.webp"
+        image_keys.append(entry)
+        thumbnails.append(S3_PUBLIC_URL + entry[LIST_THUMBNAIL_SIZE])
+    return image_keys, thumbnails
+
+def build_ticket_item(data):
+    """
+    依前端資料組出工單 item，單筆建立與批次匯入共用同一套驗證
+    驗證失敗時丟出 ValueError
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Ticket must be a JSON object')
+
+    # 取得並驗證 title
+    title = data.get('title', 'No Title')
+    if not title:
+        title = 'No Title'
+    if not isinstance(title, str):
+        raise ValueError('Title must be a string')
+
+    # Title 字數限制 (最多 100 字元)
+    if len(title) > 100:
+        raise ValueError('Title must be 100 characters or less')
+
+    # Priority 驗證
+    priority = data.get('priority', 'Low')
+    if priority not in ['Low', 'Medium', 'High']:
+        raise ValueError('Invalid priority level')
+
+    images = data.get('images', [])
+    image_keys, thumbnails = describe_images(images)
+
+    timestamp = datetime.now().isoformat()
+    return {
+        'ticket_id': str(uuid.uuid4()),
+        'title': title,
+        'description': data.get('description', ''),
+        'priority': priority,
+        'status': 'Open',
+        'created_at': timestamp,
+        'updated_at': timestamp, # 差異同步用，每次異動都會更新
+        'user_email': data.get('user_email', ''), # 用來通知
+        'user_name': data.get('user_name', ''), # 顯示用
+        'images': images, # 儲存圖片 URL
+        'image_keys': image_keys, # 原圖與縮圖的 S3 key
+        'thumbnails': thumbnails, # 列表顯示用的縮圖 URL
+        'tags': data.get('tags', []), # 分類標籤
+        'type': 'ticket', # 標記為工單
+        'version': 1 # 樂觀鎖版本號，每次更新 +1
+    }
+
+def build_ticket_message(item):
+    """
+    建立工單後送到 SQS 的通知訊息 (由 TicketNotificationWorker 消費)
+    """
+    return {
+        'ticket_id': item['ticket_id'],
+        'title': item['title'],
+        'email': item['user_email'],
+        'priority': item['priority'], # Worker 的摘要模式用來判斷是否立即通知
+        'type': 'TICKET_CREATED'
+    }
+
+def build_outbox_record(item):
+    """
+    Outbox 紀錄：OUTBOX#{ticket_id}，message 為要送到 SQS 的 JSON 字串
+    type + created_at 讓 Relay 可以用 type index 依時間找出還沒送出的紀錄
+    """
+    return {
+        'ticket_id': f"{OUTBOX_PREFIX}{item['ticket_id']}",
+        'type': 'outbox',
+        'created_at': item['created_at'],
+        'message': json.dumps(build_ticket_message(item))
+    }
+
+def ticket_puts(item):
+    """
+    新工單要一起寫入的項目：工單、有 email 時的 Outbox 紀錄、DATA_MODEL 不是 legacy 時的 TicketStore 工單實體
+    """
+    puts = [{'TableName': TABLE_NAME, 'Item': item}]
+    if item['user_email']:
+        puts.append({'TableName': TABLE_NAME, 'Item': build_outbox_record(item)})
+    if DATA_MODEL != 'legacy':
+        puts.append({'TableName': STORE_TABLE_NAME, 'Item': ticket_entity(item)})
+    return puts
+
+def put_ticket(item):
+    """
+    寫入新工單 (項目見 ticket_puts) 與它的搜尋索引 posting，以同一個 TransactWriteItems 寫入，一起成功或一起失敗
+    詞太多 (超過 TRANSACTION_MAX_ITEMS) 時 posting 改在交易後以 BatchWriteItem 寫入
+    API 不用等 SQS；SQS 暫時無法使用時訊息留在 Outbox，由 Relay 重送
+    (resource 的 client 會自動轉換型別，Item 直接傳 Python 值)
+    """
+    puts = ticket_puts(item)
+    postings = [{'TableName': TABLE_NAME, 'Item': posting_item(term, posting_entry(item))} for term in sorted(search_index_terms(item))]
+    in_transaction = len(puts) + len(postings) <= TRANSACTION_MAX_ITEMS
+    if in_transaction:
+        puts += postings
+    if len(puts) == 1:
+        get_table().put_item(Item=item)
+    else:
+        get_dynamodb().meta.client.transact_write_items(TransactItems=[{'Put': put} for put in puts])
+    if not in_transaction:
+        update_search_index(added=[item])
+
+def transact_put_tickets(items):
+    """
+    批次建立用：每張工單與它的 Outbox 紀錄、TicketStore 實體一定在同一個交易，
+    多張工單合併成一個 TransactWriteItems (最多 TRANSACTION_MAX_ITEMS 個項目)
+    交易失敗時那一組工單都沒有寫入，回傳寫入失敗的 ticket_id 集合
+    """
+    groups = []
+    size = 0
+    for item in items:
+        puts = ticket_puts(item)
+        if not groups or size + len(puts) > TRANSACTION_MAX_ITEMS:
+            groups.append([])
+            size = 0
+        groups[-1].append((item['ticket_id'], puts))
+        size += len(puts)
+
+    failed = set()
+    for group in groups:
+        try:
+            get_dynamodb().meta.client.transact_write_items(
+                TransactItems=[{'Put': put} for _, puts in group for put in puts]
+            )
+        except ClientError as e:
+            print(f"TransactWriteItems Error: {e}")
+            failed.update(ticket_id for ticket_id, _ in group)
+    return failed
+
+def parse_bulk_rows(body):
+    """
+    取出批次匯入的資料列，支援 JSON 陣列 (tickets) 或 NDJSON 字串 (ndjson)
+    回傳 [(index, data 或 None, 錯誤訊息 或 None)]，單列格式錯誤不影響其他列
+    """
+    if isinstance(body.get('tickets'), list):
+        return [(index, row, None) for index, row in enumerate(body['tickets'])]
+
+    ndjson = body.get('ndjson')
+    if isinstance(ndjson, str):
+        rows = []
+        lines = [line for line in ndjson.splitlines() if line.strip()]
+        for index, line in enumerate(lines):
+            try:
+                rows.append((index, json.loads(line), None))
+            except ValueError:
+                rows.append((index, None, 'Invalid JSON line'))
+        return rows
+
+    raise ValueError('Missing tickets array or NDJSON body')
+
+def batch_put_tickets(items, table_name=TABLE_NAME):
+    """
+    以 BatchWriteItem 每 25 筆寫入一次，UnprocessedItems 以指數退避重試
+    table_name 為 STORE_TABLE_NAME 時 items 為 TicketStore 實體 (同樣帶有 ticket_id)
+    回傳寫入失敗的 ticket_id 集合
+    """
+    requests = batch_write_requests([{'PutRequest': {'Item': item}} for item in items], table_name)
+    return {r['PutRequest']['Item']['ticket_id'] for r in requests}
+
+def batch_write_requests(requests, table_name=TABLE_NAME):
+    """
+    BatchWriteItem 的 PutRequest / DeleteRequest 每 25 筆送出一次，UnprocessedItems 以指數退避重試
+    回傳最後仍未寫入的 request
+    """
+    failed = []
+    for start in range(0, len(requests), DYNAMODB_BATCH_SIZE):
+        chunk = requests[start:start + DYNAMODB_BATCH_SIZE]
+        requests_left = chunk
+        attempt = 0
+        while requests_left:
+            try:
+                response = get_dynamodb().batch_write_item(RequestItems={table_name: requests_left})
+            except ClientError as e:
+                print(f"BatchWriteItem Error: {e}")
+                break
+            requests_left = response.get('UnprocessedItems', {}).get(table_name, [])
+            if not requests_left or attempt >= BULK_MAX_RETRIES:
+                break
+            attempt += 1
+            time.sleep(0.05 * (2 ** attempt))
+        failed.extend(requests_left)
+    return failed
+
+def is_ticket_item(item):
+    """
+    判斷是否為工單 (舊資料沒有 type；USER#、STATS#、DIGEST# 等系統項目的 key 都含有 #)
+    """
+    return bool(item) and item.get('type', 'ticket') == 'ticket' and '#' not in item.get('ticket_id', '')
+
+# --- TicketStore 實體 ---
+# User:   PK=USER#{email}    SK=PROFILE
+# Ticket: PK=TICKET#{id}     SK=TICKET，GSI1PK=OWNER#{email}、GSI2PK=STATUS#{status}、GSI3PK=Ticket
+# 只有工單帶 GSI key，所以列表只會讀到工單，成本只與工單數有關
+def user_entity(user):
+    """
+    把 TicketTable 的 USER# 資料轉成 TicketStore 的 User 實體 (相容舊資料的 email / name 欄位)
+    """
+    email = user['ticket_id'][len('USER#'):]
+    entity = {name: value for name, value in user.items() if name not in ('ticket_id', 'type', 'email', 'name')}
+    entity.update({
+        'PK': f"USER#{email}",
+        'SK': USER_SK,
+        'entity': 'User',
+        'user_email': user.get('user_email', user.get('email', email)),
+        'user_name': user.get('user_name', user.get('name', ''))
+    })
+    return entity
+
+def ticket_entity(item):
+    """
+    把工單轉成 TicketStore 的 Ticket 實體，保留 ticket_id 等原本欄位，API 回應格式不變
+    沒有 user_email 的工單不帶 GSI1PK，不會出現在 owner index (稀疏索引)
+    """
+    entity = dict(item)
+    entity.setdefault('type', 'ticket') # 舊資料沒有 type
+    entity.update({
+        'PK': f"TICKET#{item['ticket_id']}",
+        'SK': TICKET_SK,
+        'entity': 'Ticket',
+        'GSI2PK': f"STATUS#{item.get('status', 'Open')}",
+        'GSI3PK': 'Ticket'
+    })
+    if item.get('user_email'):
+        entity['GSI1PK'] = f"OWNER#{item['user_email']}"
+    return entity
+
+def from_store_item(entity):
+    """
+    去掉 TicketStore 的 key 欄位，還原成 API 回應用的格式
+    """
+    return {name: value for name, value in entity.items() if name not in STORE_KEY_ATTRIBUTES}
+
+def to_store_item(item):
+    """
+    搬移用的 transform：TicketTableTool.py copy --transform TicketAPIHandler:to_store_item
+    USER# 轉成 User、工單轉成 Ticket，其他系統項目 (統計、索引、Outbox、刪除紀錄) 略過
+    """
+    if item.get('ticket_id', '').startswith('USER#'):
+        return user_entity(item)
+    if is_ticket_item(item):
+        return ticket_entity(item)
+    return None
+
+def store_tombstone(item, timestamp):
+    """
+    TicketStore 的刪除紀錄：取代被刪除 (或封存) 的工單實體，沒有 GSI key，不會出現在列表
+    version 比原工單大，TicketTableTool copy 以較舊的資料重新搬移時不會把工單寫回來；到期後由 TTL 自動刪除
+    """
+    return dict(
+        build_tombstone(item['ticket_id'], timestamp),
+        PK=f"TICKET#{item['ticket_id']}",
+        SK=TICKET_SK,
+        entity='Tombstone',
+        version=int(item.get('version', 0)) + 1
+    )
+
+def is_store_missing(error):
+    """
+    交易只因 TicketStore 的寫入 (第二個項目) 條件不符而取消：TicketStore 還沒有這張工單 (搬移前建立的工單)
+    """
+    reasons = [reason.get('Code') for reason in error.response.get('CancellationReasons', [])]
+    return len(reasons) > 1 and reasons[0] == 'None' and reasons[1] == 'ConditionalCheckFailed'
+
+def write_ticket_with_store(ticket_id, build_actions, read_current=True):
+    """
+    DATA_MODEL 不是 legacy 時更新 / 刪除工單：TicketTable 與 TicketStore 以同一個 TransactWriteItems 寫入 (與 put_ticket 相同)
+    build_actions(old_item) 回傳 TransactItems，第一個是 TicketTable 的寫入，由它的 ConditionExpression 把關整個交易
+    - read_current=False：不需要舊資料 (統計與搜尋索引不受影響)，build_actions(None) 直接寫入，只有一次交易
+      TicketStore 還沒有這張工單時改走下面讀取後寫入完整實體的流程
+    - read_current=True：交易不會回傳舊資料，先以強一致讀取目前的工單，TicketTable 的條件再加上 version 與讀到的相同；
+      讀取後被其他請求修改時重新讀取，最多 STORE_WRITE_ATTEMPTS 次
+    回傳讀到的舊工單 (沒有讀取或不存在時為 None)；條件不符時丟出 ClientError，可交給 explain_condition_failure
+    """
+    client = get_dynamodb().meta.client
+    if not read_current:
+        actions = build_actions(None)
+        next(iter(actions[0].values()))['ReturnValuesOnConditionCheckFailure'] = 'ALL_OLD'
+        try:
+            client.transact_write_items(TransactItems=actions)
+            return None
+        except ClientError as e:
+            if not is_store_missing(e):
+                raise
+            print(f"TicketStore has no {ticket_id} yet, writing the full entity")
+
+    for attempt in range(1, STORE_WRITE_ATTEMPTS + 1):
+        old_item = get_table().get_item(Key={'ticket_id': ticket_id}, ConsistentRead=True).get('Item')
+        actions = build_actions(old_item)
+        write = next(iter(actions[0].values()))
+        if old_item is not None and 'version' in old_item:
+            write['ConditionExpression'] = f"({write['ConditionExpression']}) AND #rv = :rv"
+            write['ExpressionAttributeValues'] = dict(write['ExpressionAttributeValues'], **{':rv': old_item['version']})
+        else:
+            write['ConditionExpression'] = f"({write['ConditionExpression']}) AND attribute_not_exists(#rv)"
+        write['ExpressionAttributeNames'] = dict(write['ExpressionAttributeNames'], **{'#rv': 'version'})
+        write['ReturnValuesOnConditionCheckFailure'] = 'ALL_OLD'
+        try:
+            client.transact_write_items(TransactItems=actions)
+            return old_item
+        except ClientError as e:
+            if not is_condition_failure(e) or attempt == STORE_WRITE_ATTEMPTS:
+                raise
+            current = condition_failure_item(e)
+            # 讀取後沒有被修改，是權限、版本或已刪除造成的條件不符
+            if current is None or old_item is None or current.get('version') == old_item.get('version'):
+                raise
+
+def delete_store_user(email, caller_email, require_owner):
+    """
+    刪除 TicketStore 的使用者，權限條件與 TicketTable 相同 (Admin 或本人)
+    回傳是否刪除 (不存在或不是本人時為 False)
+    """
+    delete_kwargs = {
+        'Key': {'PK': f"USER#{email}", 'SK': USER_SK},
+        'ConditionExpression': 'attribute_exists(PK)'
+    }
+    if require_owner:
+        delete_kwargs['ConditionExpression'] += ' AND #owner = :caller'
+        delete_kwargs['ExpressionAttributeNames'] = {'#owner': 'user_email'}
+        delete_kwargs['ExpressionAttributeValues'] = {':caller': caller_email}
+    try:
+        get_store_table().delete_item(**delete_kwargs)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+def put_user(user):
+    """
+    寫入新使用者 (user 為 TicketTable 格式)
+    store / dual 以 attribute_not_exists 條件寫入，同時註冊同一個 email 只有一個會成功
+    已存在時丟出 ClientError (ConditionalCheckFailedException 或 TransactionCanceledException)
+    """
+    if DATA_MODEL == 'legacy':
+        get_table().put_item(Item=user)
+    elif DATA_MODEL == 'store':
+        get_store_table().put_item(Item=user_entity(user), ConditionExpression='attribute_not_exists(PK)')
+    else:
+        get_dynamodb().meta.client.transact_write_items(TransactItems=[
+            {'Put': {'TableName': STORE_TABLE_NAME, 'Item': user_entity(user), 'ConditionExpression': 'attribute_not_exists(PK)'}},
+            {'Put': {'TableName': TABLE_NAME, 'Item': user, 'ConditionExpression': 'attribute_not_exists(ticket_id)'}}
+        ])
+
+def load_user(email):
+    """
+    依 DATA_MODEL 讀取使用者：store / dual 先查 TicketStore，dual 找不到時退回 TicketTable
+    dual 從 TicketTable 讀到的使用者順便寫進 TicketStore (讀取時搬移)
+    """
+    if DATA_MODEL == 'legacy':
+        return get_table().get_item(Key={'ticket_id': f"USER#{email}"}).get('Item')
+
+    user = get_store_table().get_item(Key={'PK': f"USER#{email}", 'SK': USER_SK}).get('Item')
+    if user is not None or DATA_MODEL != 'dual':
+        return user
+
+    user = get_table().get_item(Key={'ticket_id': f"USER#{email}"}).get('Item')
+    if user is not None:
+        try:
+            get_store_table().put_item(Item=user_entity(user), ConditionExpression='attribute_not_exists(PK)')
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                print(f"TicketStore Mirror Error: {e}")
+    return user
+
+def stats_deltas(item, sign=1):
+    """
+    計算一張工單對統計計數器的貢獻，sign=1 為新增，-1 為移除
+    計數器屬性名稱：total、status#{狀態}、priority#{優先度}、tag#{標籤}、day#{YYYY-MM-DD}
+    """
+    deltas = Counter()
+    deltas['total'] += sign
+    if item.get('status'):
+        deltas[f"status#{item['status']}"] += sign
+    if item.get('priority'):
+        deltas[f"priority#{item['priority']}"] += sign
+    for tag in set(t for t in (item.get('tags') or []) if isinstance(t, str) and t):
+        deltas[f"tag#{tag}"] += sign
+    if item.get('created_at'):
+        deltas[f"day#{item['created_at'][:10]}"] += sign
+    return deltas
+
+# 尚未寫入的計數器異動 (Container 內共用)；changes 為合併的異動次數
+_counters = {'deltas': Counter(), 'changes': 0}
+_counters_lock = threading.Lock()
+CONTAINER_ID = uuid.uuid4().hex[:8]
+STATS_SHARD = int(CONTAINER_ID, 16) % STATS_SHARDS
+
+def stats_item_ids():
+    """
+    所有統計項目的 key：分片前的 STATS#GLOBAL 與 STATS#GLOBAL#{0..STATS_SHARDS-1}
+    """
+    return [STATS_ITEM_ID] + [f"{STATS_ITEM_ID}#{shard}" for shard in range(STATS_SHARDS)]
+
+def read_stats(fields=None):
+    """
+    以一次 BatchGetItem 讀取所有統計分片並加總成一個計數器項目 (不存在的分片視為 0)
+    """
+    merged = Counter()
+    rebuilt_at = None
+    for item in batch_get_items(stats_item_ids(), fields).values():
+        for name, value in item.items():
+            if name == 'rebuilt_at':
+                rebuilt_at = max(rebuilt_at or value, value)
+            elif name != 'ticket_id':
+                merged[name] += int(value)
+    stats_item = dict(merged)
+    if rebuilt_at:
+        stats_item['rebuilt_at'] = rebuilt_at
+    return stats_item
+
+def record_change(deltas=None):
+    """
+    每次工單異動後呼叫：累加到 Container 內的計數器，請求結束時由 flush_counters 合併成一次 ADD
+    計數器失敗不影響主要操作，漂移時可用 rebuild_stats 重建
+    """
+    with _counters_lock:
+        _counters['deltas'].update({name: value for name, value in (deltas or {}).items() if value})
+        _counters['changes'] += 1
+
+def flush_counters():
+    """
+    以一次 ADD 把合併的統計計數器寫入本 Container 的分片，並把 change_version 加上合併的異動次數 (原子累加，不需先讀)
+    change_version 用來產生列表的 ETag；lambda_handler 每個請求回傳前都會呼叫，異動不會留到下一個請求才寫入
+    節流時在同一個請求內改寫下一個分片 (最多 STATS_FLUSH_ATTEMPTS 次)，仍失敗就捨棄並記錄，計數器漂移可用 rebuild_stats 重建
+    """
+    with _counters_lock:
+        if not _counters['changes']:
+            return
+        deltas = {name: value for name, value in _counters['deltas'].items() if value}
+        changes = _counters['changes']
+        _counters['deltas'] = Counter()
+        _counters['changes'] = 0
+
+    deltas['change_version'] = changes
+    names = {}
+    values = {}
+    parts = []
+    for index, (name, value) in enumerate(deltas.items()):
+        names[f'#c{index}'] = name
+        values[f':c{index}'] = value
+        parts.append(f'#c{index} :c{index}')
+    for attempt in range(STATS_FLUSH_ATTEMPTS):
+        shard = (STATS_SHARD + attempt) % STATS_SHARDS
+        try:
+            get_table().update_item(
+                Key={'ticket_id': f"{STATS_ITEM_ID}#{shard}"},
+                UpdateExpression="add " + ", ".join(parts),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+            break
+        except Exception as e:
+            print(f"Stats update error (shard {shard}): {e}")
+            if not is_throttle_error(e) or attempt == STATS_FLUSH_ATTEMPTS - 1:
+                print(f"Stats update dropped: {changes} change(s), run rebuild_stats to correct the counters")
+                break
+    # 本 Container 的寫入立刻生效：下次重新讀取 change_version，舊的列表快取就不會再被讀到
+    change_version_cache.clear()
+
+def discard_counters():
+    """
+    rebuild_stats 開始時呼叫：尚未寫入的異動會被重新計算，不需要再 ADD (change_version 由重建 +1)
+    """
+    with _counters_lock:
+        _counters['deltas'] = Counter()
+        _counters['changes'] = 0
+
+def format_stats(stats_item):
+    """
+    把計數器項目整理成 API 回應格式，歸零的項目不列出
+    """
+    result = {'total': 0, 'by_status': {}, 'by_priority': {}, 'by_tag': {}, 'by_day': {}}
+    groups = {'status': 'by_status', 'priority': 'by_priority', 'tag': 'by_tag', 'day': 'by_day'}
+    for name, value in stats_item.items():
+        if name == 'total':
+            result['total'] = int(value)
+            continue
+        if name == 'change_version':
+            continue
+        prefix, _, key = name.partition('#')
+        if prefix in groups and int(value) != 0:
+            result[groups[prefix]][key] = int(value)
+    result['by_day'] = dict(sorted(result['by_day'].items()))
+    if 'rebuilt_at' in stats_item:
+        result['rebuilt_at'] = stats_item['rebuilt_at']
+    return result
+
+def scan_stats_segment(segment, total_segments):
+    """
+    掃描一個 Segment 並累加統計，只讀取計數需要的欄位
+    """
+    deltas = Counter()
+    scan_kwargs = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'ProjectionExpression': '#id, #type, #status, #priority, #tags, #created',
+        'ExpressionAttributeNames': {
+            '#id': 'ticket_id', '#type': 'type', '#status': 'status',
+            '#priority': 'priority', '#tags': 'tags', '#created': 'created_at'
+        }
+    }
+    while True:
+        response = get_table().scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            if is_ticket_item(item):
+                deltas.update(stats_deltas(item))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return deltas
+
+def rebuild_stats(total_segments=STATS_REBUILD_SEGMENTS):
+    """
+    計數器漂移時使用：以平行 Segment Scan 重新計算並整筆覆蓋統計項目
+    重建期間的寫入可能被覆蓋，建議在離峰時執行
+    """
+    discard_counters()
+    totals = Counter()
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        for deltas in executor.map(in_request(lambda segment: scan_stats_segment(segment, total_segments)), range(total_segments)):
+            totals.update(deltas)
+
+    stats_item = {name: value for name, value in totals.items() if value}
+    stats_item['total'] = totals['total']
+    stats_item['rebuilt_at'] = datetime.now().isoformat()
+
+    # 重新計算的結果寫入第一個分片，其他分片 (含分片前的 STATS#GLOBAL) 只保留 change_version
+    # 覆蓋時保留各分片的 change_version，第一個分片再 +1，以條件寫入避免吃掉同時發生的 ADD
+    item_ids = stats_item_ids()
+    for item_id in item_ids:
+        while True:
+            old_item = get_table().get_item(Key={'ticket_id': item_id}, ConsistentRead=True).get('Item')
+            if old_item is None and item_id != item_ids[1]:
+                break
+            old_version = (old_item or {}).get('change_version')
+            if item_id == item_ids[1]:
+                new_item = dict(stats_item, ticket_id=item_id, change_version=(old_version or 0) + 1)
+            else:
+                new_item = {'ticket_id': item_id, 'change_version': old_version or 0}
+            try:
+                if old_version is None:
+                    get_table().put_item(Item=new_item, ConditionExpression='attribute_not_exists(change_version)')
+                else:
+                    get_table().put_item(
+                        Item=new_item,
+                        ConditionExpression='change_version = :old',
+                        ExpressionAttributeValues={':old': old_version}
+                    )
+                break
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+    change_version_cache.clear()
+    return format_stats(stats_item)
+
+def build_tombstone(ticket_id, timestamp):
+    """
+    刪除工單時留下的紀錄，讓差異同步的前端知道要移除哪張工單
+    沒有 created_at / status，所以不會出現在列表用的 GSI；到期後由 DynamoDB TTL 自動刪除
+    """
+    return {
+        'ticket_id': ticket_id,
+        'type': 'tombstone',
+        'updated_at': timestamp,
+        'expires_at': int(time.time()) + TOMBSTONE_TTL_SECONDS
+    }
+
+def query_changes(since, fields=None):
+    """
+    查詢 since 之後異動的工單與刪除紀錄 (依 updated_at 由舊到新)
+    回傳 (changed_items, deleted_ids, watermark, has_more)
+    """
+    from boto3.dynamodb.conditions import Key
+
+    query_kwargs = {
+        'IndexName': SYNC_INDEX_NAME,
+        'ScanIndexForward': True,
+        'Limit': SYNC_MAX_CHANGES
+    }
+    if fields:
+        # 判斷異動類型與 watermark 需要 type、updated_at
+        projection, names = build_projection(fields + [f for f in ('type', 'updated_at') if f not in fields])
+        query_kwargs['ProjectionExpression'] = projection
+        query_kwargs['ExpressionAttributeNames'] = names
+
+    changes = []
+    truncated_at = [] # 沒讀完的 partition 讀到的最後一筆 updated_at
+    for item_type in ('ticket', 'tombstone'):
+        response = get_table().query(
+            KeyConditionExpression=Key('type').eq(item_type) & Key('updated_at').gt(since),
+            **query_kwargs
+        )
+        items = response.get('Items', [])
+        changes.extend(items)
+        if response.get('LastEvaluatedKey'):
+            truncated_at.append(items[-1]['updated_at'] if items else response['LastEvaluatedKey']['updated_at'])
+
+    # 兩個 partition 共用一個 watermark：有 partition 沒讀完時，比它讀到的位置還新的異動留到下一頁，
+    # 否則 watermark 會跳過那個 partition 還沒讀到的異動
+    has_more = bool(truncated_at)
+    if truncated_at:
+        cutoff = min(truncated_at)
+        changes = [item for item in changes if item['updated_at'] <= cutoff]
+
+    changes.sort(key=lambda item: item['updated_at'])
+    if len(changes) > SYNC_MAX_CHANGES:
+        changes = changes[:SYNC_MAX_CHANGES]
+        has_more = True
+
+    watermark = changes[-1]['updated_at'] if changes else since
+    if not has_more:
+        # 最近幾秒的寫入可能還沒同步到 GSI，watermark 不超過 now - SYNC_SETTLE_SECONDS
+        settled = (datetime.now() - timedelta(seconds=SYNC_SETTLE_SECONDS)).isoformat()
+        watermark = max(since, min(watermark, settled))
+
+    changed_items = [item for item in changes if item.get('type') == 'ticket']
+    deleted_ids = [item['ticket_id'] for item in changes if item.get('type') == 'tombstone']
+    return changed_items, deleted_ids, watermark, has_more
+
+def parse_fields(params):
+    """
+    解析 fields=ticket_id,title,status 參數，沒有指定時回傳 None (回傳全部欄位)
+    ticket_id 一定會包含；不認得的欄位丟出 ValueError
+    """
+    raw = params.get('fields')
+    if not raw:
+        return None
+    fields = ['ticket_id']
+    for field in raw.split(','):
+        field = field.strip()
+        if not field or field in fields:
+            continue
+        if field not in TICKET_FIELDS:
+            raise ValueError(f'Unknown field: {field}')
+        fields.append(field)
+    return fields
+
+def build_projection(fields):
+    """
+    把欄位清單轉成 ProjectionExpression (一律用 placeholder，避開 status、type 等保留字)
+    回傳 (projection_expression, attribute_names)
+    """
+    names = {f'#f{index}': field for index, field in enumerate(fields)}
+    return ', '.join(names), names
+
+def get_change_version():
+    """
+    讀取整張表的 change_version (每次工單異動都會 +1，各分片加總)，用來產生列表 ETag 與判斷快取是否過期
+    快取 CHANGE_VERSION_TTL 秒，其他 Container 的寫入最多延遲這麼久才會反映
+    """
+    change_version = change_version_cache.get('current')
+    if change_version is None:
+        change_version = read_stats(['ticket_id', 'change_version']).get('change_version', 0)
+        change_version_cache.set('current', change_version)
+    return change_version
+
+def get_ticket_cached(ticket_id):
+    """
+    讀取單筆工單，快取內容以 change_version 標記，表有任何異動就視為過期
+    """
+    change_version = get_change_version()
+    entry = ticket_cache.get(ticket_id)
+    if entry is not None and entry[0] == change_version:
+        return entry[1]
+    item = get_table().get_item(Key={'ticket_id': ticket_id}).get('Item')
+    if item is not None:
+        ticket_cache.set(ticket_id, (change_version, item))
+    return item
+
+def archive_shard_key(ticket_id):
+    return f"{ARCHIVE_INDEX_PREFIX}{ticket_id[:2]}.json"
+
+def load_archive_shard(shard_key):
+    """
+    讀取封存索引分片 {ticket_id: [segment_key, offset, length]}，分片不存在時回傳空 dict
+    沒有 s3:ListBucket 權限時 S3 對不存在的 key 回傳 403 AccessDenied 而不是 404，同樣視為沒有封存
+    """
+    try:
+        body = get_s3().get_object(Bucket=S3_BUCKET_NAME, Key=shard_key)['Body'].read()
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('NoSuchKey', '404'):
+            return {}
+        if code in ('AccessDenied', '403'):
+            print(f"Archive index {shard_key}: access denied, treated as not archived (grant s3:ListBucket to get 404 instead)")
+            return {}
+        raise
+    return json.loads(body)
+
+def get_archived_ticket(ticket_id, archived=False):
+    """
+    從 S3 封存讀取單筆工單：先查分片索引，再以 Range GET 只讀取工單所在的 gzip 區塊
+    archived: TicketTable 留有封存的刪除紀錄 (確定已封存)
+    找不到時回傳 None
+    """
+    # 分片快取 ARCHIVE_INDEX_TTL 秒，與其他資料的異動無關
+    # 封存 Job 先寫分片再刪除工單，確定已封存卻不在快取的分片時，表示分片是這次封存前讀的，重新讀取
+    shard_key = archive_shard_key(ticket_id)
+    shard = archive_index_cache.get(shard_key)
+    if shard is None or (archived and ticket_id not in shard):
+        shard = load_archive_shard(shard_key)
+        archive_index_cache.set(shard_key, shard)
+    location = shard.get(ticket_id)
+    if not location:
+        return None
+
+    segment_key, offset, length = location
+    block = get_s3().get_object(
+        Bucket=S3_BUCKET_NAME,
+        Key=segment_key,
+        Range=f"bytes={offset}-{offset + length - 1}"
+    )['Body'].read()
+    for line in gzip.decompress(block).splitlines():
+        item = json.loads(line)
+        if item.get('ticket_id') == ticket_id:
+            item['archived'] = True
+            return item
+    return None
+
+def get_user_cached(email):
+    """
+    讀取 USER# 使用者資料 (登入、註冊檢查用)，只快取存在的使用者
+    """
+    user = user_cache.get(email)
+    if user is None:
+        user = load_user(email)
+        if user is not None:
+            user_cache.set(email, user)
+    return user
+
+def query_tickets_cached(params, change_version, loader=None):
+    """
+    列表頁快取：key 包含 change_version 與查詢參數，資料異動後舊的 key 自然不會再命中
+    loader 預設為 query_tickets，搜尋時傳入 search_tickets
+    """
+    loader = loader or query_tickets
+    cache_key = (change_version, loader.__name__, json.dumps(params, sort_keys=True))
+    cached = list_cache.get(cache_key)
+    if cached is None:
+        cached = loader(params)
+        list_cache.set(cache_key, cached)
+    return cached
+
+def cache_metrics():
+    return {cache.name: cache.metrics() for cache in (list_cache, ticket_cache, user_cache, change_version_cache, claims_cache, archive_index_cache)}
+
+def list_etag(change_version, params):
+    """
+    列表的 Strong ETag：change_version 加上查詢參數 (不同篩選條件是不同的內容)
+    """
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return f'"cv{change_version}-{digest}"'
+
+def gzip_etag(etag):
+    """
+    gzip 回應的 ETag：內容位元組不同，Strong ETag 不能與未壓縮的共用
+    """
+    return etag[:-1] + '-gzip"'
+
+def matching_etag(request_headers, etag):
+    """
+    比對 If-None-Match (可能是 *、多個 ETag 或 W/ 開頭)，回傳相符的 ETag (未壓縮或 gzip 版本)，不相符時回傳 None
+    """
+    raw = get_header(request_headers, 'If-None-Match')
+    if not raw:
+        return None
+    for candidate in raw.split(','):
+        candidate = candidate.strip().replace('W/', '', 1)
+        if candidate == '*':
+            return etag
+        if candidate in (etag, gzip_etag(etag)):
+            return candidate
+    return None
+
+def etag_matches(request_headers, etag):
+    return matching_etag(request_headers, etag) is not None
+
+def build_get_response(event, headers, payload, etag=None):
+    """
+    GET 回應共用：帶 ETag / Cache-Control，If-None-Match 相符時回傳 304
+    前端接受 gzip 且 body 超過 GZIP_MIN_BYTES 時以 gzip + base64 回傳，ETag 加上 -gzip
+    (API Gateway 需在 Binary Media Types 加入 */*，請求 body 也會變成 base64，由 parse_body 還原)
+    """
+    request_headers = event.get('headers')
+    response_headers = dict(headers)
+    response_headers['Cache-Control'] = 'private, no-cache'
+    # 304 也要帶 Vary，快取才會依 Accept-Encoding 分開存放
+    response_headers['Vary'] = 'Accept-Encoding'
+    if etag:
+        response_headers['ETag'] = etag
+        matched = matching_etag(request_headers, etag)
+        if matched:
+            response_headers['ETag'] = matched
+            return {'statusCode': 304, 'headers': response_headers, 'body': ''}
+
+    body = to_json(payload)
+    accept_encoding = (get_header(request_headers, 'Accept-Encoding') or '').lower()
+    if 'gzip' in accept_encoding and len(body) >= GZIP_MIN_BYTES:
+        response_headers['Content-Encoding'] = 'gzip'
+        if etag:
+            response_headers['ETag'] = gzip_etag(etag)
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': base64.b64encode(gzip.compress(body.encode('utf-8'), compresslevel=5)).decode('ascii'),
+            'isBase64Encoded': True
+        }
+    return {'statusCode': 200, 'headers': response_headers, 'body': body}
+
+def encode_cursor(index_name, last_key):
+    """
+    將 DynamoDB 的 LastEvaluatedKey 包成不透明的 next_cursor 字串
+    一併記錄使用的 index，避免游標被拿去查詢別的 index
+    """
+    if not last_key:
+        return None
+    raw = to_json({'i': index_name, 'k': last_key})
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, index_name):
+    """
+    解析 next_cursor，格式錯誤或 index 不符時丟出 ValueError
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid next_cursor')
+
+    if not isinstance(data, dict) or data.get('i') != index_name or not isinstance(data.get('k'), dict):
+        raise ValueError('Invalid next_cursor')
+    return data['k']
+
+def parse_page_params(params):
+    """
+    解析列表與搜尋共用的 limit / order 參數，回傳 (limit, order)
+    """
+    try:
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    order = (params.get('order') or 'desc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    return limit, order
+
+def query_tickets(params):
+    """
+    依查詢參數透過 GSI 分頁讀取工單，只讀取本頁需要的資料
+    回傳 (items, next_cursor)，參數錯誤時丟出 ValueError
+
+    支援參數:
+    - limit: 每頁筆數 (預設 DEFAULT_PAGE_SIZE，最多 MAX_PAGE_SIZE)
+    - next_cursor: 上一頁回傳的游標
+    - status / priority / user_email: 篩選條件
+    - created_from / created_to: created_at 範圍 (ISO 8601，含端點)
+    - order: asc 或 desc (預設 desc，新的在前)
+    - fields: 只回傳指定欄位，例如 ticket_id,title,status,priority,created_at
+    """
+    from boto3.dynamodb.conditions import Key, Attr
+
+    limit, order = parse_page_params(params)
+
+    status = params.get('status')
+    priority = params.get('priority')
+    owner_email = params.get('user_email')
+    created_from = params.get('created_from')
+    created_to = params.get('created_to')
+
+    if priority and priority not in ['Low', 'Medium', 'High']:
+        raise ValueError('Invalid priority level')
+
+    filters = []
+    if priority:
+        filters.append(Attr('priority').eq(priority))
+
+    if DATA_MODEL == 'store':
+        # TicketStore：有 owner 時走 owner index (不用再篩選 user_email)，其次 status，否則列出所有工單
+        table = get_store_table()
+        if owner_email:
+            index_name = OWNER_INDEX_NAME
+            key_condition = Key('GSI1PK').eq(f"OWNER#{owner_email}")
+            if status:
+                filters.append(Attr('status').eq(status))
+        elif status:
+            index_name = STORE_STATUS_INDEX_NAME
+            key_condition = Key('GSI2PK').eq(f"STATUS#{status}")
+        else:
+            index_name = ENTITY_INDEX_NAME
+            key_condition = Key('GSI3PK').eq('Ticket')
+    else:
+        # 有 status 時走 status index (稀疏索引，只有工單有 status)，否則走 type index
+        table = get_table()
+        if status:
+            index_name = STATUS_INDEX_NAME
+            key_condition = Key('status').eq(status)
+        else:
+            index_name = TYPE_INDEX_NAME
+            key_condition = Key('type').eq('ticket')
+        if owner_email:
+            filters.append(Attr('user_email').eq(owner_email))
+
+    # created_at 是 index 的 Sort Key，範圍條件放在 KeyCondition 才不會多讀
+    if created_from and created_to:
+        key_condition = key_condition & Key('created_at').between(created_from, created_to)
+    elif created_from:
+        key_condition = key_condition & Key('created_at').gte(created_from)
+    elif created_to:
+        key_condition = key_condition & Key('created_at').lte(created_to)
+
+    query_kwargs = {
+        'IndexName': index_name,
+        'KeyConditionExpression': key_condition,
+        'ScanIndexForward': order == 'asc'
+    }
+    if filters:
+        filter_expression = filters[0]
+        for condition in filters[1:]:
+            filter_expression = filter_expression & condition
+        query_kwargs['FilterExpression'] = filter_expression
+
+    # 列表只需要部分欄位時，不必把 description、images 等大欄位傳回來
+    fields = parse_fields(params)
+    if fields:
+        projection, names = build_projection(fields)
+        query_kwargs['ProjectionExpression'] = projection
+        query_kwargs['ExpressionAttributeNames'] = names
+
+    cursor = params.get('next_cursor')
+    if cursor:
+        query_kwargs['ExclusiveStartKey'] = decode_cursor(cursor, index_name)
+
+    # 每次只評估剩下需要的筆數，LastEvaluatedKey 就會剛好停在本頁最後一筆，不會跳過資料
+    items = []
+    last_key = None
+    while len(items) < limit:
+        query_kwargs['Limit'] = limit - len(items)
+        response = table.query(**query_kwargs)
+        items.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+    if DATA_MODEL == 'store':
+        items = [from_store_item(item) for item in items]
+    return items, encode_cursor(index_name, last_key)
+
+# --- 搜尋索引 ---
+# 中日韓文字 (漢字、假名、韓文)，沒有空白分詞，改用相鄰兩字 (bigram)
+CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+WORD_RE = re.compile(r'[^\W_]+')
+SEGMENT_RE = re.compile(f'[{CJK_CHARS}]+|[^{CJK_CHARS}]+')
+CJK_RE = re.compile(f'[{CJK_CHARS}]')
+
+def tokenize(text):
+    """
+    標題斷詞 (NFKC 正規化、轉小寫)：
+    - 英數字以單字為單位，略過單一英文字母
+    - 中日韓文字取相鄰兩字，例如「投影機故障」-> 投影、影機、機故、故障；只有一個字時保留單字
+    """
+    terms = set()
+    normalized = unicodedata.normalize('NFKC', text if isinstance(text, str) else '').lower()
+    for word in WORD_RE.findall(normalized):
+        for segment in SEGMENT_RE.findall(word):
+            if CJK_RE.match(segment):
+                if len(segment) == 1:
+                    terms.add(segment)
+                else:
+                    terms.update(segment[i:i + 2] for i in range(len(segment) - 1))
+            elif len(segment) > 1 or segment.isdigit():
+                terms.add(segment)
+    return terms
+
+def normalize_tag(tag):
+    return unicodedata.normalize('NFKC', str(tag)).strip().lower()
+
+def search_index_terms(item):
+    """
+    工單對應的所有索引詞 (title#{詞}、tag#{標籤})
+    """
+    terms = {f'title#{term}' for term in tokenize(item.get('title'))}
+    tags = item.get('tags')
+    if isinstance(tags, list):
+        terms.update(f'tag#{tag}' for tag in map(normalize_tag, tags) if tag)
+    return terms
+
+def posting_entry(item):
+    # created_at 放前面，排序後就是建立時間順序
+    return f"{item.get('created_at', '')}|{item['ticket_id']}"
+
+def posting_key(term, entry):
+    return {'ticket_id': f'{SEARCH_INDEX_PREFIX}{term}#{entry}'}
+
+def posting_item(term, entry):
+    return dict(posting_key(term, entry), search_term=term, posting=entry)
+
+def update_search_index(added=(), removed=()):
+    """
+    依新增 / 移除的工單更新倒排索引：每個詞的每張工單一個項目，以 BatchWriteItem 寫入 / 刪除
+    同一張工單前後都有的詞互相抵銷，不會寫入
+    索引更新失敗只記錄 log，不影響工單本身的寫入
+    """
+    adds = {(term, posting_entry(item)) for item in added for term in search_index_terms(item)}
+    deletes = {(term, posting_entry(item)) for item in removed for term in search_index_terms(item)}
+    unchanged = adds & deletes
+    requests = [
+        {'PutRequest': {'Item': posting_item(term, entry)}}
+        for term, entry in sorted(adds - unchanged)
+    ]
+    requests += [{'DeleteRequest': {'Key': posting_key(term, entry)}} for term, entry in sorted(deletes - unchanged)]
+    if not requests:
+        return
+
+    chunks = [requests[start:start + DYNAMODB_BATCH_SIZE] for start in range(0, len(requests), DYNAMODB_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=min(SEARCH_INDEX_WORKERS, len(chunks))) as executor:
+        futures = [executor.submit(in_request(batch_write_requests), chunk) for chunk in chunks]
+        for future in futures:
+            try:
+                failed = future.result()
+            except Exception as e:
+                print(f"Search index error: {e}")
+                continue
+            if failed:
+                print(f"Search index error: {len(failed)} posting(s) not written")
+
+def read_postings_page(reader):
+    """
+    讀取一個詞的下一頁 posting ({created_at}|{ticket_id}，依 posting 排序)
+    reader: {'term', 'entries', 'last' (讀到的最後一筆), 'start_key', 'done'}
+    """
+    from boto3.dynamodb.conditions import Key
+
+    query_kwargs = {
+        'IndexName': SEARCH_INDEX_NAME,
+        'KeyConditionExpression': Key('search_term').eq(reader['term']),
+        'ProjectionExpression': 'posting',
+        'Limit': SEARCH_POSTING_PAGE
+    }
+    if reader['start_key']:
+        query_kwargs['ExclusiveStartKey'] = reader['start_key']
+    response = get_table().query(**query_kwargs)
+    items = response.get('Items', [])
+    reader['entries'].update(item['posting'] for item in items)
+    if items:
+        reader['last'] = items[-1]['posting']
+    reader['start_key'] = response.get('LastEvaluatedKey')
+    reader['done'] = not reader['start_key']
+
+def posting_exists(term, entries):
+    """
+    以 BatchGetItem 檢查哪些 posting 存在於這個詞 (entries 不多時比讀完整個詞便宜)
+    """
+    keys = [posting_key(term, entry)['ticket_id'] for entry in entries]
+    found = batch_get_items(keys, ['ticket_id'])
+    return {entry for entry, key in zip(entries, keys) if key in found}
+
+def match_postings(terms, executor):
+    """
+    所有詞都有的 posting：各詞同時一頁一頁讀，最先讀完的詞 (最少的) 當作候選，其他詞只檢查候選
+    - 其他詞已讀到的範圍內沒出現的候選直接排除 (posting 依排序讀取)
+    - 還沒讀到的候選不超過 SEARCH_CHECK_LIMIT 時以 BatchGetItem 檢查，否則繼續讀那個詞
+    """
+    readers = [{'term': term, 'entries': set(), 'last': None, 'start_key': None, 'done': False} for term in sorted(terms)]
+    while True:
+        list(executor.map(in_request(read_postings_page), [reader for reader in readers if not reader['done']]))
+        finished = [reader for reader in readers if reader['done']]
+        if finished:
+            break
+    rarest = min(finished, key=lambda reader: len(reader['entries']))
+    candidates = set(rarest['entries'])
+
+    for reader in readers:
+        if reader is rarest:
+            continue
+        while candidates:
+            if reader['done']:
+                candidates &= reader['entries']
+                break
+            unread = {entry for entry in candidates if entry > reader['last']}
+            candidates = (candidates & reader['entries']) | unread
+            if len(unread) <= SEARCH_CHECK_LIMIT:
+                candidates = (candidates - unread) | posting_exists(reader['term'], sorted(unread))
+                break
+            read_postings_page(reader)
+        if not candidates:
+            break
+    return candidates
+
+def verify_postings(entries, terms, executor):
+    """
+    去掉過期的 posting：工單已刪除 / 封存、created_at 不同 (posting 已換新)，或標題、標籤已不含搜尋的詞
+    (索引寫入失敗時可能留下)；回傳仍然有效的 posting
+    """
+    entries = sorted(entries)
+    chunks = [entries[start:start + 100] for start in range(0, len(entries), 100)]
+    fields = ['ticket_id', 'type', 'created_at', 'title', 'tags']
+
+    def check(chunk):
+        found = batch_get_items([entry.split('|', 1)[1] for entry in chunk], fields)
+        valid = []
+        for entry in chunk:
+            item = found.get(entry.split('|', 1)[1])
+            if is_ticket_item(item) and posting_entry(item) == entry and terms <= search_index_terms(item):
+                valid.append(entry)
+        return valid
+
+    valid = set()
+    for chunk_valid in executor.map(in_request(check), chunks):
+        valid.update(chunk_valid)
+    if len(valid) < len(entries):
+        print(f"Search index: {len(entries) - len(valid)} stale posting(s) skipped")
+    return valid
+
+def backfill_search_index():
+    """
+    為既有工單補上搜尋索引 (透過 type index 只讀工單，不 Scan 整張表)
+    重複寫入同一個 posting 不影響結果，可以重複執行；回傳處理的工單數
+    """
+    from boto3.dynamodb.conditions import Key
+
+    query_kwargs = {
+        'IndexName': TYPE_INDEX_NAME,
+        'KeyConditionExpression': Key('type').eq('ticket'),
+        'ProjectionExpression': '#id, #title, #tags, #created',
+        'ExpressionAttributeNames': {'#id': 'ticket_id', '#title': 'title', '#tags': 'tags', '#created': 'created_at'}
+    }
+    indexed = 0
+    while True:
+        response = get_table().query(**query_kwargs)
+        items = response.get('Items', [])
+        update_search_index(added=items)
+        indexed += len(items)
+        if 'LastEvaluatedKey' not in response:
+            return indexed
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def batch_get_items(keys, fields=None):
+    """
+    以 BatchGetItem 每 100 筆讀取一次，UnprocessedKeys 以指數退避重試
+    回傳 {ticket_id: item}
+    """
+    found = {}
+    for start in range(0, len(keys), 100):
+        request = {'Keys': [{'ticket_id': key} for key in keys[start:start + 100]]}
+        if fields:
+            request['ProjectionExpression'], request['ExpressionAttributeNames'] = build_projection(fields)
+        attempt = 0
+        while request:
+            response = get_dynamodb().batch_get_item(RequestItems={TABLE_NAME: request})
+            for item in response.get('Responses', {}).get(TABLE_NAME, []):
+                found[item['ticket_id']] = item
+            request = response.get('UnprocessedKeys', {}).get(TABLE_NAME)
+            if not request:
+                break
+            if attempt >= BULK_MAX_RETRIES:
+                raise RuntimeError('BatchGetItem did not finish, please retry')
+            attempt += 1
+            time.sleep(0.05 * (2 ** attempt))
+    return found
+
+def search_tickets(params):
+    """
+    ?q=&tags= 搜尋：從最少的詞開始取 posting 交集，去掉過期的 posting 後依建立時間分頁，再以 BatchGetItem 取回本頁工單
+    回傳 (items, next_cursor, total)，參數錯誤時丟出 ValueError
+
+    支援參數:
+    - q: 標題關鍵字 (所有詞都要符合)
+    - tags: 逗號分隔的標籤 (所有標籤都要符合)
+    - limit / next_cursor / order / fields: 與列表相同
+    """
+    limit, order = parse_page_params(params)
+    fields = parse_fields(params)
+
+    terms = {f'tag#{tag}' for tag in map(normalize_tag, (params.get('tags') or '').split(',')) if tag}
+    terms.update(f'title#{term}' for term in tokenize(params.get('q')))
+    if not terms:
+        raise ValueError('q or tags must contain at least one searchable term')
+    if len(terms) > SEARCH_MAX_TERMS:
+        raise ValueError(f'At most {SEARCH_MAX_TERMS} search terms')
+
+    after = None
+    if params.get('next_cursor'):
+        after = decode_cursor(params['next_cursor'], SEARCH_CURSOR_NAME).get('entry')
+        if not isinstance(after, str):
+            raise ValueError('Invalid next_cursor')
+
+    # total 只計算有效的 posting，與實際能回傳的工單數一致
+    with ThreadPoolExecutor(max_workers=SEARCH_INDEX_WORKERS) as executor:
+        matched = match_postings(terms, executor)
+        matched = verify_postings(matched, terms, executor) if matched else matched
+
+    entries = sorted(matched, reverse=order == 'desc')
+    total = len(entries)
+    if after is not None:
+        entries = [entry for entry in entries if (entry < after if order == 'desc' else entry > after)]
+    page = entries[:limit]
+    next_cursor = encode_cursor(SEARCH_CURSOR_NAME, {'entry': page[-1]}) if len(entries) > limit else None
+
+    # 索引還沒移除的工單可能已被刪除 (tombstone)，需要 type 才能判斷
+    ticket_ids = [entry.split('|', 1)[1] for entry in page]
+    found = batch_get_items(ticket_ids, fields + ['type'] if fields and 'type' not in fields else fields)
+    items = [found[ticket_id] for ticket_id in ticket_ids if is_ticket_item(found.get(ticket_id))]
+    if fields and 'type' not in fields:
+        for item in items:
+            item.pop('type', None)
+    return items, next_cursor, total
+
+def parse_upload_files(files):
+    """
+    驗證批次上傳的檔案清單 [{file_name, file_type, size}]，不合法時丟出 ValueError
+    回傳 (安全的檔名, file_type, size) 的 list
+    """
+    if not isinstance(files, list) or not files:
+        raise ValueError('files must be a non-empty list')
+    if len(files) > MAX_UPLOAD_FILES:
+        raise ValueError(f'At most {MAX_UPLOAD_FILES} files per request')
+
+    specs = []
+    for index, spec in enumerate(files):
+        if not isinstance(spec, dict) or not spec.get('file_name') or not spec.get('file_type'):
+            raise ValueError(f'files[{index}]: Missing file_name or file_type')
+        if spec['file_type'] not in ALLOWED_IMAGE_TYPES:
+            raise ValueError(f"files[{index}]: file_type must be one of {', '.join(ALLOWED_IMAGE_TYPES)}")
+        size = spec.get('size')
+        if not isinstance(size, int) or isinstance(size, bool) or not 0 < size <= MAX_UPLOAD_BYTES:
+            raise ValueError(f'files[{index}]: size must be between 1 and {MAX_UPLOAD_BYTES} bytes')
+        # 檔名只保留最後一段，其餘特殊字元換成底線，避免跳出工單的 prefix
+        file_name = re.sub(r'[^\w.\-]', '_', str(spec['file_name']).replace('\\', '/').split('/')[-1]).lstrip('.')
+        specs.append((file_name or 'image', spec['file_type'], size))
+    return specs
+
+# --- 路由 ---
+# 1. 處理 CORS (讓 React 可以呼叫)
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS, PUT, DELETE, PATCH",
+    "Access-Control-Allow-Headers": "Content-Type, Authorization, If-Match, If-None-Match",
+    "Access-Control-Expose-Headers": "ETag, Retry-After"
+}
+
+TICKETS_RESOURCE = '/tickets'
+TICKET_RESOURCE = '/tickets/{id}'
+
+# (method, resource, action) -> handler
+# POST 的 action 來自 body.action；GET 的 action 來自 view 或 since 參數
+ROUTES = {}
+
+def route(method, resource, action=None):
+    """
+    註冊路由的 decorator，同一個 handler 可以疊多個 @route
+    """
+    def decorator(handler):
+        ROUTES[(method, resource, action)] = handler
+        return handler
+    return decorator
+
+class Request:
+    """
+    一次 API 請求解析後的內容，傳給各個 handler
+    """
+    def __init__(self, event, method, resource, body, user_email, is_admin):
+        self.event = event
+        self.method = method
+        self.resource = resource
+        self.body = body
+        self.headers = event.get('headers') or {}
+        self.params = event.get('queryStringParameters') or {}
+        self.path_params = event.get('pathParameters') or {}
+        self.user_email = user_email
+        self.is_admin = is_admin
+
+    def ticket_id(self):
+        # 嘗試從 pathParameters 獲取 ticket_id (如果 API Gateway 有設定 {id})，否則從 Body 讀取
+        return self.path_params.get('id') or self.path_params.get('ticket_id') or self.body.get('ticket_id')
+
+def raw_body(event):
+    """
+    Request Body 字串；Binary Media Types 設為 */* 時 API Gateway 會把所有 body 以 base64 傳進來
+    """
+    body = event.get('body')
+    if body and event.get('isBase64Encoded'):
+        return base64.b64decode(body).decode('utf-8')
+    return body
+
+def parse_body(event, method):
+    """
+    解析 Request Body；NDJSON 匯入時 body 不是單一 JSON，直接視為批次建立
+    """
+    body = raw_body(event)
+    if method == 'POST':
+        content_type = (get_header(event.get('headers'), 'Content-Type') or '').split(';')[0].strip().lower()
+        if content_type in NDJSON_CONTENT_TYPES:
+            return {'action': 'bulk_create_tickets', 'ndjson': body or ''}
+    # 安全地解析 Body，防止 GET / DELETE 請求沒有 Body 時報錯
+    return json.loads(body) if body else {}
+
+def resolve_action(method, body, params):
+    if method == 'POST':
+        return body.get('action')
+    if method == 'GET':
+        if params.get('view'):
+            return params['view']
+        if params.get('since'):
+            return 'since'
+        if params.get('q') or params.get('tags'):
+            return 'search'
+    return None
+
+# === 註冊 (Register) ===
+@route('POST', TICKETS_RESOURCE, 'register')
+def handle_register(req):
+    body = req.body
+    email = body.get('email')
+    password = body.get('password')
+    name = body.get('name', 'User')
+    
+    if not email or not password:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Missing email or password'})}
+    
+    # 密碼強度檢查 (後端雙重驗證)
+    # 必須包含：至少8字元、大寫字母、小寫字母、數字、特殊符號
+    if len(password) < 8:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Password must be at least 8 characters'})}
+
+    if not re.search(r'[A-Z]', password):
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Password must contain at least one uppercase letter'})}
+
+    if not re.search(r'[a-z]', password):
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Password must contain at least one lowercase letter'})}
+
+    if not re.search(r'[0-9]', password):
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Password must contain at least one number'})}
+
+    if not re.search(r'[!@#$%^&*()_+\-=\[\]{};\':"\\|,.<>\/?`~]', password):
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Password must contain at least one symbol (!@#$%^&* etc.)'})}
+
+    user_id = f"USER#{email}"
+    
+    # 檢查是否已存在
+    if get_user_cached(email) is not None:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'User already exists'})}
+    
+    # 密碼雜湊 (Hash)
+    # 使用 SHA-256 + Email 作為簡易 Salt
+    salt = email.lower()
+    hashed_password = hashlib.sha256((password + salt).encode('utf-8')).hexdigest()
+
+    item = {
+        'ticket_id': user_id,
+        'user_email': email, # 統一欄位名稱
+        'password': hashed_password, # 儲存雜湊後的密碼
+        'user_name': name, # 統一欄位名稱
+        'type': 'user',
+        'created_at': datetime.now().isoformat()
+    }
+    try:
+        put_user(item)
+    except ClientError as e:
+        # 同時註冊同一個 email 時，只有第一個條件寫入會成功
+        if e.response['Error']['Code'] not in ('ConditionalCheckFailedException', 'TransactionCanceledException'):
+            raise
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'User already exists'})}
+    return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'message': 'User registered successfully'})}
+
+# === 登入 (Login) ===
+@route('POST', TICKETS_RESOURCE, 'login')
+def handle_login(req):
+    email = req.body.get('email')
+    password = req.body.get('password')
+    
+    user = get_user_cached(email)
+    
+    if user is None:
+        return {'statusCode': 401, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'User not found'})}
+    
+    # 驗證密碼
+    salt = email.lower()
+    hashed_input = hashlib.sha256((password + salt).encode('utf-8')).hexdigest()
+    
+    # 相容性檢查：如果舊密碼是明文 (長度通常較短，SHA256 是 64 字元)，則直接比對
+    # 注意：這只是過渡期邏輯，建議清空舊資料
+    stored_password = user.get('password')
+    
+    if len(stored_password) < 64: # 假設舊密碼是明文
+         if stored_password != password:
+            return {'statusCode': 401, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Invalid password'})}
+    else:
+        if stored_password != hashed_input:
+            return {'statusCode': 401, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Invalid password'})}
+    
+    # 取得使用者資料 (相容舊資料 email/name 與新資料 user_email/user_name)
+    return_email = user.get('user_email', user.get('email'))
+    return_name = user.get('user_name', user.get('name'))
+
+    return {
+        'statusCode': 200, 
+        'headers': CORS_HEADERS, 
+        'body': json.dumps({
+            'message': 'Login successful',
+            'user': {
+                'email': return_email,
+                'name': return_name
+            }
+        })
+    }
+
+# === 取得 S3 上傳 URL (Get Upload URL) ===
+@route('POST', TICKETS_RESOURCE, 'get_upload_url')
+def handle_get_upload_url(req):
+    file_name = req.body.get('file_name')
+    file_type = req.body.get('file_type')
+    
+    if not file_name or not file_type:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Missing file_name or file_type'})}
+    
+    # 產生唯一的檔案名稱 (避免覆蓋)
+    # 格式: tickets/{uuid}/{timestamp}_{filename}
+    unique_id = str(uuid.uuid4())
+    timestamp = int(datetime.now().timestamp())
+    object_key = f"tickets/{unique_id}/{timestamp}_{file_name}"
+    
+    try:
+        # 產生 Pre-signed URL
+        presigned_url = get_s3().generate_presigned_url(
+            'put_object',
+            Params={
+                'Bucket': S3_BUCKET_NAME,
+                'Key': object_key,
+                'ContentType': file_type
+            },
+            ExpiresIn=300 # URL 有效期 5 分鐘
+        )
+        
+        # 回傳上傳 URL 和最終的圖片 URL
+        # 注意：如果 Bucket 不是公開的，讀取時也需要 Pre-signed URL (這裡假設是公開讀取或透過 CloudFront)
+        # 或是之後讀取時再動態產生 GetObject 的 Pre-signed URL
+        image_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{object_key}"
+        
+        return {
+            'statusCode': 200,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({
+                'upload_url': presigned_url,
+                'image_url': image_url,
+                'key': object_key
+            })
+        }
+    except Exception as e:
+        print(f"S3 Presign Error: {e}")
+        return {'statusCode': 500, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Failed to generate upload URL'})}
+
+# === 批次取得 S3 上傳 URL (Get Upload URLs) ===
+# 一次回傳所有檔案的 Presigned POST，同一張工單的圖片都放在 tickets/{ticket_id}/ 底下
+@route('POST', TICKETS_RESOURCE, 'get_upload_urls')
+def handle_get_upload_urls(req):
+    try:
+        specs = parse_upload_files(req.body.get('files'))
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
+
+    # 編輯既有工單時沿用它的 ticket_id，新工單則產生一個 upload_id 讓同一批圖片共用 prefix
+    upload_id = req.body.get('ticket_id') or str(uuid.uuid4())
+    try:
+        upload_id = str(uuid.UUID(upload_id))
+    except (ValueError, TypeError, AttributeError):
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Invalid ticket_id'})}
+    prefix = f"tickets/{upload_id}/"
+    timestamp = int(datetime.now().timestamp())
+
+    try:
+        uploads = []
+        for index, (file_name, file_type, size) in enumerate(specs):
+            object_key = f"{prefix}{timestamp}_{index}_{file_name}"
+            # Policy 限定 Key、Content-Type 與大小，超過宣告的 size 或換類型 S3 會直接拒絕
+            post = get_s3().generate_presigned_post(
+                Bucket=S3_BUCKET_NAME,
+                Key=object_key,
+                Fields={'Content-Type': file_type},
+                Conditions=[
+                    {'Content-Type': file_type},
+                    ['content-length-range', 1, size]
+                ],
+                ExpiresIn=UPLOAD_URL_EXPIRES
+            )
+            uploads.append({
+                'file_name': file_name,
+                'upload_url': post['url'],
+                'fields': post['fields'],
+                'image_url': f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{object_key}",
+                'key': object_key
+            })
+    except Exception as e:
+        print(f"S3 Presign Error: {e}")
+        return {'statusCode': 500, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Failed to generate upload URL'})}
+
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json.dumps({
+            'upload_id': upload_id,
+            'prefix': prefix,
+            'expires_in': UPLOAD_URL_EXPIRES,
+            'uploads': uploads
+        })
+    }
+
+# === 重建統計 (Rebuild Stats) ===
+@route('POST', TICKETS_RESOURCE, 'rebuild_stats')
+def handle_rebuild_stats(req):
+    if not req.is_admin:
+        return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Permission denied: Only Admin can rebuild stats'})}
+    stats = rebuild_stats()
+    return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': to_json({'message': 'Stats rebuilt', 'stats': stats})}
+
+# === 重建搜尋索引 (Rebuild Search Index) ===
+# 功能上線前建立的工單需要執行一次
+@route('POST', TICKETS_RESOURCE, 'rebuild_search_index')
+def handle_rebuild_search_index(req):
+    if not req.is_admin:
+        return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Permission denied: Only Admin can rebuild search index'})}
+    indexed = backfill_search_index()
+    record_change()
+    return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'message': 'Search index rebuilt', 'indexed': indexed})}
+
+# === 批次建立工單 (Bulk Create Tickets) ===
+@route('POST', TICKETS_RESOURCE, 'bulk_create_tickets')
+def handle_bulk_create_tickets(req):
+    if not req.is_admin:
+        return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Permission denied: Only Admin can bulk create tickets'})}
+
+    try:
+        rows = parse_bulk_rows(req.body)
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
+
+    if not rows:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'No tickets to create'})}
+    if len(rows) > MAX_BULK_TICKETS:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': f'At most {MAX_BULK_TICKETS} tickets per request'})}
+
+    # 1. 逐列驗證 (規則與單筆建立相同)
+    results = []
+    items = []
+    for index, data, error in rows:
+        if error is None:
+            try:
+                item = build_ticket_item(data)
+                items.append(item)
+                results.append({'index': index, 'ticket_id': item['ticket_id'], 'status': 'created'})
+                continue
+            except ValueError as e:
+                error = str(e)
+        results.append({'index': index, 'status': 'failed', 'error': error})
+
+    # 2. 工單連同 Outbox 紀錄 (通知由 TicketOutboxRelay 送出) 與 TicketStore 實體以交易寫入
+    failed_writes = transact_put_tickets(items)
+    written = {item['ticket_id']: item for item in items if item['ticket_id'] not in failed_writes}
+    for result in results:
+        if result.get('ticket_id') in failed_writes:
+            result['status'] = 'failed'
+            result['error'] = 'Failed to write ticket'
+        elif result['status'] == 'created':
+            # 有 email 的工單已排入 Outbox
+            result['notified'] = bool(written[result['ticket_id']]['user_email'])
+
+    # 3. 搜尋索引與統計
+    bulk_deltas = Counter()
+    for item in written.values():
+        bulk_deltas.update(stats_deltas(item))
+    # 索引先於 change_version 更新，避免新版本的搜尋快取讀到舊索引
+    update_search_index(added=written.values())
+    record_change(bulk_deltas)
+
+    created = sum(1 for result in results if result['status'] == 'created')
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json.dumps({
+            'message': 'Bulk create finished',
+            'created': created,
+            'failed': len(results) - created,
+            'results': results
+        })
+    }
+
+# === 建立工單 (Create Ticket) ===
+# 預設行為 (無 action 或 action='create_ticket')
+@route('POST', TICKETS_RESOURCE)
+@route('POST', TICKETS_RESOURCE, 'create_ticket')
+def handle_create_ticket(req):
+    try:
+        item = build_ticket_item(req.body)
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
+    ticket_id = item['ticket_id']
+    
+    # 寫入 DynamoDB (搜尋索引與有 email 時通知的 Outbox 紀錄一起寫入，由 TicketOutboxRelay 送到 SQS)
+    put_ticket(item)
+    record_change(stats_deltas(item))
+    
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json.dumps({'message': 'Success', 'ticket_id': ticket_id})
+    }
+
+# === 單筆工單 (GET /tickets/{id}) ===
+# ETag 就是工單的 version，可直接拿來當 PUT/DELETE 的 If-Match
+@route('GET', TICKET_RESOURCE)
+def handle_get_ticket(req):
+    item = get_ticket_cached(req.ticket_id())
+    if item is None or item.get('archived'):
+        # 不在 TicketTable (或只剩封存留下的刪除紀錄) 時查 S3 封存 (已封存的工單只能讀取)
+        item = get_archived_ticket(req.ticket_id(), archived=item is not None)
+    if not is_ticket_item(item):
+        return {'statusCode': 404, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Ticket not found'})}
+    return build_get_response(req.event, CORS_HEADERS, item, f'"{int(item.get("version", 0))}"')
+
+# === 快取命中率 (GET /tickets?view=cache_stats，Admin only) ===
+# 只反映目前這個 Lambda Container 的快取
+@route('GET', TICKETS_RESOURCE, 'cache_stats')
+def handle_cache_stats(req):
+    if not req.is_admin:
+        return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Permission denied: Only Admin can view cache stats'})}
+    return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps(cache_metrics())}
+
+# === 統計資訊 (GET /tickets?view=stats) ===
+# 直接讀取計數器分片並加總，成本固定一次 BatchGetItem，與資料量無關
+@route('GET', TICKETS_RESOURCE, 'stats')
+def handle_stats(req):
+    stats_item = read_stats()
+    etag = list_etag(stats_item.get('change_version', 0), req.params)
+    return build_get_response(req.event, CORS_HEADERS, format_stats(stats_item), etag)
+
+# === 差異同步 (GET /tickets?since=<watermark>) ===
+# 只回傳 watermark 之後異動與刪除的工單
+@route('GET', TICKETS_RESOURCE, 'since')
+def handle_sync(req):
+    since = req.params['since']
+    try:
+        datetime.fromisoformat(since)
+    except ValueError:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'since must be an ISO 8601 timestamp'})}
+
+    # 超過刪除紀錄保留期限，無法保證差異正確，請前端重新載入完整列表
+    oldest = (datetime.now() - timedelta(seconds=TOMBSTONE_TTL_SECONDS)).isoformat()
+    if since < oldest:
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'full_resync': True})}
+
+    try:
+        fields = parse_fields(req.params)
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
+
+    changed, deleted, watermark, has_more = query_changes(since, fields)
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': to_json({
+            'changed': changed,
+            'deleted': deleted,
+            'watermark': watermark,
+            'has_more': has_more
+        })
+    }
+
+# === 搜尋工單 (GET /tickets?q=&tags=) ===
+# 以倒排索引取交集，不需要讀整張表
+@route('GET', TICKETS_RESOURCE, 'search')
+def handle_search(req):
+    change_version = get_change_version()
+    etag = list_etag(change_version, req.params)
+    if etag_matches(req.headers, etag):
+        return build_get_response(req.event, CORS_HEADERS, None, etag)
+
+    try:
+        items, next_cursor, total = query_tickets_cached(req.params, change_version, search_tickets)
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
+
+    return build_get_response(req.event, CORS_HEADERS, {
+        'count': len(items),
+        'total': total,
+        'items': items,
+        'next_cursor': next_cursor
+    }, etag)
+
+# === 查詢工單列表 (GET /tickets) ===
+@route('GET', TICKETS_RESOURCE)
+def handle_list_tickets(req):
+    # 資料沒有異動時直接回傳 304，省下 Query 與傳輸
+    change_version = get_change_version()
+    etag = list_etag(change_version, req.params)
+    if etag_matches(req.headers, etag):
+        return build_get_response(req.event, CORS_HEADERS, None, etag)
+
+    # 透過 GSI 分頁查詢，不再 Scan 整張表 (同一個 Container 內相同查詢直接用快取)
+    try:
+        items, next_cursor = query_tickets_cached(req.params, change_version)
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
+    
+    # 標準化回應格式
+    return build_get_response(req.event, CORS_HEADERS, {
+        'count': len(items),
+        'items': items,
+        'next_cursor': next_cursor
+    }, etag)
+
+# === 更新工單 (PUT/PATCH) ===
+# 假設路徑是 /tickets/123，但 API Gateway 可能沒設好 Proxy，也支援從 Body 讀取 ticket_id
+@route('PUT', TICKETS_RESOURCE)
+@route('PUT', TICKET_RESOURCE)
+@route('PATCH', TICKETS_RESOURCE)
+@route('PATCH', TICKET_RESOURCE)
+def handle_update_ticket(req):
+    body = req.body
+    user_email = req.user_email
+    is_admin = req.is_admin
+    ticket_id = req.ticket_id()
     
-    # 1. 處理 CORS (讓 React 可以呼叫)
-    headers = {
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "GET, POST, OPTIONS, PUT, DELETE, PATCH",
-        "Access-Control-Allow-Headers": "Content-Type, Authorization"
+    if not ticket_id:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Missing ticket_id'})}
+
+    # 更新欄位
+    new_status = body.get('status')
+    new_title = body.get('title')
+    new_description = body.get('description')
+    new_images = body.get('images')
+    new_priority = body.get('priority')
+    new_tags = body.get('tags')
+
+    # Title 字數限制 (最多 100 字元)
+    if new_title is not None and len(new_title) > 100:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Title must be 100 characters or less'})}
+
+    # Priority 驗證
+    if new_priority is not None and new_priority not in ['Low', 'Medium', 'High']:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Invalid priority level'})}
+
+    try:
+        expected_version = parse_expected_version(req.headers, body)
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
+
+    # 權限檢查
+    # - 只有 Admin 可以修改 status (只看 Token，不用查資料庫)
+    # - Admin 或 Owner 可以修改 title、description、images、priority、tags
+    #   Owner 比對放進 ConditionExpression，由 DynamoDB 在寫入時一起檢查
+    if new_status and not is_admin:
+        return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Permission denied: Only Admin can update status'})}
+
+    content_forbidden = 'Permission denied: Only Admin or Owner can edit ticket content'
+    edits_content = new_title is not None or new_description is not None or new_images is not None or new_priority is not None or new_tags is not None
+    require_owner = edits_content and not is_admin
+    if require_owner and not user_email:
+        return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': content_forbidden})}
+
+    # 構建更新表達式
+    update_expressions = []
+    expression_attribute_names = {}
+    expression_attribute_values = {}
+
+    if new_status:
+        update_expressions.append('#s = :s')
+        expression_attribute_names['#s'] = 'status'
+        expression_attribute_values[':s'] = new_status
+
+    if new_title is not None:
+        update_expressions.append('#t = :t')
+        expression_attribute_names['#t'] = 'title'
+        expression_attribute_values[':t'] = new_title
+
+    if new_description is not None:
+        update_expressions.append('#d = :d')
+        expression_attribute_names['#d'] = 'description'
+        expression_attribute_values[':d'] = new_description
+
+    if new_images is not None:
+        update_expressions.append('#i = :i')
+        expression_attribute_names['#i'] = 'images'
+        expression_attribute_values[':i'] = new_images
+        image_keys, thumbnails = describe_images(new_images)
+        update_expressions.append('#ik = :ik')
+        expression_attribute_names['#ik'] = 'image_keys'
+        expression_attribute_values[':ik'] = image_keys
+        update_expressions.append('#th = :th')
+        expression_attribute_names['#th'] = 'thumbnails'
+        expression_attribute_values[':th'] = thumbnails
+
+    if new_priority is not None:
+        update_expressions.append('#p = :p')
+        expression_attribute_names['#p'] = 'priority'
+        expression_attribute_values[':p'] = new_priority
+
+    if new_tags is not None:
+        update_expressions.append('#tags = :tags')
+        expression_attribute_names['#tags'] = 'tags'
+        expression_attribute_values[':tags'] = new_tags
+
+    if not update_expressions:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'No fields to update'})}
+
+    update_expressions.append('#u = :u')
+    expression_attribute_names['#u'] = 'updated_at'
+    expression_attribute_values[':u'] = datetime.now().isoformat()
+    # 這次寫入的欄位 {屬性名稱: 新值}，用來組出更新後的工單
+    changes = {
+        expression_attribute_names[name]: expression_attribute_values[value]
+        for name, value in (expression.split(' = ') for expression in update_expressions)
+    }
+
+    condition, condition_names, condition_values = build_mutation_condition(user_email, require_owner, expected_version)
+    expression_attribute_names.update(condition_names)
+    expression_attribute_values.update(condition_values)
+    # 版本號 +1 (舊資料沒有 version 時 ADD 會從 0 開始)
+    expression_attribute_names['#v'] = 'version'
+    expression_attribute_values[':one'] = 1
+
+    update_kwargs = {
+        'Key': {'ticket_id': ticket_id},
+        'UpdateExpression': "set " + ", ".join(update_expressions) + " add #v :one",
+        'ConditionExpression': condition,
+        'ExpressionAttributeNames': expression_attribute_names,
+        'ExpressionAttributeValues': expression_attribute_values
     }
+
+    def build_actions(current):
+        actions = [{'Update': dict(update_kwargs, TableName=TABLE_NAME)}]
+        if current is None and '#' not in ticket_id:
+            # 不需要舊資料：TicketStore 以相同的 SET / ADD 更新，狀態改變時一併更新 GSI2PK
+            # 由 TicketTable 的條件把關；TicketStore 沒有這張工單時條件不符，改走讀取後寫入完整實體
+            store_names = {'#v': 'version'}
+            store_values = {':one': 1}
+            for name, value in (expression.split(' = ') for expression in update_expressions):
+                store_names[name] = expression_attribute_names[name]
+                store_values[value] = expression_attribute_values[value]
+            store_update = "set " + ", ".join(update_expressions)
+            if new_status:
+                store_update += ", GSI2PK = :gsi2"
+                store_values[':gsi2'] = f"STATUS#{new_status}"
+            actions.append({'Update': {
+                'TableName': STORE_TABLE_NAME,
+                'Key': {'PK': f"TICKET#{ticket_id}", 'SK': TICKET_SK},
+                'UpdateExpression': store_update + " add #v :one",
+                'ConditionExpression': 'attribute_exists(PK)',
+                'ExpressionAttributeNames': store_names,
+                'ExpressionAttributeValues': store_values
+            }})
+        elif is_ticket_item(current):
+            # TicketStore 寫入更新後的完整工單
+            new_entity = ticket_entity(dict(current, **changes, version=int(current.get('version', 0)) + 1))
+            actions.append({'Put': {'TableName': STORE_TABLE_NAME, 'Item': new_entity}})
+        return actions
+
+    # 狀態、優先度、標籤與標題會影響統計與搜尋索引，需要舊資料；回傳的新版本也要知道舊版本
+    # 只改內容、圖片且帶了 If-Match (或 expected_version) 時不用先讀取
+    needs_old_item = bool(new_status) or new_priority is not None or new_tags is not None or new_title is not None or expected_version is None
+
+    try:
+        if DATA_MODEL == 'legacy':
+            old_item = get_table().update_item(
+                ReturnValues="ALL_OLD",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                **update_kwargs
+            )['Attributes']
+        else:
+            old_item = write_ticket_with_store(ticket_id, build_actions, read_current=needs_old_item)
+            if old_item is None and not needs_old_item:
+                # 沒有讀取舊資料，版本由 If-Match 得知，統計與搜尋索引不受影響
+                ticket_cache.invalidate(ticket_id)
+                record_change()
+                new_version = expected_version + 1
+                return {'statusCode': 200, 'headers': dict(CORS_HEADERS, ETag=f'"{new_version}"'), 'body': json.dumps({'message': 'Updated', 'version': new_version})}
+    except ClientError as e:
+        if not is_condition_failure(e):
+            raise
+        status_code, error_body = explain_condition_failure(e, user_email, require_owner, content_forbidden)
+        return {'statusCode': status_code, 'headers': CORS_HEADERS, 'body': json.dumps(error_body)}
+
+    new_version = int(old_item.get('version', 0)) + 1
+    ticket_cache.invalidate(ticket_id)
+
+    # 狀態、優先度或標籤有變動時同步調整統計 (change_version 一律 +1)
+    deltas = Counter()
+    if is_ticket_item(old_item):
+        new_item = dict(old_item, **changes, version=new_version)
+        deltas.update(stats_deltas(new_item))
+        deltas.update(stats_deltas(old_item, -1))
+        # 標題或標籤有變動時同步調整搜尋索引 (只寫入有差異的詞)
+        if new_title is not None or new_tags is not None:
+            update_search_index(added=[new_item], removed=[old_item])
+    record_change(deltas)
+
+    return {'statusCode': 200, 'headers': dict(CORS_HEADERS, ETag=f'"{new_version}"'), 'body': json.dumps({'message': 'Updated', 'version': new_version})}
+
+# === 刪除工單 (DELETE) ===
+@route('DELETE', TICKETS_RESOURCE)
+@route('DELETE', TICKET_RESOURCE)
+def handle_delete_ticket(req):
+    user_email = req.user_email
+    ticket_id = req.ticket_id()
     
+    if not ticket_id:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Missing ticket_id'})}
+
+    # 權限檢查：Admin 或 Owner 才能刪除
+    # Owner 比對與版本檢查都放進 ConditionExpression，一次寫入完成
+    delete_forbidden = 'Permission denied: Only Admin or Owner can delete'
+    require_owner = not req.is_admin
+    if require_owner and not user_email:
+        return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': delete_forbidden})}
+
+    try:
+        expected_version = parse_expected_version(req.headers, req.body)
+    except ValueError as e:
+        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
+
+    try:
+        condition, condition_names, condition_values = build_mutation_condition(user_email, require_owner, expected_version)
+        delete_kwargs = {
+            'ConditionExpression': condition,
+            'ExpressionAttributeNames': condition_names,
+            'ExpressionAttributeValues': condition_values,
+            'ReturnValues': 'ALL_OLD',
+            'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+        }
+
+        ticket_cache.invalidate(ticket_id)
+        if ticket_id.startswith('USER#') and DATA_MODEL != 'legacy':
+            email = ticket_id[len('USER#'):]
+            user_cache.invalidate(email)
+            deleted = delete_store_user(email, user_email, require_owner)
+            if DATA_MODEL == 'store':
+                # store 模式下 TicketTable 已經沒有使用者資料
+                if not deleted:
+                    return {'statusCode': 404, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'User not found or permission denied'})}
+                return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'message': 'Deleted'})}
+
+        if '#' in ticket_id:
+            # USER# 等系統項目直接刪除，不留刪除紀錄
+            response = get_table().delete_item(Key={'ticket_id': ticket_id}, **delete_kwargs)
+            if ticket_id.startswith('USER#'):
+                user_cache.invalidate(ticket_id[len('USER#'):])
+        elif DATA_MODEL == 'legacy':
+            # 工單以刪除紀錄 (tombstone) 覆蓋，讓差異同步的前端也能得知
+            response = get_table().put_item(Item=build_tombstone(ticket_id, datetime.now().isoformat()), **delete_kwargs)
+        else:
+            # TicketStore 的工單實體同時換成刪除紀錄
+            timestamp = datetime.now().isoformat()
+            def build_actions(current):
+                put = {'TableName': TABLE_NAME, 'Item': build_tombstone(ticket_id, timestamp), 'ConditionExpression': condition,
+                       'ExpressionAttributeNames': condition_names, 'ExpressionAttributeValues': condition_values}
+                actions = [{'Put': put}]
+                if is_ticket_item(current):
+                    actions.append({'Put': {'TableName': STORE_TABLE_NAME, 'Item': store_tombstone(current, timestamp)}})
+                return actions
+            response = {'Attributes': write_ticket_with_store(ticket_id, build_actions)}
+        if is_ticket_item(response.get('Attributes')):
+            update_search_index(removed=[response['Attributes']])
+            record_change(stats_deltas(response['Attributes'], -1))
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'message': 'Deleted'})}
+    except ClientError as e:
+        if is_condition_failure(e):
+            status_code, error_body = explain_condition_failure(e, user_email, require_owner, delete_forbidden)
+            return {'statusCode': status_code, 'headers': CORS_HEADERS, 'body': json.dumps(error_body)}
+        print(f"Delete error: {str(e)}") # 建議把錯誤印出來，去 CloudWatch 比較好查
+        return {'statusCode': 500, 'headers': CORS_HEADERS, 'body': json.dumps({'error': f'Delete failed: {str(e)}'})}
+    except Exception as e:
+        print(f"Delete error: {str(e)}") # 建議把錯誤印出來，去 CloudWatch 比較好查
+        return {'statusCode': 500, 'headers': CORS_HEADERS, 'body': json.dumps({'error': f'Delete failed: {str(e)}'})}
+
+def dispatch(event):
     # 如果是 OPTIONS 預檢請求，直接回傳 200
     if event.get('httpMethod') == 'OPTIONS':
-        return {'statusCode': 200, 'headers': headers, 'body': ''}
+        set_route('options')
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
     method = event.get('httpMethod')
-    path = event.get('path')
     
     # 解析使用者身分
     user_claims = get_user_claims(event.get('headers', {}))
@@ -80,372 +2476,48 @@ def lambda_handler(event, context):
         user_groups = raw_groups
         
     is_admin = 'Admin' in user_groups
-    
-    print(f"User: {user_email}, Groups: {user_groups}, IsAdmin: {is_admin}")
 
     try:
-        # --- Create (POST) ---
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-
-            # === 註冊 (Register) ===
-            if action == 'register':
-                email = body.get('email')
-                password = body.get('password')
-                name = body.get('name', 'User')
-                
-                if not email or not password:
-                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing email or password'})}
-                
-                # 密碼強度檢查 (後端雙重驗證)
-                # 必須包含：至少8字元、大寫字母、小寫字母、數字、特殊符號
-                if len(password) < 8:
-                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Password must be at least 8 characters'})}
-
-                if not re.search(r'[A-Z]', password):
-                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Password must contain at least one uppercase letter'})}
-
-                if not re.search(r'[a-z]', password):
-                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Password must contain at least one lowercase letter'})}
-
-                if not re.search(r'[0-9]', password):
-                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Password must contain at least one number'})}
-
-                if not re.search(r'[!@#$%^&*()_+\-=\[\]{};\':"\\|,.<>\/?`~]', password):
-                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Password must contain at least one symbol (!@#$%^&* etc.)'})}
-
-                user_id = f"USER#{email}"
-                
-                # 檢查是否已存在
-                existing = table.get_item(Key={'ticket_id': user_id})
-                if 'Item' in existing:
-                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'User already exists'})}
-                
-                # 密碼雜湊 (Hash)
-                # 使用 SHA-256 + Email 作為簡易 Salt
-                salt = email.lower()
-                hashed_password = hashlib.sha256((password + salt).encode('utf-8')).hexdigest()
-
-                item = {
-                    'ticket_id': user_id,
-                    'user_email': email, # 統一欄位名稱
-                    'password': hashed_password, # 儲存雜湊後的密碼
-                    'user_name': name, # 統一欄位名稱
-                    'type': 'user',
-                    'created_at': datetime.now().isoformat()
-                }
-                table.put_item(Item=item)
-                return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'message': 'User registered successfully'})}
-
-            # === 登入 (Login) ===
-            elif action == 'login':
-                email = body.get('email')
-                password = body.get('password')
-                
-                user_id = f"USER#{email}"
-                response = table.get_item(Key={'ticket_id': user_id})
-                
-                if 'Item' not in response:
-                    return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'User not found'})}
-                
-                user = response['Item']
-                
-                # 驗證密碼
-                salt = email.lower()
-                hashed_input = hashlib.sha256((password + salt).encode('utf-8')).hexdigest()
-                
-                # 相容性檢查：如果舊密碼是明文 (長度通常較短，SHA256 是 64 字元)，則直接比對
-                # 注意：這只是過渡期邏輯，建議清空舊資料
-                stored_password = user.get('password')
-                
-                if len(stored_password) < 64: # 假設舊密碼是明文
-                     if stored_password != password:
-                        return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Invalid password'})}
-                else:
-                    if stored_password != hashed_input:
-                        return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Invalid password'})}
-                
-                # 取得使用者資料 (相容舊資料 email/name 與新資料 user_email/user_name)
-                return_email = user.get('user_email', user.get('email'))
-                return_name = user.get('user_name', user.get('name'))
-
-                return {
-                    'statusCode': 200, 
-                    'headers': headers, 
-                    'body': json.dumps({
-                        'message': 'Login successful',
-                        'user': {
-                            'email': return_email,
-                            'name': return_name
-                        }
-                    })
-                }
-
-            # === 取得 S3 上傳 URL (Get Upload URL) ===
-            elif action == 'get_upload_url':
-                file_name = body.get('file_name')
-                file_type = body.get('file_type')
-                
-                if not file_name or not file_type:
-                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing file_name or file_type'})}
-                
-                # 產生唯一的檔案名稱 (避免覆蓋)
-                # 格式: tickets/{uuid}/{timestamp}_{filename}
-                unique_id = str(uuid.uuid4())
-                timestamp = int(datetime.now().timestamp())
-                object_key = f"tickets/{unique_id}/{timestamp}_{file_name}"
-                
-                try:
-                    # 產生 Pre-signed URL
-                    presigned_url = s3.generate_presigned_url(
-                        'put_object',
-                        Params={
-                            'Bucket': S3_BUCKET_NAME,
-                            'Key': object_key,
-                            'ContentType': file_type
-                        },
-                        ExpiresIn=300 # URL 有效期 5 分鐘
-                    )
-                    
-                    # 回傳上傳 URL 和最終的圖片 URL
-                    # 注意：如果 Bucket 不是公開的，讀取時也需要 Pre-signed URL (這裡假設是公開讀取或透過 CloudFront)
-                    # 或是之後讀取時再動態產生 GetObject 的 Pre-signed URL
-                    image_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{object_key}"
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': headers,
-                        'body': json.dumps({
-                            'upload_url': presigned_url,
-                            'image_url': image_url,
-                            'key': object_key
-                        })
-                    }
-                except Exception as e:
-                    print(f"S3 Presign Error: {e}")
-                    return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': 'Failed to generate upload URL'})}
-
-            # === 建立工單 (Create Ticket) ===
-            # 預設行為 (無 action 或 action='create_ticket')
-
-            # 取得並驗證 title
-            title = body.get('title', 'No Title')
-            if not title:
-                title = 'No Title'
-
-            # Title 字數限制 (最多 100 字元)
-            if len(title) > 100:
-                return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Title must be 100 characters or less'})}
-
-            ticket_id = str(uuid.uuid4())
-            timestamp = datetime.now().isoformat()
-            
-            item = {
-                'ticket_id': ticket_id,
-                'title': title,
-                'description': body.get('description', ''),
-                'priority': body.get('priority', 'Low'),
-                'status': 'Open',
-                'created_at': timestamp,
-                'user_email': body.get('user_email', ''), # 用來通知
-                'user_name': body.get('user_name', ''), # 顯示用
-                'images': body.get('images', []), # 儲存圖片 URL
-                'tags': body.get('tags', []), # 分類標籤
-                'type': 'ticket' # 標記為工單
-            }
-            
-            # 寫入 DynamoDB
-            table.put_item(Item=item)
-            
-            # 發送訊息到 SQS (加分項)
-            if item['user_email']:
-                msg_body = {
-                    'ticket_id': ticket_id,
-                    'title': item['title'],
-                    'email': item['user_email'],
-                    'type': 'TICKET_CREATED'
-                }
-                try:
-                    sqs.send_message(
-                        QueueUrl=SQS_QUEUE_URL,
-                        MessageBody=json.dumps(msg_body)
-                    )
-                except Exception as e:
-                    print(f"SQS Error: {e}")
-            
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({'message': 'Success', 'ticket_id': ticket_id})
-            }
-
-        # --- Read All (GET) ---
-        elif method == 'GET':
-            # 這裡簡化直接 Scan (正式環境通常不建議，但作業可接受)
-            response = table.scan()
-            all_items = response.get('Items', [])
-            
-            # 過濾掉使用者資料 (只回傳工單)
-            # 判斷標準：ticket_id 不以 USER# 開頭，或者 type == 'ticket' (舊資料可能沒 type，所以用 USER# 判斷較準)
-            items = [i for i in all_items if not i.get('ticket_id', '').startswith('USER#')]
-            
-            # 標準化回應格式
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({
-                    'count': len(items),
-                    'items': items
-                }, cls=DecimalEncoder)
-            }
-            
-        # --- Update (PUT/PATCH) ---
-        elif method == 'PUT' or method == 'PATCH':
-            # 假設路徑是 /tickets/123，但 API Gateway 可能沒設好 Proxy
-            # 我們支援從 Body 讀取 ticket_id
-            body = json.loads(event.get('body', '{}'))
-            
-            # 嘗試從 pathParameters 獲取 ticket_id (如果 API Gateway 有設定 {id})
-            path_params = event.get('pathParameters')
-            ticket_id = None
-            if path_params:
-                # 嘗試抓 id 或 ticket_id，看你在 API Gateway 怎麼命名的
-                ticket_id = path_params.get('id') or path_params.get('ticket_id')
-
-            if not ticket_id:
-                ticket_id = body.get('ticket_id')
-            
-            if not ticket_id:
-                return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing ticket_id'})}
-
-            # 取得現有的 ticket 資料以檢查權限
-            try:
-                response = table.get_item(Key={'ticket_id': ticket_id})
-                item = response.get('Item')
+        body = parse_body(event, method)
+        path_params = event.get('pathParameters') or {}
+        resource = TICKET_RESOURCE if (path_params.get('id') or path_params.get('ticket_id')) else TICKETS_RESOURCE
+        action = resolve_action(method, body, event.get('queryStringParameters') or {})
 
-                if not item:
-                    return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Ticket not found'})}
+        # 找不到對應 action 時退回該 method + resource 的預設 handler (例如 POST 沒有 action 就是建立工單)
+        handler = ROUTES.get((method, resource, action)) or ROUTES.get((method, resource, None))
+        if handler is None:
+            set_route('not_found')
+            return {'statusCode': 404, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Not Found'})}
 
-                owner_email = item.get('user_email')
-                is_owner = user_email and (user_email == owner_email)
-            except Exception as e:
-                print(f"Get ticket error: {str(e)}")
-                return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': f'Failed to get ticket: {str(e)}'})}
-
-            # 更新欄位
-            new_status = body.get('status')
-            new_title = body.get('title')
-            new_description = body.get('description')
-            new_images = body.get('images')
-            new_priority = body.get('priority')
-            new_tags = body.get('tags')
-
-            # Title 字數限制 (最多 100 字元)
-            if new_title is not None and len(new_title) > 100:
-                return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Title must be 100 characters or less'})}
-
-            # Priority 驗證
-            if new_priority is not None and new_priority not in ['Low', 'Medium', 'High']:
-                return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Invalid priority level'})}
-
-            # 權限檢查
-            # - 只有 Admin 可以修改 status
-            # - Admin 或 Owner 可以修改 title、description、images、priority、tags
-            if new_status and not is_admin:
-                return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Permission denied: Only Admin can update status'})}
-
-            if (new_title is not None or new_description is not None or new_images is not None or new_priority is not None or new_tags is not None) and not (is_admin or is_owner):
-                return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Permission denied: Only Admin or Owner can edit ticket content'})}
-
-            # 構建更新表達式
-            update_expressions = []
-            expression_attribute_names = {}
-            expression_attribute_values = {}
-
-            if new_status:
-                update_expressions.append('#s = :s')
-                expression_attribute_names['#s'] = 'status'
-                expression_attribute_values[':s'] = new_status
-
-            if new_title is not None:
-                update_expressions.append('#t = :t')
-                expression_attribute_names['#t'] = 'title'
-                expression_attribute_values[':t'] = new_title
-
-            if new_description is not None:
-                update_expressions.append('#d = :d')
-                expression_attribute_names['#d'] = 'description'
-                expression_attribute_values[':d'] = new_description
-
-            if new_images is not None:
-                update_expressions.append('#i = :i')
-                expression_attribute_names['#i'] = 'images'
-                expression_attribute_values[':i'] = new_images
-
-            if new_priority is not None:
-                update_expressions.append('#p = :p')
-                expression_attribute_names['#p'] = 'priority'
-                expression_attribute_values[':p'] = new_priority
-
-            if new_tags is not None:
-                update_expressions.append('#tags = :tags')
-                expression_attribute_names['#tags'] = 'tags'
-                expression_attribute_values[':tags'] = new_tags
-
-            if update_expressions:
-                table.update_item(
-                    Key={'ticket_id': ticket_id},
-                    UpdateExpression="set " + ", ".join(update_expressions),
-                    ExpressionAttributeNames=expression_attribute_names,
-                    ExpressionAttributeValues=expression_attribute_values,
-                    ReturnValues="UPDATED_NEW"
-                )
-                return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'message': 'Updated'})}
-            else:
-                return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'No fields to update'})}
-
-        # --- Delete (DELETE) ---
-        elif method == 'DELETE':
-            # [修正 1] 安全地解析 Body，防止 DELETE 請求沒有 Body 時報錯
-            raw_body = event.get('body')
-            body = json.loads(raw_body) if raw_body else {}
-            
-            # 嘗試從 pathParameters 獲取 ticket_id
-            path_params = event.get('pathParameters')
-            ticket_id = path_params.get('id') if path_params else body.get('ticket_id')
-            
-            if ticket_id:
-                # 權限檢查：Admin 或 Owner 才能刪除
-                try:
-                    response = table.get_item(Key={'ticket_id': ticket_id})
-                    item = response.get('Item')
-                    
-                    if not item:
-                        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Ticket not found'})}
-                    
-                    # [修正 2] 確保變數存在，防止 None 比較錯誤
-                    owner_email = item.get('user_email')
-                    # 這裡的 user_email 來自最上面的 JWT 解析
-                    is_owner = user_email and (user_email == owner_email)
-                    
-                    if not (is_admin or is_owner):
-                        return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Permission denied: Only Admin or Owner can delete'})}
-                        
-                    table.delete_item(Key={'ticket_id': ticket_id})
-                    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'message': 'Deleted'})}
-                except Exception as e:
-                    print(f"Delete error: {str(e)}") # 建議把錯誤印出來，去 CloudWatch 比較好查
-                    return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': f'Delete failed: {str(e)}'})}
-            else:
-                return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Missing ticket_id'})}
+        # 指標的 Route 維度用 handler 名稱 (數量固定，不會因為參數不同而暴增)
+        set_route(handler.__name__[len('handle_'):])
+        return handler(Request(event, method, resource, body, user_email, is_admin))
 
     except Exception as e:
-        print(f"Error: {str(e)}")
+        print(f"Error: {type(e).__name__}: {str(e)}")
         return {
             'statusCode': 500,
-            'headers': headers,
+            'headers': CORS_HEADERS,
             'body': json.dumps({'error': str(e)})
         }
-    
-    return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Not Found'})}
\ No newline at end of file
+
+def too_many_requests():
+    # 節流且退避預算用完：請前端稍後重試，不回傳原始錯誤訊息
+    headers = dict(CORS_HEADERS, **{'Retry-After': str(retry_after())})
+    return {'statusCode': 429, 'headers': headers, 'body': json.dumps({'error': 'Too many requests, please retry later'})}
+
+def lambda_handler(event, context):
+    # 完整 event 只取樣記錄並遮蔽 Token、密碼與圖片 (EVENT_LOG_SAMPLE_RATE)，每個請求結束時輸出一行 EMF 指標
+    start_request()
+    budget = start_budget()
+    log_event(event)
+    response = dispatch(event)
+    # 各 handler 自己攔下的例外也會回 5xx，以預算記錄的節流判斷是否改回 429
+    if response['statusCode'] >= 500 and budget['exhausted']:
+        response = too_many_requests()
+    if response['statusCode'] >= 500:
+        log_event(event, force=True)
+    # 回傳前寫入這個請求的統計異動：回傳後 Container 可能被凍結或回收，其他 Container 也看不到尚未寫入的 change_version
+    flush_counters()
+    finish_request(StatusCode=response['statusCode'])
+    return response
@@ -0,0 +1,212 @@
+import gzip
+import json
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from botocore.exceptions import ClientError
+from TicketTelemetry import start_request, finish_request
+# 與 TicketAPIHandler 打包在同一個 Lambda，共用設定、統計、搜尋索引與封存讀取的格式
+from TicketAPIHandler import (
+    S3_BUCKET_NAME, TABLE_NAME, STORE_TABLE_NAME, DATA_MODEL, STATUS_INDEX_NAME, ARCHIVE_PREFIX,
+    archive_shard_key, load_archive_shard, get_dynamodb, get_table, get_s3, is_ticket_item, is_condition_failure,
+    build_tombstone, store_tombstone, stats_deltas, record_change, flush_counters, update_search_index, to_json
+)
+# --- 設定區 ---
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '180')) # Closed 且超過幾天沒有異動才封存
+ARCHIVE_MAX_TICKETS = int(os.environ.get('ARCHIVE_MAX_TICKETS', '20000')) # 單次執行最多封存筆數，其餘留給下次
+ARCHIVE_BLOCK_SIZE = 100       # 每個 gzip 區塊的工單數 (讀取單筆時只下載一個區塊)
+ARCHIVE_SEGMENT_SIZE = 5000    # 每個 Segment 最多工單數
+DELETE_BATCH_SIZE = 25         # 每次 TransactWriteItems 條件覆蓋的筆數
+MIN_REMAINING_MS = 60000       # Lambda 剩餘時間低於這個值就停止讀取新的工單
+# ------------
+
+def find_archivable(cutoff, limit, context=None):
+    """
+    透過 status index 找出 Closed、created_at 與 updated_at 都早於 cutoff 的工單
+    (updated_at 一定晚於 created_at，所以 created_at 放在 KeyCondition 就能少讀)
+    """
+    from boto3.dynamodb.conditions import Key, Attr
+
+    query_kwargs = {
+        'IndexName': STATUS_INDEX_NAME,
+        'KeyConditionExpression': Key('status').eq('Closed') & Key('created_at').lt(cutoff),
+        'FilterExpression': Attr('updated_at').lt(cutoff) | Attr('updated_at').not_exists()
+    }
+    items = []
+    while len(items) < limit:
+        response = get_table().query(**query_kwargs)
+        items.extend(item for item in response.get('Items', []) if is_ticket_item(item))
+        if 'LastEvaluatedKey' not in response:
+            break
+        if context is not None and context.get_remaining_time_in_millis() < MIN_REMAINING_MS:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return items[:limit]
+
+def build_segment(items):
+    """
+    把工單寫成多個 gzip 區塊串接的 NDJSON (整個檔案仍可直接 gunzip)
+    回傳 (segment bytes, 區塊 [[offset, length]], {ticket_id: 區塊編號})
+    """
+    parts = []
+    blocks = []
+    tickets = {}
+    offset = 0
+    for start in range(0, len(items), ARCHIVE_BLOCK_SIZE):
+        chunk = items[start:start + ARCHIVE_BLOCK_SIZE]
+        data = gzip.compress(''.join(to_json(item) + '\n' for item in chunk).encode('utf-8'))
+        for item in chunk:
+            tickets[item['ticket_id']] = len(blocks)
+        blocks.append([offset, len(data)])
+        parts.append(data)
+        offset += len(data)
+    return b''.join(parts), blocks, tickets
+
+def write_segments(items, run_id, cutoff):
+    """
+    依 created_at 的年月分區寫入 Segment 與 manifest
+    回傳 {ticket_id: [segment_key, offset, length]} 與每個 Segment 的摘要
+    """
+    partitions = {}
+    for item in sorted(items, key=lambda item: item['created_at']):
+        partitions.setdefault(item['created_at'][:7], []).append(item)
+
+    locations = {}
+    segments = []
+    for month, month_items in partitions.items():
+        year, mm = month.split('-')
+        for number, start in enumerate(range(0, len(month_items), ARCHIVE_SEGMENT_SIZE)):
+            chunk = month_items[start:start + ARCHIVE_SEGMENT_SIZE]
+            segment_key = f"{ARCHIVE_PREFIX}{year}/{mm}/{run_id}-{number:03d}.ndjson.gz"
+            data, blocks, tickets = build_segment(chunk)
+            get_s3().put_object(Bucket=S3_BUCKET_NAME, Key=segment_key, Body=data, ContentType='application/gzip')
+
+            manifest = {
+                'segment': segment_key,
+                'count': len(chunk),
+                'bytes': len(data),
+                'created_from': chunk[0]['created_at'],
+                'created_to': chunk[-1]['created_at'],
+                'cutoff': cutoff,
+                'archived_at': datetime.now().isoformat(),
+                'blocks': blocks,
+                'tickets': tickets
+            }
+            get_s3().put_object(
+                Bucket=S3_BUCKET_NAME,
+                Key=segment_key.replace('.ndjson.gz', '.manifest.json'),
+                Body=json.dumps(manifest).encode('utf-8'),
+                ContentType='application/json'
+            )
+            for ticket_id, block in tickets.items():
+                locations[ticket_id] = [segment_key] + blocks[block]
+            segments.append({'segment': segment_key, 'count': len(chunk), 'bytes': len(data)})
+    return locations, segments
+
+def update_archive_index(locations):
+    """
+    把新封存的位置合併進 S3 的索引分片 (Job 需設定 Reserved Concurrency = 1，避免同時改同一個分片)
+    """
+    shards = {}
+    for ticket_id, location in locations.items():
+        shards.setdefault(archive_shard_key(ticket_id), {})[ticket_id] = location
+    for shard_key, entries in shards.items():
+        shard = load_archive_shard(shard_key)
+        shard.update(entries)
+        get_s3().put_object(
+            Bucket=S3_BUCKET_NAME,
+            Key=shard_key,
+            Body=json.dumps(shard, separators=(',', ':')).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+def delete_condition(item):
+    """
+    只刪除讀取後沒有再被修改的工單 (仍是 Closed 且 version 相同)
+    """
+    if 'version' in item:
+        return '#s = :closed AND #v = :v', {':closed': 'Closed', ':v': item['version']}
+    return '#s = :closed AND attribute_not_exists(#v)', {':closed': 'Closed'}
+
+def delete_archived(items):
+    """
+    與 API 刪除相同，以 archived 的刪除紀錄 (tombstone) 條件覆蓋工單，差異同步的前端也會移除這些工單
+    DATA_MODEL 不是 legacy 時，TicketStore 的工單實體在同一個交易換成刪除紀錄
+    以 TransactWriteItems 每 25 筆寫入；有任何一筆條件不符時整批取消，改成逐筆寫入
+    回傳實際刪除的工單
+    """
+    deleted = []
+    client = get_dynamodb().meta.client
+    for start in range(0, len(items), DELETE_BATCH_SIZE):
+        chunk = items[start:start + DELETE_BATCH_SIZE]
+        timestamp = datetime.now().isoformat()
+        item_actions = []
+        for item in chunk:
+            condition, values = delete_condition(item)
+            actions = [{'Put': {
+                'TableName': TABLE_NAME,
+                'Item': dict(build_tombstone(item['ticket_id'], timestamp), archived=True),
+                'ConditionExpression': condition,
+                'ExpressionAttributeNames': {'#s': 'status', '#v': 'version'},
+                'ExpressionAttributeValues': values
+            }}]
+            if DATA_MODEL != 'legacy':
+                actions.append({'Put': {'TableName': STORE_TABLE_NAME, 'Item': store_tombstone(item, timestamp)}})
+            item_actions.append(actions)
+        try:
+            client.transact_write_items(TransactItems=[action for actions in item_actions for action in actions])
+            deleted.extend(chunk)
+            continue
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+
+        for item, actions in zip(chunk, item_actions):
+            try:
+                client.transact_write_items(TransactItems=actions)
+                deleted.append(item)
+            except ClientError as e:
+                if not is_condition_failure(e):
+                    raise
+                # 讀取後被重新開啟或修改，留在 TicketTable (S3 內的舊副本不會被讀到)
+                print(f"Skip {item['ticket_id']}: modified after it was read")
+    return deleted
+
+def archive_closed_tickets(older_than_days=ARCHIVE_AFTER_DAYS, dry_run=False, context=None):
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+    items = find_archivable(cutoff, ARCHIVE_MAX_TICKETS, context)
+    if dry_run or not items:
+        return {'cutoff': cutoff, 'candidates': len(items), 'archived': 0, 'segments': []}
+
+    # 先寫 S3 再刪 DynamoDB：中途失敗時工單仍在 TicketTable，下次執行會重新封存
+    run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+    locations, segments = write_segments(items, run_id, cutoff)
+    update_archive_index(locations)
+    deleted = delete_archived(items)
+
+    # 與刪除工單相同：移除搜尋索引、扣除統計並讓列表快取失效
+    deltas = Counter()
+    for item in deleted:
+        deltas.update(stats_deltas(item, -1))
+    update_search_index(removed=deleted)
+    record_change(deltas)
+    flush_counters()
+
+    return {
+        'cutoff': cutoff,
+        'candidates': len(items),
+        'archived': len(deleted),
+        'segments': segments
+    }
+
+def lambda_handler(event, context):
+    # EventBridge 排程觸發 (例如每天一次)；event 可帶 older_than_days / dry_run 覆寫
+    start_request('archive')
+    result = archive_closed_tickets(
+        older_than_days=int(event.get('older_than_days', ARCHIVE_AFTER_DAYS)),
+        dry_run=bool(event.get('dry_run', False)),
+        context=context
+    )
+    print("Archive result:", json.dumps(result))
+    finish_request(Candidates=result['candidates'], Archived=result['archived'])
+    return result
@@ -0,0 +1,123 @@
+"""
+JWT 驗證 (TicketAPIHandler.verify_jwt) 的本機檢查，不連 Cognito / AWS
+
+    pip install cryptography
+    python api/TicketAuthCheck.py
+    python api/TicketAuthCheck.py --iterations 5000
+
+- 以 TicketBenchmark.TokenSigner 產生 RSA 金鑰與 JWKS 檔 (JWKS_FILE)，簽出各種 Token
+- 檢查正確的 Token 通過；竄改內容、alg=none、過期、錯誤的 iss / aud、未知的 kid、其他金鑰簽的 Token 都被拒絕
+- 量測第一次驗證 (RSA 運算) 與之後走 claims 快取的耗時
+任一項不符時以非 0 結束，可放在 CI
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def unsigned_token(signer, claims):
+    # alg=none：沒有簽章的 Token
+    header = signer.b64(json.dumps({'alg': 'none', 'kid': 'bench'}).encode())
+    return 'Bearer ' + header + '.' + signer.b64(json.dumps(claims).encode()) + '.'
+
+def tampered_token(signer, token, claims):
+    # 保留原本的簽章，只換掉 payload (例如把自己加進 Admin)
+    header, _, signature = token[len('Bearer '):].split('.')
+    return 'Bearer ' + header + '.' + signer.b64(json.dumps(claims).encode()) + '.' + signature
+
+def build_cases(handler, signer):
+    """
+    回傳 [(名稱, Token, 預期的錯誤訊息開頭或 None 表示應通過)]
+    """
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    issuer, audience = handler.JWT_ISSUER, handler.COGNITO_APP_CLIENT_ID
+    claims = {'email': 'user@bench.local'}
+    valid = signer.token(issuer, audience, claims)
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    now = int(time.time())
+    return [
+        ('valid', valid, None),
+        ('valid, aud list', signer.token(issuer, audience, dict(claims, aud=['other', audience])), None),
+        ('tampered payload', tampered_token(signer, valid, {'email': 'user@bench.local', 'cognito:groups': ['Admin'],
+                                                             'iss': issuer, 'aud': audience, 'exp': now + 3600}), 'Invalid signature'),
+        ('alg=none', unsigned_token(signer, dict(claims, iss=issuer, aud=audience, exp=now + 3600)), 'Unsupported alg'),
+        ('expired', signer.token(issuer, audience, dict(claims, exp=now - handler.JWT_LEEWAY_SECONDS - 60)), 'Token expired'),
+        ('missing exp', signer.token(issuer, audience, dict(claims, exp=None)), 'Token expired'),
+        ('not yet valid', signer.token(issuer, audience, dict(claims, nbf=now + handler.JWT_LEEWAY_SECONDS + 60)), 'Token not yet valid'),
+        ('wrong iss', signer.token('https://example.com/other-pool', audience, claims), 'Invalid issuer'),
+        ('wrong aud', signer.token(issuer, 'other-client', claims), 'Invalid audience'),
+        ('unknown kid', signer.token(issuer, audience, claims, kid='rotated'), 'Unknown kid'),
+        ('other key, same kid', signer.token(issuer, audience, claims, key=other_key), 'Invalid signature'),
+        ('malformed', 'Bearer not-a-jwt', 'Malformed token'),
+    ]
+
+def check_cases(handler, cases):
+    failures = []
+    for name, token, expected in cases:
+        try:
+            handler.verify_jwt(token[len('Bearer '):])
+            error = None
+        except ValueError as e:
+            error = str(e)
+        # get_user_claims 驗證失敗時視為未登入 (不顯示它印出的 Token rejected)
+        with contextlib.redirect_stdout(io.StringIO()):
+            accepted = bool(handler.get_user_claims({'Authorization': token}))
+        if expected is None:
+            ok = error is None and accepted
+        else:
+            ok = error is not None and error.startswith(expected) and not accepted
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<22} {error or 'accepted'}")
+        if not ok:
+            failures.append(name)
+    return failures
+
+def measure(handler, signer, iterations):
+    """
+    回傳 (第一次驗證的平均毫秒數, 快取命中的平均毫秒數)
+    """
+    tokens = [signer.token(handler.JWT_ISSUER, handler.COGNITO_APP_CLIENT_ID, {'email': f'user{index}@bench.local'})
+              for index in range(min(iterations, 200))]
+    started = time.perf_counter()
+    for token in tokens:
+        handler.get_user_claims({'Authorization': token})
+    uncached = (time.perf_counter() - started) * 1000 / len(tokens)
+
+    headers = {'Authorization': tokens[0]}
+    started = time.perf_counter()
+    for _ in range(iterations):
+        handler.get_user_claims(headers)
+    cached = (time.perf_counter() - started) * 1000 / iterations
+    return uncached, cached
+
+def run(args):
+    try:
+        from TicketBenchmark import TokenSigner
+        signer = TokenSigner(tempfile.mkdtemp(prefix='ticket-auth-'))
+    except ImportError:
+        raise SystemExit('TicketAuthCheck needs cryptography: pip install cryptography')
+
+    os.environ['JWKS_FILE'] = signer.jwks_file # 需在 import TicketAPIHandler 前設定
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    import TicketAPIHandler as handler
+
+    failures = check_cases(handler, build_cases(handler, signer))
+    handler.claims_cache.clear()
+    uncached, cached = measure(handler, signer, args.iterations)
+    print(f"verify (RSA): {uncached:.3f} ms / token, cached claims: {cached * 1000:.2f} us / request")
+    if failures:
+        raise SystemExit(f"{len(failures)} check(s) failed: {', '.join(failures)}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='TicketAPIHandler JWT 驗證本機檢查')
+    parser.add_argument('--iterations', type=int, default=2000, help='量測快取命中耗時的次數')
+    return parser
+
+if __name__ == '__main__':
+    sys.path.insert(0, API_DIR)
+    run(build_parser().parse_args())
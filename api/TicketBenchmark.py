@@ -0,0 +1,460 @@
+"""
+TicketAPIHandler / TicketNotificationWorker 效能測試 (在本機執行，不連 AWS)
+
+    pip install "moto[dynamodb,s3,sqs,sns]" cryptography
+    python api/TicketBenchmark.py --tickets 50000 --requests 2000 --concurrency 8 --out bench.json
+    python api/TicketBenchmark.py --mix list=70,create=10,update=10,login=10 --compare bench.json
+
+- 以 moto 在同一個 Process 內模擬 DynamoDB / SQS / SNS / S3，先灌入指定數量的工單與使用者
+- 依 --mix 的比例產生 create / list / update / delete / login / notify (一批 SQS 訊息交給 Worker) 請求，
+  以 --concurrency 個執行緒同時送出
+- 每個請求的 AWS 呼叫次數與 Consumed Capacity 取自 TicketTelemetry 的 EMF 紀錄
+- 結果 (throughput、p50 / p95 / p99、AWS 呼叫數、冷啟動 import 時間) 存成 JSON，--compare 與之前的結果比較
+
+執行緒共用同一份模組 (等同一個 Container 同時處理多個請求，快取也共用)，moto 同一時間只處理一個 AWS 呼叫，
+數字適合比較改版前後，不代表在 AWS 上的實際延遲
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+OPERATIONS = ('create', 'list', 'update', 'delete', 'login', 'notify')
+DEFAULT_MIX = 'list=40,create=20,update=15,login=15,delete=5,notify=5'
+BENCH_PASSWORD = 'Bench-Passw0rd!'
+LIST_QUERIES = (
+    {},
+    {'status': 'Open'},
+    {'status': 'Closed'},
+    {'priority': 'High'},
+    {'fields': 'ticket_id,title,status,priority,created_at'},
+)
+TITLE_WORDS = ('投影機', '冷氣', '網路', '印表機', '電腦', 'projector', 'wifi', 'printer', '門鎖', '燈管')
+TAGS = ('投影機', '網路', '冷氣', '電腦', '水電')
+
+def parse_mix(spec):
+    """
+    解析 create=20,list=40 形式的比例，回傳 [(operation, weight)]
+    """
+    mix = []
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation '{name}' in --mix (choose from {', '.join(OPERATIONS)})")
+        try:
+            mix.append((name, float(weight)))
+        except ValueError:
+            raise SystemExit(f"Invalid weight for '{name}' in --mix")
+    if not any(weight > 0 for _, weight in mix):
+        raise SystemExit('--mix needs at least one positive weight')
+    return mix
+
+def percentile(values, p):
+    # nearest-rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+def measure_cold_import(module, runs):
+    """
+    在新的 Python Process 內 import 模組，回傳每次的毫秒數摘要 (等同 Lambda 冷啟動的 Init 階段)
+    """
+    code = f"import time; t = time.perf_counter(); import {module}; print((time.perf_counter() - t) * 1000)"
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=API_DIR, env=env, capture_output=True, text=True, check=True)
+        samples.append(float(output.stdout.strip().splitlines()[-1]))
+    return {'runs': runs, 'min': round(min(samples), 2), 'p50': round(percentile(samples, 50), 2), 'max': round(max(samples), 2)}
+
+class TokenSigner:
+    """
+    產生本機 RSA 金鑰與 JWKS 檔 (TicketAPIHandler 透過 JWKS_FILE 讀取)，簽出與 Cognito 相同格式的 ID Token
+    """
+    def __init__(self, directory):
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        numbers = self.key.public_key().public_numbers()
+        self.jwks_file = os.path.join(directory, 'jwks.json')
+        with open(self.jwks_file, 'w', encoding='utf-8') as f:
+            json.dump({'keys': [{
+                'kty': 'RSA', 'kid': 'bench', 'alg': 'RS256', 'use': 'sig',
+                'n': self.b64(numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, 'big')),
+                'e': self.b64(numbers.e.to_bytes((numbers.e.bit_length() + 7) // 8, 'big'))
+            }]}, f)
+
+    @staticmethod
+    def b64(data):
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    def token(self, issuer, audience, claims, kid='bench', key=None):
+        """
+        claims 可覆寫 iss / aud / exp (例如測試過期或錯誤的 aud)；key 指定其他私鑰時簽出簽章不符的 Token
+        """
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+        payload = dict({'iss': issuer, 'aud': audience, 'exp': int(time.time()) + 86400}, **claims)
+        signing_input = self.b64(json.dumps({'alg': 'RS256', 'kid': kid}).encode()) + '.' + self.b64(json.dumps(payload).encode())
+        signature = (key or self.key).sign(signing_input.encode('ascii'), padding.PKCS1v15(), hashes.SHA256())
+        return 'Bearer ' + signing_input + '.' + self.b64(signature)
+
+def create_resources(handler):
+    """
+    建立與 README 相同設定的 Table / Queue / Topic / Bucket，回傳 (queue_url, topic_arn)
+    """
+    import boto3
+    client = boto3.client('dynamodb')
+
+    def index(name, partition_key, sort_key='created_at', projection='ALL'):
+        return {
+            'IndexName': name,
+            'KeySchema': [{'AttributeName': partition_key, 'KeyType': 'HASH'}, {'AttributeName': sort_key, 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': projection}
+        }
+
+    client.create_table(
+        TableName=handler.TABLE_NAME,
+        BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'ticket_id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name in ('ticket_id', 'type', 'status', 'created_at', 'updated_at', 'search_term', 'posting')],
+        GlobalSecondaryIndexes=[
+            index(handler.TYPE_INDEX_NAME, 'type'),
+            index(handler.STATUS_INDEX_NAME, 'status'),
+            index(handler.SYNC_INDEX_NAME, 'type', 'updated_at'),
+            index(handler.SEARCH_INDEX_NAME, 'search_term', 'posting', 'KEYS_ONLY')
+        ]
+    )
+    client.create_table(
+        TableName=handler.STORE_TABLE_NAME,
+        BillingMode='PAY_PER_REQUEST',
+        KeySchema=[{'AttributeName': 'PK', 'KeyType': 'HASH'}, {'AttributeName': 'SK', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name in ('PK', 'SK', 'GSI1PK', 'GSI2PK', 'GSI3PK', 'created_at')],
+        GlobalSecondaryIndexes=[
+            index(handler.OWNER_INDEX_NAME, 'GSI1PK'),
+            index(handler.STORE_STATUS_INDEX_NAME, 'GSI2PK'),
+            index(handler.ENTITY_INDEX_NAME, 'GSI3PK')
+        ]
+    )
+    boto3.client('s3').create_bucket(Bucket=handler.S3_BUCKET_NAME)
+    queue_url = boto3.client('sqs').create_queue(QueueName='TicketQueue')['QueueUrl']
+    topic_arn = boto3.client('sns').create_topic(Name='TicketNotificationTopic')['TopicArn']
+    return queue_url, topic_arn
+
+def seed(handler, ticket_count, user_count, rng):
+    """
+    灌入使用者與工單 (直接走 TicketAPIHandler 的批次寫入)，回傳 (user emails, 工單 list)
+    """
+    users = [f"user{index}@bench.local" for index in range(user_count)]
+    for email in users:
+        handler.put_user({
+            'ticket_id': f"USER#{email}",
+            'user_email': email,
+            'password': hashlib.sha256((BENCH_PASSWORD + email.lower()).encode('utf-8')).hexdigest(),
+            'user_name': email.split('@')[0],
+            'type': 'user',
+            'created_at': datetime.now().isoformat()
+        })
+
+    tickets = []
+    deltas = Counter()
+    for index in range(ticket_count):
+        item = handler.build_ticket_item(random_ticket(rng, users))
+        item['status'] = rng.choice(('Open', 'Open', 'Processing', 'Closed'))
+        tickets.append(item)
+        deltas.update(handler.stats_deltas(item))
+    handler.batch_put_tickets(tickets)
+    if handler.DATA_MODEL != 'legacy':
+        handler.batch_put_tickets([handler.ticket_entity(item) for item in tickets], handler.STORE_TABLE_NAME)
+    handler.record_change(deltas)
+    handler.flush_counters()
+    return users, tickets
+
+def random_ticket(rng, users):
+    email = rng.choice(users)
+    return {
+        'title': f"{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)} #{rng.randrange(10000)}",
+        'description': 'benchmark ' * rng.randrange(1, 40),
+        'priority': rng.choice(('Low', 'Medium', 'High')),
+        'user_email': email,
+        'user_name': email.split('@')[0],
+        'tags': rng.sample(TAGS, rng.randrange(0, 3))
+    }
+
+def api_event(method, body=None, params=None, path_params=None, token=None):
+    return {
+        'httpMethod': method,
+        'path': '/tickets',
+        'headers': {'Authorization': token} if token else {},
+        'queryStringParameters': params,
+        'pathParameters': path_params,
+        'body': json.dumps(body) if body is not None else None
+    }
+
+def build_requests(args, mix, users, tickets, tokens, rng):
+    """
+    依比例預先產生所有請求 [(operation, target, event)]，target 為 'api' 或 'worker'
+    刪除與更新使用不同的工單，避免更新到已刪除的工單
+    """
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    ticket_ids = [item['ticket_id'] for item in tickets]
+    rng.shuffle(ticket_ids)
+    delete_pool = ticket_ids[:len(ticket_ids) // 4]
+    update_pool = ticket_ids[len(ticket_ids) // 4:] or ticket_ids
+
+    requests = []
+    for _ in range(args.requests):
+        operation = rng.choices(names, weights)[0]
+        if operation == 'delete' and not delete_pool:
+            operation = 'list'
+        if operation == 'create':
+            email = rng.choice(users)
+            requests.append((operation, 'api', api_event('POST', dict(random_ticket(rng, users), user_email=email), token=tokens[email])))
+        elif operation == 'list':
+            params = dict(rng.choice(LIST_QUERIES), limit=str(args.page_size))
+            requests.append((operation, 'api', api_event('GET', params=params)))
+        elif operation == 'update':
+            body = {'status': rng.choice(('Open', 'Processing', 'Closed'))}
+            requests.append((operation, 'api', api_event('PUT', body, path_params={'id': rng.choice(update_pool)}, token=tokens['admin'])))
+        elif operation == 'delete':
+            requests.append((operation, 'api', api_event('DELETE', path_params={'id': delete_pool.pop()}, token=tokens['admin'])))
+        elif operation == 'login':
+            requests.append((operation, 'api', api_event('POST', {'action': 'login', 'email': rng.choice(users), 'password': BENCH_PASSWORD})))
+        else:
+            records = []
+            for index in range(args.notify_batch):
+                item = rng.choice(tickets)
+                records.append({
+                    'messageId': f"bench-{len(requests)}-{index}",
+                    'body': json.dumps({'ticket_id': item['ticket_id'], 'title': item['title'], 'email': item['user_email'],
+                                        'priority': item['priority'], 'type': 'TICKET_CREATED'})
+                })
+            requests.append((operation, 'worker', {'Records': records}))
+    return requests
+
+def serialize_stand_in():
+    """
+    moto 的 backend 不是 thread-safe (例如 TransactWriteItems 複製整張表時另一個執行緒正在寫入)，
+    同一時間只處理一個 AWS 呼叫，等同單一節點的服務；handler 本身的程式碼仍然同時執行
+    """
+    from moto.core.botocore_stubber import BotocoreStubber
+    lock = threading.Lock()
+    process_request = BotocoreStubber.process_request
+
+    def locked(self, request):
+        with lock:
+            return process_request(self, request)
+    BotocoreStubber.process_request = locked
+
+_local = threading.local()
+
+def capture_record(record):
+    # TicketTelemetry 在處理請求的執行緒呼叫 sink，以 thread-local 對應到目前這個請求
+    _local.record = record
+
+def execute(handler, worker, request):
+    """
+    送出一個請求，回傳 (operation, 毫秒, statusCode, EMF 紀錄)
+    """
+    operation, target, event = request
+    _local.record = None
+    started = time.perf_counter()
+    try:
+        if target == 'api':
+            status = handler.lambda_handler(event, None)['statusCode']
+        else:
+            failures = worker.lambda_handler(event, None)['batchItemFailures']
+            status = 500 if failures else 200
+    except Exception as e:
+        print(f"{operation} raised {type(e).__name__}: {e}", file=sys.stderr)
+        status = 'exception'
+    elapsed = (time.perf_counter() - started) * 1000
+    return operation, elapsed, status, _local.record
+
+def summarize(results, wall_seconds):
+    """
+    依 operation 彙整延遲百分位數、狀態碼、每個請求的 AWS 呼叫數與 Consumed Capacity
+    """
+    grouped = {}
+    for operation, elapsed, status, record in results:
+        grouped.setdefault(operation, []).append((elapsed, status, record or {}))
+
+    operations = {}
+    for operation, rows in sorted(grouped.items()):
+        latencies = [elapsed for elapsed, _, _ in rows]
+        services = Counter()
+        for _, _, record in rows:
+            for name, value in record.items():
+                if name.endswith('.Calls'):
+                    services[name[:-len('.Calls')]] += value
+        operations[operation] = {
+            'count': len(rows),
+            'status_codes': dict(Counter(str(status) for _, status, _ in rows)),
+            'errors': sum(1 for _, status, _ in rows if status == 'exception' or status >= 500),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 3),
+                'p50': round(percentile(latencies, 50), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(max(latencies), 3)
+            },
+            'aws_calls_per_request': round(sum(record.get('AwsCalls', 0) for _, _, record in rows) / len(rows), 3),
+            'aws_calls_by_service': {service: round(calls / len(rows), 3) for service, calls in sorted(services.items())},
+            'consumed_capacity_per_request': round(sum(record.get('ConsumedCapacity', 0) for _, _, record in rows) / len(rows), 3),
+            'throughput_rps': round(len(rows) / wall_seconds, 2)
+        }
+
+    latencies = [elapsed for _, elapsed, _, _ in results]
+    totals = {
+        'count': len(results),
+        'throughput_rps': round(len(results) / wall_seconds, 2),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3)
+        },
+        'aws_calls_per_request': round(sum((record or {}).get('AwsCalls', 0) for _, _, _, record in results) / len(results), 3)
+    }
+    return operations, totals
+
+def print_report(report, previous=None):
+    """
+    印出各 operation 的摘要；有 previous 時附上與之前結果的差異
+    """
+    def change(new, old):
+        if old in (None, 0) or new is None:
+            return ''
+        return f" ({(new - old) / old * 100:+.1f}%)"
+
+    old_operations = (previous or {}).get('operations', {})
+    print(f"{'operation':<10}{'count':>7}{'rps':>9}{'p50 ms':>18}{'p95 ms':>11}{'p99 ms':>18}{'aws calls':>18}{'errors':>8}")
+    for operation, stats in report['operations'].items():
+        old = old_operations.get(operation, {})
+        old_latency = old.get('latency_ms', {})
+        print(
+            f"{operation:<10}{stats['count']:>7}{stats['throughput_rps']:>9}"
+            f"{stats['latency_ms']['p50']:>9}{change(stats['latency_ms']['p50'], old_latency.get('p50')):>9}"
+            f"{stats['latency_ms']['p95']:>11}"
+            f"{stats['latency_ms']['p99']:>9}{change(stats['latency_ms']['p99'], old_latency.get('p99')):>9}"
+            f"{stats['aws_calls_per_request']:>9}{change(stats['aws_calls_per_request'], old.get('aws_calls_per_request')):>9}"
+            f"{stats['errors']:>8}"
+        )
+    totals = report['totals']
+    old_totals = (previous or {}).get('totals', {})
+    print(f"total: {totals['count']} requests, {totals['throughput_rps']} req/s{change(totals['throughput_rps'], old_totals.get('throughput_rps'))}, "
+          f"p99 {totals['latency_ms']['p99']} ms{change(totals['latency_ms']['p99'], old_totals.get('latency_ms', {}).get('p99'))}")
+    for module, cold in report['cold_import_ms'].items():
+        old_cold = (previous or {}).get('cold_import_ms', {}).get(module, {})
+        print(f"cold import {module}: p50 {cold['p50']} ms{change(cold['p50'], old_cold.get('p50'))}")
+
+def run(args):
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise SystemExit('TicketBenchmark needs moto: pip install "moto[dynamodb,s3,sqs,sns]" cryptography')
+
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    cold_import = {module: measure_cold_import(module, args.cold_runs) for module in ('TicketAPIHandler', 'TicketNotificationWorker')}
+
+    # moto 只攔截本機 boto3 呼叫，填入假的憑證避免去讀真正的設定
+    os.environ.update({'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench', 'AWS_DEFAULT_REGION': 'us-east-1'})
+    os.environ.pop('AWS_PROFILE', None)
+    os.environ.setdefault('EVENT_LOG_SAMPLE_RATE', '0')
+    workdir = tempfile.mkdtemp(prefix='ticket-bench-')
+    signer = TokenSigner(workdir)
+    os.environ['JWKS_FILE'] = signer.jwks_file # 需在 import TicketAPIHandler 前設定
+    sys.path.insert(0, API_DIR)
+
+    serialize_stand_in()
+    with mock_aws():
+        import TicketAPIHandler as handler
+        import TicketNotificationWorker as worker
+        import TicketTelemetry
+        queue_url, topic_arn = create_resources(handler)
+        worker.SQS_QUEUE_URL = queue_url
+        worker.SNS_TOPIC_ARN = topic_arn
+
+        print(f"Seeding {args.tickets} tickets and {args.users} users...", file=sys.stderr)
+        seed_started = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            users, tickets = seed(handler, args.tickets, args.users, rng)
+        seed_seconds = time.perf_counter() - seed_started
+
+        tokens = {email: signer.token(handler.JWT_ISSUER, handler.COGNITO_APP_CLIENT_ID, {'email': email}) for email in users}
+        tokens['admin'] = signer.token(handler.JWT_ISSUER, handler.COGNITO_APP_CLIENT_ID, {'email': 'admin@bench.local', 'cognito:groups': ['Admin']})
+        requests = build_requests(args, mix, users, tickets, tokens, rng)
+        warmup = [('list', 'api', api_event('GET', params={'limit': str(args.page_size)}))] * args.warmup
+
+        TicketTelemetry.set_sink(capture_record)
+        print(f"Running {len(requests)} requests with concurrency {args.concurrency}...", file=sys.stderr)
+        try:
+            # handler 與 Worker 的 log 不計入結果，避免 I/O 影響延遲
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                for request in warmup:
+                    execute(handler, worker, request)
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    results = list(executor.map(lambda request: execute(handler, worker, request), requests))
+                wall_seconds = time.perf_counter() - started
+        finally:
+            TicketTelemetry.set_sink(None)
+
+    operations, totals = summarize(results, wall_seconds)
+    report = {
+        'started_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'data_model': handler.DATA_MODEL,
+        'seed_seconds': round(seed_seconds, 2),
+        'wall_seconds': round(wall_seconds, 3),
+        'cold_import_ms': cold_import,
+        'totals': totals,
+        'operations': operations
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    print_report(report, previous)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Saved {args.out}", file=sys.stderr)
+    return report
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='TicketAPIHandler / TicketNotificationWorker 本機效能測試')
+    parser.add_argument('--tickets', type=int, default=5000, help='預先灌入的工單數')
+    parser.add_argument('--users', type=int, default=100, help='預先註冊的使用者數')
+    parser.add_argument('--requests', type=int, default=1000, help='測試的請求數')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時送出請求的執行緒數')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'各種請求的比例 (預設 {DEFAULT_MIX})')
+    parser.add_argument('--page-size', type=int, default=50, help='列表每頁筆數')
+    parser.add_argument('--notify-batch', type=int, default=10, help='notify 每批 SQS 訊息數')
+    parser.add_argument('--warmup', type=int, default=20, help='正式測試前的列表請求數 (不計入結果)')
+    parser.add_argument('--cold-runs', type=int, default=5, help='量測冷啟動 import 的次數')
+    parser.add_argument('--seed', type=int, default=42, help='亂數種子，相同參數會產生相同的請求')
+    parser.add_argument('--out', help='結果 JSON 檔')
+    parser.add_argument('--compare', help='之前的結果 JSON 檔，印出差異')
+    return parser
+
+if __name__ == '__main__':
+    run(build_parser().parse_args())
@@ -1,37 +1,187 @@
 import json
 import boto3
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from TicketTelemetry import instrument, in_request, start_request, finish_request
 # --- 設定區 ---
 SNS_TOPIC_ARN = 'arn:aws:sns:us-east-1:463414760499:TicketNotificationTopic' # <--- 貼上你的 SNS ARN
+SQS_QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/463414760499/TicketQueue' # <--- 與 TicketAPIHandler 相同的 Queue
+TABLE_NAME = 'TicketTable'
+MAX_PUBLISH_WORKERS = 8 # 同時發送 SNS 的執行緒上限
+
+# 摘要模式：同一時間窗內的非緊急通知合併成一封 Email
+DIGEST_MODE = os.environ.get('DIGEST_MODE', 'false').lower() == 'true'
+DIGEST_WINDOW_SECONDS = min(int(os.environ.get('DIGEST_WINDOW_SECONDS', '300')), 900) # SQS DelaySeconds 上限 900
+URGENT_PRIORITIES = ['High'] # 這些優先度不進摘要，立即通知
 # ------------
 
-sns = boto3.client('sns')
+sns = instrument(boto3.client('sns'))
+sqs = instrument(boto3.client('sqs'))
+dynamodb = boto3.resource('dynamodb')
+instrument(dynamodb.meta.client)
+table = dynamodb.Table(TABLE_NAME)
+
+def build_notification(body):
+    """
+    依 SQS 訊息內容組出 Email 的 (Subject, Message)
+    """
+    ticket_id = body.get('ticket_id')
+    title = body.get('title')
+
+    # 準備 Email 內容
+    message_text = f"New Ticket Created!\nID: {ticket_id}\nTitle: {title}\nPlease check the dashboard."
+    return f"[Alert] New Ticket: {title}", message_text
+
+def publish_notification(body):
+    """
+    發送單筆 SNS 通知，失敗時直接丟出例外讓呼叫端記錄
+    """
+    subject, message_text = build_notification(body)
+    sns.publish(
+        TopicArn=SNS_TOPIC_ARN,
+        Subject=subject,
+        Message=message_text
+    )
+
+def digest_id_for(recipient, now):
+    """
+    摘要項目的 key：DIGEST#{收件對象}#{時間窗起點}
+    收件對象目前就是 SNS Topic (所有訂閱者收到同一封摘要)
+    """
+    window_start = int(now // DIGEST_WINDOW_SECONDS) * DIGEST_WINDOW_SECONDS
+    return f"DIGEST#{recipient}#{window_start}", window_start
+
+def add_to_digest(body):
+    """
+    把通知加入目前時間窗的摘要項目 (存在 TicketTable，多個 Worker 同時執行也共用同一份)
+    時間窗第一次出現時排一個延遲的 DIGEST_FLUSH 訊息，時間到再統一發送
+    """
+    now = time.time()
+    digest_id, window_start = digest_id_for(SNS_TOPIC_ARN, now)
+    window_end = window_start + DIGEST_WINDOW_SECONDS
+    # 用 String Set 存 [ticket_id, title]，SQS 重送同一則訊息時會自動去重
+    entry = json.dumps([body.get('ticket_id'), body.get('title')], ensure_ascii=False)
+
+    try:
+        response = table.update_item(
+            Key={'ticket_id': digest_id},
+            UpdateExpression="add entries :e set recipient = :r, window_end = :we, expires_at = :exp",
+            ConditionExpression="attribute_not_exists(sent_at)",
+            ExpressionAttributeValues={
+                ':e': {entry},
+                ':r': SNS_TOPIC_ARN,
+                ':we': window_end,
+                ':exp': window_end + 86400 # DynamoDB TTL，一天後自動刪除
+            },
+            ReturnValues="ALL_NEW"
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # 這個時間窗剛好已經送出，改成直接通知，避免漏信
+        publish_notification(body)
+        return
+
+    # 還沒排過發送訊息才排 (重複排也沒關係，flush_digest 只會成功一次)
+    if not response['Attributes'].get('flush_scheduled'):
+        sqs.send_message(
+            QueueUrl=SQS_QUEUE_URL,
+            MessageBody=json.dumps({'type': 'DIGEST_FLUSH', 'digest_id': digest_id}),
+            DelaySeconds=max(0, min(900, int(window_end - now) + 1))
+        )
+        table.update_item(
+            Key={'ticket_id': digest_id},
+            UpdateExpression="set flush_scheduled = :t",
+            ExpressionAttributeValues={':t': True}
+        )
+
+def flush_digest(digest_id):
+    """
+    時間窗結束後發送摘要：先以條件更新標記 sent_at 搶到發送權，再 publish
+    publish 失敗時清掉 sent_at 並丟出例外，讓 SQS 重試
+    """
+    try:
+        response = table.update_item(
+            Key={'ticket_id': digest_id},
+            UpdateExpression="set sent_at = :now",
+            ConditionExpression="attribute_exists(ticket_id) AND attribute_not_exists(sent_at)",
+            ExpressionAttributeValues={':now': int(time.time())},
+            ReturnValues="ALL_NEW"
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            print(f"Digest {digest_id} already sent or missing, skip")
+            return
+        raise
+
+    entries = sorted(json.loads(entry) for entry in response['Attributes'].get('entries', []))
+    lines = [f"- {ticket_id}: {title}" for ticket_id, title in entries]
+    message_text = f"{len(entries)} new tickets created in the last {DIGEST_WINDOW_SECONDS} seconds:\n" + "\n".join(lines) + "\nPlease check the dashboard."
+
+    try:
+        sns.publish(
+            TopicArn=response['Attributes'].get('recipient', SNS_TOPIC_ARN),
+            Subject=f"[Digest] {len(entries)} New Tickets",
+            Message=message_text
+        )
+    except Exception:
+        table.update_item(Key={'ticket_id': digest_id}, UpdateExpression="remove sent_at")
+        raise
+
+def handle_message(body):
+    """
+    依訊息類型分派：摘要發送、加入摘要或立即通知
+    """
+    if body.get('type') == 'DIGEST_FLUSH':
+        flush_digest(body['digest_id'])
+    elif DIGEST_MODE and body.get('type') == 'TICKET_CREATED' and body.get('priority') not in URGENT_PRIORITIES:
+        add_to_digest(body)
+    else:
+        publish_notification(body)
 
 def lambda_handler(event, context):
     # SQS 可能一次傳來多筆紀錄 (Records)
+    # 回傳 batchItemFailures，只讓發送失敗的訊息重試 (需在 Event Source Mapping 開啟 ReportBatchItemFailures)
+    start_request('notification')
+    pending = {}  # (ticket_id 或 digest_id, type) -> (messageId, body)
     for record in event['Records']:
         try:
             # 解析 SQS 訊息
             body = json.loads(record['body'])
-            print("Processing message:", body)
-            
-            ticket_id = body.get('ticket_id')
-            title = body.get('title')
-            
-            # 準備 Email 內容
-            message_text = f"New Ticket Created!\nID: {ticket_id}\nTitle: {title}\nPlease check the dashboard."
-            
-            # 發送 SNS
-            sns.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Subject=f"[Alert] New Ticket: {title}",
-                Message=message_text
-            )
-            
         except Exception as e:
-            print(f"Error processing record: {str(e)}")
-            # 如果失敗，不要回傳錯誤，不然 SQS 會一直重試。
-            # 生產環境會用 Dead Letter Queue，這裡先 Pass。
+            # 格式錯誤的訊息重試也不會成功，記錄後略過
+            print(f"Error parsing record {record.get('messageId')}: {str(e)}")
             continue
-            
-    return {'statusCode': 200, 'body': json.dumps('SQS Processed')}
\ No newline at end of file
+        if not isinstance(body, dict):
+            # 合法 JSON 但不是物件 (例如 [1,2]、"x")，一樣略過，不讓整批重試
+            print(f"Skipping record {record.get('messageId')}: body is not a JSON object")
+            continue
+
+        print("Processing message:", body)
+
+        # 同一批內相同 ticket_id + type 只處理一次
+        dedupe_key = (body.get('ticket_id') or body.get('digest_id'), body.get('type'))
+        if dedupe_key in pending:
+            print(f"Skipping duplicate message {record.get('messageId')} for {dedupe_key}")
+            continue
+        pending[dedupe_key] = (record['messageId'], body)
+
+    batch_item_failures = []
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(MAX_PUBLISH_WORKERS, len(pending))) as executor:
+            futures = {
+                message_id: executor.submit(in_request(handle_message), body)
+                for message_id, body in pending.values()
+            }
+            for message_id, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    # SNS 節流等暫時性錯誤交給 SQS 重試，超過次數由 Dead Letter Queue 接手
+                    print(f"Error publishing message {message_id}: {str(e)}")
+                    batch_item_failures.append({'itemIdentifier': message_id})
+
+    finish_request(Records=len(event['Records']), Failures=len(batch_item_failures))
+    return {'batchItemFailures': batch_item_failures}
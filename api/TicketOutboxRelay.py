@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from TicketTelemetry import instrument, start_request, finish_request
+# --- 設定區 ---
+SQS_QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/463414760499/TicketQueue' # <--- 與 TicketAPIHandler 相同的 Queue
+TABLE_NAME = 'TicketTable'
+TYPE_INDEX_NAME = 'type-created_at-index'
+OUTBOX_PREFIX = 'OUTBOX#'      # 與 TicketAPIHandler 相同
+
+SQS_BATCH_SIZE = 10            # SendMessageBatch 上限
+SWEEP_PAGE_SIZE = 100          # 排程補送時每次讀取的 Outbox 筆數
+SWEEP_MIN_REMAINING_MS = 10000 # Lambda 剩餘時間低於這個值就停止補送，留給下次排程
+SWEEP_GRACE_SECONDS = 120      # 只補送建立超過這麼久的紀錄，較新的交給 Stream 處理
+# ------------
+
+sqs = instrument(boto3.client('sqs'))
+dynamodb = boto3.resource('dynamodb')
+instrument(dynamodb.meta.client)
+table = dynamodb.Table(TABLE_NAME)
+
+def send_batch(records):
+    """
+    把 [(outbox_id, message)] 以 SendMessageBatch 每 10 筆送出
+    回傳送出成功的 outbox_id list；整批失敗 (例如 SQS 暫時無法使用) 時該批全部視為失敗
+    """
+    sent = []
+    for start in range(0, len(records), SQS_BATCH_SIZE):
+        chunk = records[start:start + SQS_BATCH_SIZE]
+        entries = [{'Id': str(index), 'MessageBody': message} for index, (_, message) in enumerate(chunk)]
+        try:
+            response = sqs.send_message_batch(QueueUrl=SQS_QUEUE_URL, Entries=entries)
+        except ClientError as e:
+            print(f"SQS Batch Error: {e}")
+            continue
+        for success in response.get('Successful', []):
+            sent.append(chunk[int(success['Id'])][0])
+        for failure in response.get('Failed', []):
+            print(f"SQS rejected {chunk[int(failure['Id'])][0]}: {failure.get('Message')}")
+    return sent
+
+def delete_outbox(outbox_ids):
+    """
+    刪除已送出的 Outbox 紀錄 (刪除失敗只會讓下次補送重複發送，Worker 會在同一批內去重)
+    """
+    with table.batch_writer() as batch:
+        for outbox_id in outbox_ids:
+            batch.delete_item(Key={'ticket_id': outbox_id})
+
+def relay_stream(records):
+    """
+    DynamoDB Stream 觸發：只處理新寫入的 OUTBOX# 紀錄
+    送出失敗的紀錄回報 batchItemFailures，Stream 會從那一筆開始重試
+    """
+    pending = []
+    for record in records:
+        if record.get('eventName') != 'INSERT':
+            continue
+        image = record['dynamodb'].get('NewImage', {})
+        outbox_id = image.get('ticket_id', {}).get('S', '')
+        if not outbox_id.startswith(OUTBOX_PREFIX):
+            continue
+        pending.append((outbox_id, image['message']['S'], record['dynamodb']['SequenceNumber']))
+
+    sent = set(send_batch([(outbox_id, message) for outbox_id, message, _ in pending]))
+    delete_outbox(sent)
+
+    failures = [{'itemIdentifier': sequence} for outbox_id, _, sequence in pending if outbox_id not in sent]
+    print(f"Relayed {len(sent)} of {len(pending)} outbox records")
+    return {'batchItemFailures': failures}
+
+def sweep(context=None):
+    """
+    排程觸發 (例如 EventBridge 每分鐘)：透過 type index 依建立時間補送 SWEEP_GRACE_SECONDS 之前還在 Outbox 的紀錄
+    (剛寫入的紀錄 Stream 正在送，一起補送只會重複發送)
+    """
+    sent_total = 0
+    failed_total = 0
+    cutoff = (datetime.now() - timedelta(seconds=SWEEP_GRACE_SECONDS)).isoformat()
+    query_kwargs = {
+        'IndexName': TYPE_INDEX_NAME,
+        'KeyConditionExpression': Key('type').eq('outbox') & Key('created_at').lt(cutoff),
+        'Limit': SWEEP_PAGE_SIZE
+    }
+    while True:
+        response = table.query(**query_kwargs)
+        records = [(item['ticket_id'], item['message']) for item in response.get('Items', [])]
+        sent = send_batch(records)
+        delete_outbox(sent)
+        sent_total += len(sent)
+        failed_total += len(records) - len(sent)
+
+        if 'LastEvaluatedKey' not in response:
+            break
+        if context is not None and context.get_remaining_time_in_millis() < SWEEP_MIN_REMAINING_MS:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    print(f"Outbox sweep sent {sent_total}, failed {failed_total}")
+    return {'sent': sent_total, 'failed': failed_total}
+
+def lambda_handler(event, context):
+    # DynamoDB Stream (近乎即時) 與排程補送 (SQS 中斷後恢復) 共用同一個 Lambda
+    records = event.get('Records') or []
+    if records and records[0].get('eventSource') == 'aws:dynamodb':
+        start_request('outbox_stream')
+        result = relay_stream(records)
+        finish_request(Records=len(records), Failures=len(result['batchItemFailures']))
+        return result
+    start_request('outbox_sweep')
+    result = sweep(context)
+    finish_request(**result)
+    return result
@@ -0,0 +1,109 @@
+"""
+差異同步 (TicketAPIHandler.query_changes) 的本機檢查，以 moto 模擬 DynamoDB，不連 AWS
+
+    pip install "moto[dynamodb,s3,sqs,sns]"
+    python api/TicketSyncCheck.py
+
+- 以很小的 SYNC_MAX_CHANGES 或超過 1 MB 的工單讓 Query 分頁截斷，寫入工單與刪除紀錄 (tombstone) 後從最舊的 since 依 watermark 翻頁
+- 檢查每一筆異動都有回傳 (包含某個 partition 被分頁截斷、另一個 partition 有更新的異動時)，且 watermark 不會倒退
+任一項不符時以非 0 結束，可放在 CI
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+from datetime import datetime, timedelta
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+MAX_PAGES = 50 # 翻頁超過這個次數視為沒有進展
+LARGE_DESCRIPTION = 'x' * 300000 # big_ticket：3 筆就超過 Query 單頁 1 MB，筆數沒到上限就被截斷
+
+# (名稱, 每頁上限 (None 為預設 SYNC_MAX_CHANGES), 依時間先後的異動類型)
+CASES = [
+    ('tickets cut at 1 MB, newer tombstone', None, ['big_ticket'] * 5 + ['tombstone']),
+    ('tickets truncated, newer tombstone', 2, ['ticket'] * 5 + ['tombstone']),
+    ('tombstones truncated, newer ticket', 2, ['tombstone'] * 5 + ['ticket']),
+    ('interleaved', 2, ['ticket', 'tombstone'] * 4),
+    ('both truncated', 3, ['ticket'] * 4 + ['tombstone'] * 4),
+    ('single page', 10, ['ticket', 'tombstone', 'ticket']),
+]
+
+def write_changes(handler, name, kinds):
+    """
+    依序寫入異動 (updated_at 每筆間隔 1 秒，都在 SYNC_SETTLE_SECONDS 之前)，回傳 (since, 預期的 {ticket_id: type})
+    """
+    started = datetime.now() - timedelta(hours=1)
+    expected = {}
+    for index, kind in enumerate(kinds):
+        ticket_id = f"{name.replace(' ', '-')}-{index}"
+        timestamp = (started + timedelta(seconds=index + 1)).isoformat()
+        if kind == 'tombstone':
+            item = handler.build_tombstone(ticket_id, timestamp)
+        else:
+            item = {'ticket_id': ticket_id, 'type': 'ticket', 'title': ticket_id, 'status': 'Open',
+                    'created_at': timestamp, 'updated_at': timestamp, 'version': 1}
+            if kind == 'big_ticket':
+                item['description'] = LARGE_DESCRIPTION
+        handler.get_table().put_item(Item=item)
+        expected[ticket_id] = 'tombstone' if kind == 'tombstone' else 'ticket'
+    return started.isoformat(), expected
+
+def sync_all(handler, since):
+    """
+    依 watermark 翻頁直到 has_more 為 False，回傳 ({ticket_id: type}, 錯誤訊息或 None)
+    """
+    seen = {}
+    for _ in range(MAX_PAGES):
+        changed, deleted, watermark, has_more = handler.query_changes(since)
+        if watermark < since:
+            return seen, f'watermark went back from {since} to {watermark}'
+        seen.update({item['ticket_id']: 'ticket' for item in changed})
+        seen.update({ticket_id: 'tombstone' for ticket_id in deleted})
+        since = watermark
+        if not has_more:
+            return seen, None
+    return seen, f'no progress after {MAX_PAGES} pages'
+
+def check_cases(handler):
+    failures = []
+    default_page_size = handler.SYNC_MAX_CHANGES
+    for name, page_size, kinds in CASES:
+        handler.SYNC_MAX_CHANGES = page_size or default_page_size
+        since, expected = write_changes(handler, name, kinds)
+        seen, error = sync_all(handler, since)
+        # 其他案例的異動也會被讀到，只比對本案例寫入的
+        seen = {ticket_id: kind for ticket_id, kind in seen.items() if ticket_id in expected}
+        missing = sorted(set(expected) - set(seen))
+        if error is None and missing:
+            error = f'missing {missing}'
+        if error is None and seen != expected:
+            error = 'wrong change type'
+        print(f"{'ok  ' if error is None else 'FAIL'} {name:<36} {error or f'{len(seen)} changes'}")
+        if error is not None:
+            failures.append(name)
+    return failures
+
+def run(args):
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise SystemExit('TicketSyncCheck needs moto: pip install "moto[dynamodb,s3,sqs,sns]"')
+
+    os.environ.update({'AWS_ACCESS_KEY_ID': 'check', 'AWS_SECRET_ACCESS_KEY': 'check', 'AWS_DEFAULT_REGION': 'us-east-1'})
+    os.environ.pop('AWS_PROFILE', None)
+    with mock_aws():
+        import TicketAPIHandler as handler
+        from TicketBenchmark import create_resources
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_resources(handler)
+        failures = check_cases(handler)
+    if failures:
+        raise SystemExit(f"{len(failures)} check(s) failed: {', '.join(failures)}")
+
+def build_parser():
+    return argparse.ArgumentParser(description='TicketAPIHandler 差異同步本機檢查')
+
+if __name__ == '__main__':
+    sys.path.insert(0, API_DIR)
+    run(build_parser().parse_args())
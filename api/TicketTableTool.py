@@ -0,0 +1,310 @@
+"""
+TicketTable 匯出 / 回填 / 搬移工具 (平行 Segment Scan)
+
+    python api/TicketTableTool.py --segments 8 --max-rcu 200 export --out backup.ndjson.gz
+    python api/TicketTableTool.py --checkpoint backfill.json --max-wcu 100 backfill
+    python api/TicketTableTool.py copy --target-table TicketStore --transform TicketAPIHandler:to_store_item
+
+- 每個 Segment 由一個執行緒負責，依實際消耗的 Capacity Units 限速，不會吃光線上流量
+- --checkpoint 記錄每個 Segment 的 LastEvaluatedKey，中斷後以相同參數重新執行即可從上次的位置繼續
+- --transform module:function 會對每筆資料呼叫 function(item)，回傳 dict、dict 的 list 或 None (略過)
+"""
+import argparse
+import gzip
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+from TicketAPIHandler import TABLE_NAME, to_json, is_ticket_item
+
+DEFAULT_SEGMENTS = 8
+PROGRESS_INTERVAL = 10         # 每隔幾秒印一次進度
+
+class CapacityLimiter:
+    """
+    以實際消耗的 Capacity Units 限速 (Token Bucket)，所有執行緒共用
+    先讀再扣，超用時讓呼叫的執行緒睡到額度補回來
+    """
+    def __init__(self, units_per_second):
+        self.rate = units_per_second
+        self.available = units_per_second or 0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, units):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.rate, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            self.available -= units
+            wait = -self.available / self.rate if self.available < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class Checkpoint:
+    """
+    記錄每個 Segment 的進度 {segment: {'last_key', 'done', 'items'}}，每讀完一頁就寫回檔案
+    """
+    def __init__(self, path, command, total_segments):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {'command': command, 'total_segments': total_segments, 'segments': {}}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('command') != command or saved.get('total_segments') != total_segments:
+                raise SystemExit(f"Checkpoint {path} was created by '{saved.get('command')}' with {saved.get('total_segments')} segments")
+            self.state = saved
+
+    def segment(self, segment):
+        return self.state['segments'].setdefault(str(segment), {'last_key': None, 'done': False, 'items': 0})
+
+    def update(self, segment, last_key, count):
+        with self.lock:
+            progress = self.segment(segment)
+            progress['last_key'] = last_key
+            progress['done'] = last_key is None
+            progress['items'] += count
+            if self.path:
+                # 先寫暫存檔再取代，中斷時不會留下寫一半的 checkpoint
+                with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                    f.write(to_json(self.state))
+                os.replace(self.path + '.tmp', self.path)
+
+    def total_items(self):
+        return sum(progress['items'] for progress in self.state['segments'].values())
+
+class NdjsonSink:
+    """
+    把資料寫成 NDJSON (.gz 結尾時以 gzip 壓縮)，續跑時接在檔案後面
+    """
+    def __init__(self, path, append):
+        mode = 'ab' if append else 'wb'
+        self.file = gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+        self.lock = threading.Lock()
+
+    def write(self, items):
+        data = ''.join(to_json(item) + '\n' for item in items).encode('utf-8')
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+_local = threading.local()
+
+def get_table(table_name):
+    # boto3 resource 不是 thread-safe，每個執行緒各自建立
+    tables = _local.__dict__.setdefault('tables', {})
+    if table_name not in tables:
+        tables[table_name] = boto3.session.Session().resource('dynamodb').Table(table_name)
+    return tables[table_name]
+
+def load_transform(spec):
+    """
+    讀取 module:function 形式的 transform callback
+    """
+    if not spec:
+        return None
+    module_name, _, function_name = spec.partition(':')
+    if not function_name:
+        raise SystemExit('--transform must be module:function')
+    sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module_name), function_name)
+
+def apply_transform(transform, items):
+    if transform is None:
+        return items
+    results = []
+    for item in items:
+        output = transform(item)
+        if output is None:
+            continue
+        results.extend(output if isinstance(output, list) else [output])
+    return results
+
+def matches(only, item):
+    if only == 'users':
+        return item.get('ticket_id', '').startswith('USER#')
+    if only == 'tickets':
+        return is_ticket_item(item)
+    return True
+
+def conditional_put(table_name, items, write_limiter):
+    """
+    逐筆以條件 PutItem 寫入目標 Table，不會蓋掉線上同時寫入的較新資料：
+    - 有 version 的資料 (工單)：目標不存在或目標的 version 較舊才寫入；刪除紀錄的 version 比原工單大，已刪除的工單不會被寫回
+    - 沒有 version 的資料 (使用者等)：只寫入目標不存在的項目
+    回傳實際寫入的筆數
+    """
+    table = get_table(table_name)
+    partition_key = next(key['AttributeName'] for key in table.key_schema if key['KeyType'] == 'HASH')
+    written = 0
+    for item in items:
+        put_kwargs = {'Item': item, 'ExpressionAttributeNames': {'#k': partition_key}, 'ReturnConsumedCapacity': 'TOTAL'}
+        if 'version' in item:
+            put_kwargs['ConditionExpression'] = 'attribute_not_exists(#k) OR #v < :v'
+            put_kwargs['ExpressionAttributeNames']['#v'] = 'version'
+            put_kwargs['ExpressionAttributeValues'] = {':v': item['version']}
+        else:
+            put_kwargs['ConditionExpression'] = 'attribute_not_exists(#k)'
+        try:
+            response = table.put_item(**put_kwargs)
+            write_limiter.consume(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+            written += 1
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            write_limiter.consume(1) # 條件不符仍會消耗寫入容量
+    return written
+
+def legacy_updates(item, now):
+    """
+    舊資料缺少的欄位：type、updated_at、version (只處理工單與 USER#，其他系統項目略過)
+    """
+    ticket_id = item.get('ticket_id', '')
+    if ticket_id.startswith('USER#'):
+        defaults = {'type': 'user'}
+    elif '#' not in ticket_id and item.get('type', 'ticket') == 'ticket':
+        defaults = {'type': 'ticket', 'updated_at': item.get('created_at') or now, 'version': 1}
+    else:
+        return {}
+    return {name: value for name, value in defaults.items() if name not in item}
+
+def backfill_items(table_name, items, write_limiter, dry_run):
+    """
+    只補上缺少的欄位，並以 attribute_not_exists 條件更新，不會蓋掉線上同時寫入的值
+    回傳更新筆數
+    """
+    now = time.strftime('%Y-%m-%dT%H:%M:%S')
+    updated = 0
+    for item in items:
+        updates = legacy_updates(item, now)
+        if not updates:
+            continue
+        updated += 1
+        if dry_run:
+            continue
+        names = {f'#a{index}': name for index, name in enumerate(updates)}
+        values = {f':a{index}': value for index, value in enumerate(updates.values())}
+        try:
+            response = get_table(table_name).update_item(
+                Key={'ticket_id': item['ticket_id']},
+                UpdateExpression='set ' + ', '.join(f'{name} = {value}' for name, value in zip(names, values)),
+                ConditionExpression='attribute_exists(ticket_id) AND ' + ' AND '.join(f'attribute_not_exists({name})' for name in names),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnConsumedCapacity='TOTAL'
+            )
+            write_limiter.consume(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            updated -= 1 # 已經被線上寫入補上或刪除
+    return updated
+
+def scan_segment(args, segment, checkpoint, read_limiter, handle):
+    progress = checkpoint.segment(segment)
+    if progress['done']:
+        return
+    scan_kwargs = {'Segment': segment, 'TotalSegments': args.segments, 'ReturnConsumedCapacity': 'TOTAL'}
+    if progress['last_key']:
+        scan_kwargs['ExclusiveStartKey'] = progress['last_key']
+
+    while True:
+        response = get_table(args.table).scan(**scan_kwargs)
+        read_limiter.consume(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+        items = [item for item in response.get('Items', []) if matches(args.only, item)]
+        handle(items)
+        last_key = response.get('LastEvaluatedKey')
+        checkpoint.update(segment, last_key, len(items))
+        if not last_key:
+            return
+        scan_kwargs['ExclusiveStartKey'] = last_key
+
+def run(args):
+    checkpoint = Checkpoint(args.checkpoint, args.command, args.segments)
+    resuming = bool(checkpoint.state['segments'])
+    read_limiter = CapacityLimiter(args.max_rcu)
+    write_limiter = CapacityLimiter(args.max_wcu)
+    transform = load_transform(getattr(args, 'transform', None))
+    counters = {'written': 0}
+    counter_lock = threading.Lock()
+
+    def count(n):
+        with counter_lock:
+            counters['written'] += n
+
+    sink = None
+    if args.command == 'export':
+        sink = NdjsonSink(args.out, append=resuming)
+        def handle(items):
+            output = apply_transform(transform, items)
+            sink.write(output)
+            count(len(output))
+    elif args.command == 'copy':
+        def handle(items):
+            count(conditional_put(args.target_table, apply_transform(transform, items), write_limiter))
+    else:
+        def handle(items):
+            count(backfill_items(args.table, items, write_limiter, args.dry_run))
+
+    done = threading.Event()
+    def report():
+        while not done.wait(PROGRESS_INTERVAL):
+            print(f"[{args.command}] scanned {checkpoint.total_items()}, written {counters['written']}", file=sys.stderr)
+    threading.Thread(target=report, daemon=True).start()
+
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers or args.segments) as executor:
+            futures = [executor.submit(scan_segment, args, segment, checkpoint, read_limiter, handle) for segment in range(args.segments)]
+            for future in futures:
+                future.result()
+    finally:
+        done.set()
+        if sink:
+            sink.close()
+
+    result = {
+        'command': args.command,
+        'scanned': checkpoint.total_items(),
+        'written': counters['written'],
+        'seconds': round(time.monotonic() - started, 2)
+    }
+    print(json.dumps(result))
+    return result
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='TicketTable 平行匯出 / 回填 / 搬移工具')
+    parser.add_argument('--table', default=TABLE_NAME)
+    parser.add_argument('--segments', type=int, default=DEFAULT_SEGMENTS, help='TotalSegments (續跑時需相同)')
+    parser.add_argument('--workers', type=int, help='執行緒數，預設與 segments 相同')
+    parser.add_argument('--max-rcu', type=float, help='每秒最多消耗的 Read Capacity Units')
+    parser.add_argument('--max-wcu', type=float, help='每秒最多消耗的 Write Capacity Units')
+    parser.add_argument('--checkpoint', help='進度檔，中斷後以相同參數重新執行即可續跑')
+    parser.add_argument('--only', choices=['tickets', 'users'], help='只處理工單或 USER# 資料')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='匯出成 NDJSON (.gz 結尾時壓縮)')
+    export.add_argument('--out', required=True)
+    export.add_argument('--transform', help='module:function，對每筆資料轉換後再寫出')
+
+    copy = commands.add_parser('copy', help='搬移到另一個 Table (例如搬到 TicketStore 單表設計)')
+    copy.add_argument('--target-table', required=True)
+    copy.add_argument('--transform', help='module:function，對每筆資料轉換後再寫入')
+
+    backfill = commands.add_parser('backfill', help='為舊資料補上 type、updated_at、version')
+    backfill.add_argument('--dry-run', action='store_true', help='只計算需要更新的筆數')
+    return parser
+
+if __name__ == '__main__':
+    run(build_parser().parse_args())
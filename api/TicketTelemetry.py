@@ -0,0 +1,295 @@
+"""
+AWS 呼叫追蹤與 CloudWatch 指標 (Embedded Metric Format)
+
+以 botocore 事件掛在 client 上，每一次 DynamoDB / S3 / SQS / SNS 呼叫都在目前的請求 (Route) 底下記錄一個 span
+(服務、操作、耗時、Consumed Capacity、筆數、重試次數、錯誤類別)，呼叫的地方不需要修改
+每個請求結束時輸出一行 EMF JSON，CloudWatch 會自動轉成以 Function + Route 為維度的指標，span 明細可用 Logs Insights 查詢
+
+需與使用它的 Lambda 打包在一起 (TicketAPIHandler、TicketNotificationWorker、TicketOutboxRelay、TicketThumbnailWorker)
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+# --- 設定區 ---
+METRIC_NAMESPACE = os.environ.get('METRIC_NAMESPACE', 'TicketSystem')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get('EVENT_LOG_SAMPLE_RATE', '0.01')) # 完整 event 的取樣比例 (0 ~ 1)
+MAX_SPANS_PER_REQUEST = 200    # 每個請求最多輸出的 span 明細 (批次作業呼叫很多)，指標仍計算全部
+MAX_LOGGED_STRING = 256        # 記錄 event 時超過這個長度的字串會截斷 (例如 base64 圖片)
+# 記錄 event 時遮蔽的 header 與欄位 (不分大小寫)
+REDACTED_KEYS = (
+    'authorization', 'cookie', 'x-api-key', 'x-amz-security-token',
+    'password', 'token', 'id_token', 'access_token', 'refresh_token', 'secret'
+)
+THROTTLE_ERRORS = (
+    'ProvisionedThroughputExceededException', 'RequestLimitExceeded', 'ThrottlingException',
+    'Throttling', 'TooManyRequestsException', 'SlowDown'
+)
+# TransactWriteItems 因節流取消時，CancellationReasons 內的代碼
+TRANSACTION_THROTTLE_REASONS = ('ThrottlingError', 'ProvisionedThroughputExceeded')
+# ------------
+
+_lock = threading.Lock()
+# 目前的請求存在 contextvar；沒有 context 的執行緒 (沒用 in_request 包裝的執行緒池) 記在最近開始的請求
+# Lambda 一個 Container 一次只處理一個請求，兩者相同；benchmark 以多執行緒同時處理請求時才有差別
+_request = contextvars.ContextVar('ticket_telemetry_request', default=None)
+_latest = [None]
+_cold_start = [True]
+
+def new_totals():
+    return {'calls': 0, 'ms': 0.0, 'capacity': 0.0, 'errors': 0, 'throttles': 0, 'retries': 0, 'services': {}}
+
+def current_request():
+    return _request.get() or _latest[0]
+
+def start_request(route=None):
+    """
+    Lambda 開始處理一個請求時呼叫，之後的 AWS 呼叫都記在這個請求
+    """
+    request = {'route': route, 'started': time.perf_counter(), 'spans': [], 'dropped': 0, 'totals': new_totals()}
+    _request.set(request)
+    _latest[0] = request
+    return request
+
+def set_route(route):
+    request = current_request()
+    if request is not None:
+        request['route'] = route
+
+def in_request(fn):
+    """
+    包裝要丟進執行緒池的函式，讓它的 AWS 呼叫記在目前的請求：executor.submit(in_request(fn), ...)
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+def count_items(params, parsed):
+    """
+    一次呼叫處理的筆數：讀取看回應 (Count、Items、Responses)，批次寫入看請求 (RequestItems、TransactItems、Entries)
+    """
+    if 'Count' in parsed:
+        return parsed['Count']
+    if 'Items' in parsed:
+        return len(parsed['Items'])
+    if 'Item' in parsed:
+        return 1
+    if isinstance(parsed.get('Responses'), dict):
+        return sum(len(items) for items in parsed['Responses'].values())
+    if isinstance(parsed.get('Responses'), list):
+        return len(parsed['Responses'])
+    if 'Messages' in parsed:
+        return len(parsed['Messages'])
+    if isinstance(params.get('RequestItems'), dict):
+        return sum(len(requests) for requests in params['RequestItems'].values())
+    for name in ('TransactItems', 'Entries'):
+        if isinstance(params.get(name), list):
+            return len(params[name])
+    return None
+
+def consumed_capacity(parsed):
+    capacity = parsed.get('ConsumedCapacity')
+    if isinstance(capacity, dict):
+        return capacity.get('CapacityUnits', 0)
+    if isinstance(capacity, list):
+        return sum(entry.get('CapacityUnits', 0) for entry in capacity)
+    return 0
+
+def record_span(span):
+    request = current_request()
+    if request is None:
+        return # 不在任何請求內 (例如命令列工具)
+    with _lock:
+        totals = request['totals']
+        totals['calls'] += 1
+        totals['ms'] += span['ms']
+        totals['capacity'] += span.get('capacity', 0)
+        totals['retries'] += span.get('retries', 0)
+        totals['throttles'] += span.get('throttles', 0)
+        if 'error' in span:
+            totals['errors'] += 1
+        service = totals['services'].setdefault(span['service'], {'calls': 0, 'ms': 0.0})
+        service['calls'] += 1
+        service['ms'] += span['ms']
+
+        if len(request['spans']) < MAX_SPANS_PER_REQUEST:
+            request['spans'].append(span)
+        else:
+            request['dropped'] += 1
+
+def _before_call(params, model, context, **kwargs):
+    # DynamoDB 一律要求回傳 Consumed Capacity (不影響計費)
+    if model.service_model.service_name == 'dynamodb' and 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+    context['telemetry'] = {
+        'service': model.service_model.service_name,
+        'operation': model.name,
+        'started': time.perf_counter(),
+        'params': params
+    }
+
+def _after_call(parsed, context, **kwargs):
+    call = context.get('telemetry')
+    if call is None:
+        return
+    span = {
+        'service': call['service'],
+        'operation': call['operation'],
+        'ms': round((time.perf_counter() - call['started']) * 1000, 2)
+    }
+    capacity = consumed_capacity(parsed)
+    if capacity:
+        span['capacity'] = capacity
+    items = count_items(call['params'], parsed)
+    if items is not None:
+        span['items'] = items
+    unprocessed = parsed.get('UnprocessedItems') or parsed.get('UnprocessedKeys')
+    if unprocessed:
+        span['unprocessed'] = sum(len(value.get('Keys', [])) if isinstance(value, dict) else len(value) for value in unprocessed.values())
+    if parsed.get('Failed'):
+        span['failed'] = len(parsed['Failed'])
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts')
+    if retries:
+        span['retries'] = retries
+    error = parsed.get('Error', {}).get('Code')
+    if error:
+        span['error'] = error
+    if call.get('throttles'):
+        span['throttles'] = call['throttles']
+    record_span(span)
+
+def _after_call_error(exception, context, **kwargs):
+    # 連線逾時等沒有收到回應的錯誤 (有回應的錯誤在 _after_call 記錄)
+    call = context.get('telemetry')
+    if call is None:
+        return
+    span = {
+        'service': call['service'],
+        'operation': call['operation'],
+        'ms': round((time.perf_counter() - call['started']) * 1000, 2),
+        'error': type(exception).__name__
+    }
+    if call.get('throttles'):
+        span['throttles'] = call['throttles']
+    record_span(span)
+
+def is_throttled(parsed):
+    code = parsed.get('Error', {}).get('Code')
+    if code == 'TransactionCanceledException':
+        return any(reason.get('Code') in TRANSACTION_THROTTLE_REASONS for reason in parsed.get('CancellationReasons', []))
+    return code in THROTTLE_ERRORS
+
+def _count_attempt(response, request_dict=None, **kwargs):
+    # 每次嘗試 (包含之後重試成功的) 都會觸發 needs-retry，在這裡計算被節流的次數；回傳 None，不影響是否重試
+    call = (request_dict or {}).get('context', {}).get('telemetry')
+    if call is not None and response is not None and is_throttled(response[1]):
+        call['throttles'] = call.get('throttles', 0) + 1
+
+def instrument(client):
+    """
+    在 boto3 client 上掛追蹤事件，回傳同一個 client (resource 請傳 resource.meta.client)
+    重複呼叫不會重複註冊
+    """
+    events = client.meta.events
+    events.register('before-parameter-build', _before_call, unique_id='ticket-telemetry-before')
+    events.register('after-call', _after_call, unique_id='ticket-telemetry-after')
+    events.register('after-call-error', _after_call_error, unique_id='ticket-telemetry-error')
+    events.register('needs-retry', _count_attempt, unique_id='ticket-telemetry-attempt')
+    return client
+
+def finish_request(**properties):
+    """
+    請求結束時輸出一行 EMF JSON 並回傳同一份 dict
+    properties 會原樣放進紀錄 (例如 StatusCode)，方便在 Logs Insights 篩選
+    """
+    request = current_request() or start_request()
+    with _lock:
+        totals = request['totals']
+        spans = list(request['spans'])
+        dropped = request['dropped']
+    started = request['started']
+    route = request['route'] or 'unknown'
+
+    metrics = {
+        'Latency': round((time.perf_counter() - started) * 1000, 2),
+        'AwsCalls': totals['calls'],
+        'AwsLatency': round(totals['ms'], 2),
+        'ConsumedCapacity': totals['capacity'],
+        'AwsErrors': totals['errors'],
+        'Throttles': totals['throttles'],
+        'Retries': totals['retries']
+    }
+    for service, service_totals in totals['services'].items():
+        metrics[f'{service}.Calls'] = service_totals['calls']
+        metrics[f'{service}.Latency'] = round(service_totals['ms'], 2)
+
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRIC_NAMESPACE,
+                'Dimensions': [['Function', 'Route']],
+                'Metrics': [
+                    {'Name': name, 'Unit': 'Milliseconds' if name.endswith('Latency') else 'Count'}
+                    for name in metrics
+                ]
+            }]
+        },
+        'Function': FUNCTION_NAME,
+        'Route': route,
+        'ColdStart': _cold_start[0]
+    }
+    record.update(metrics)
+    record.update(properties)
+    record['spans'] = spans
+    if dropped:
+        record['spans_dropped'] = dropped
+    _cold_start[0] = False
+
+    _sink[0](record)
+    return record
+
+def emit(record):
+    print(json.dumps(record, separators=(',', ':'), default=str))
+
+_sink = [emit]
+
+def set_sink(sink):
+    """
+    替換輸出 EMF 紀錄的函式 (預設印到 stdout 給 CloudWatch Logs)，例如 benchmark 改成收集起來
+    傳入 None 恢復預設
+    """
+    _sink[0] = sink or emit
+
+def redact(value, key=None):
+    """
+    遮蔽敏感欄位並截斷過長的字串；JSON 字串 (例如 API Gateway 的 body) 會先解析再處理
+    """
+    if key is not None and key.lower() in REDACTED_KEYS:
+        return '[REDACTED]'
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        if value[:1] in ('{', '['):
+            try:
+                return redact(json.loads(value))
+            except ValueError:
+                pass
+        if len(value) > MAX_LOGGED_STRING:
+            return f'{value[:MAX_LOGGED_STRING]}...[{len(value)} chars]'
+    return value
+
+def log_event(event, force=False):
+    """
+    依 EVENT_LOG_SAMPLE_RATE 取樣記錄完整 event (已遮蔽)，force=True 時一定記錄 (例如回應 5xx)
+    """
+    if not force and random.random() >= EVENT_LOG_SAMPLE_RATE:
+        return
+    event = dict(event)
+    if event.get('isBase64Encoded') and isinstance(event.get('body'), str):
+        event['body'] = f"[base64 {len(event['body'])} chars]"
+    print("Event:", json.dumps(redact(event), separators=(',', ':'), default=str))
@@ -0,0 +1,192 @@
+"""
+DynamoDB 節流處理：Client 端自動限速、Full Jitter 退避重試，以及每個請求的退避預算
+
+- Client 端限速 (AIMD)：收到節流錯誤後把速率降到最近實際送出速率的 RATE_DECREASE 倍，每次成功再加回 RATE_INCREASE，
+  恢復到節流前的速率就不再限速 (同一個 Container 共用)
+- botocore 本身不重試 (total_max_attempts=1)，改由 needs-retry 事件決定：節流與暫時性錯誤以 Full Jitter 指數退避重試
+- 同一個請求的限速等待與退避合計不超過 RETRY_BUDGET_MS，用完就放棄，不會一路重試到 API Gateway 逾時
+  (botocore 的 adaptive 模式等待沒有上限，流量小的 Container 節流後可能每個呼叫都等好幾秒，所以不使用)
+- 因節流放棄時記錄在目前請求的預算，API 據此回傳 429 + Retry-After
+
+需與 TicketAPIHandler 一起打包 (TicketArchiveJob 透過 TicketAPIHandler 的 client 共用)
+"""
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from botocore.exceptions import ConnectionError as EndpointError, HTTPClientError
+from TicketTelemetry import THROTTLE_ERRORS, TRANSACTION_THROTTLE_REASONS
+# --- 設定區 ---
+RETRY_BUDGET_MS = int(os.environ.get('RETRY_BUDGET_MS', '1000')) # 每個請求限速等待 + 退避合計上限
+RETRY_MAX_ATTEMPTS = 5         # 單一呼叫最多嘗試次數 (含第一次)
+RETRY_BASE_DELAY = 0.025       # 第一次重試的退避上限 (秒)，之後每次加倍
+RETRY_MAX_DELAY = 0.5          # 單次退避上限 (秒)
+RETRY_AFTER_SECONDS = (1, 3)   # 429 的 Retry-After 範圍，隨機分散前端重試的時間
+RATE_DECREASE = 0.7            # 節流時速率乘上的倍數
+RATE_INCREASE = 1.0            # 每次成功增加的速率 (呼叫數 / 秒)
+MIN_RATE = 5.0                 # 限速的最低速率 (呼叫數 / 秒)，流量小的 Container 節流後每個呼叫最多等 0.2 秒
+RATE_WINDOW = 1.0              # 計算實際送出速率的時間窗 (秒)
+# 也會重試的伺服器暫時性錯誤 (節流錯誤見 TicketTelemetry.THROTTLE_ERRORS、TRANSACTION_THROTTLE_REASONS)
+TRANSIENT_ERRORS = ('InternalServerError', 'InternalFailure', 'ServiceUnavailable', 'RequestTimeout', 'RequestTimeoutException')
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+# ------------
+
+_lock = threading.Lock()
+# 目前請求的預算；執行緒池內的工作以 TicketTelemetry.in_request 包裝時共用同一份
+_budget = contextvars.ContextVar('ticket_retry_budget', default=None)
+
+class RateLimiter:
+    """
+    Container 內共用的 token bucket，沒遇過節流 (或已恢復) 時不限速
+    wait() 回傳需要等待的秒數並先扣 token (可以是負的，之後的呼叫補回)
+    重試的呼叫已經退避過，只計入送出速率，不限速也不扣 token
+    """
+    def __init__(self):
+        self.enabled = False
+        self.rate = 0.0
+        self.recover_rate = 0.0
+        self.tokens = 0.0
+        self.refilled_at = time.monotonic()
+        self.sent = deque()
+
+    def measured_rate(self, now):
+        while self.sent and self.sent[0] <= now - RATE_WINDOW:
+            self.sent.popleft()
+        return len(self.sent) / RATE_WINDOW
+
+    def wait(self, max_wait=None, retry=False):
+        now = time.monotonic()
+        self.sent.append(now)
+        self.measured_rate(now)
+        if not self.enabled or retry:
+            return 0
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        delay = max(0.0, (1 - self.tokens) / self.rate)
+        if max_wait is not None and delay > max_wait:
+            return 0 # 預算不夠等，直接送出讓 DynamoDB 決定
+        self.tokens -= 1
+        return delay
+
+    def on_throttle(self):
+        now = time.monotonic()
+        measured = max(MIN_RATE, self.measured_rate(now))
+        if not self.enabled:
+            self.enabled = True
+            self.rate = measured
+            self.recover_rate = measured
+            self.tokens = 1.0 # 節流當下不讓下一個新的呼叫多等一整個間隔
+            self.refilled_at = now
+        self.rate = max(MIN_RATE, min(self.rate, measured) * RATE_DECREASE)
+
+    def on_success(self):
+        if self.enabled:
+            self.rate += RATE_INCREASE
+            if self.rate >= self.recover_rate:
+                self.enabled = False
+
+limiter = RateLimiter()
+
+def client_config():
+    """
+    建立 client 時使用：boto3.resource('dynamodb', config=client_config())
+    """
+    from botocore.config import Config
+    return Config(retries={'mode': 'standard', 'total_max_attempts': 1})
+
+def start_budget(budget_ms=RETRY_BUDGET_MS):
+    """
+    Lambda 開始處理一個請求時呼叫，之後的限速等待與重試都從這份預算扣除
+    沒有呼叫時 (命令列工具、排程 Job) 只受 RETRY_MAX_ATTEMPTS 限制
+    """
+    budget = {'remaining': budget_ms / 1000, 'retries': 0, 'waited': 0.0, 'exhausted': None}
+    _budget.set(budget)
+    return budget
+
+def current_budget():
+    return _budget.get()
+
+def retry_after():
+    return random.randint(*RETRY_AFTER_SECONDS)
+
+def classify(status_code, parsed):
+    """
+    依回應判斷是否重試：回傳 ('throttle' 或 'transient', 錯誤代碼)，不需要重試時回傳 None
+    parsed 可以是 botocore 解析後的回應或 ClientError.response
+    """
+    code = parsed.get('Error', {}).get('Code')
+    if code in THROTTLE_ERRORS:
+        return 'throttle', code
+    if code == 'TransactionCanceledException':
+        reasons = [reason.get('Code') for reason in parsed.get('CancellationReasons', []) if reason.get('Code') not in (None, 'None')]
+        # 全部都是節流才重試 (例如條件不符的交易重試也不會成功)
+        if reasons and all(reason in TRANSACTION_THROTTLE_REASONS for reason in reasons):
+            return 'throttle', code
+        return None
+    if code in TRANSIENT_ERRORS or status_code in TRANSIENT_STATUS_CODES:
+        return 'transient', code or str(status_code)
+    return None
+
+def is_throttle_error(error):
+    """
+    例外是否為節流 (含因節流取消的交易)
+    """
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    error = classify(response.get('ResponseMetadata', {}).get('HTTPStatusCode'), response)
+    return error is not None and error[0] == 'throttle'
+
+def _before_send(request=None, **kwargs):
+    # 限速：等待的時間從預算扣除，預算不夠時不等待；第 2 次以後的嘗試已經在 _needs_retry 退避過
+    retries = (getattr(request, 'context', None) or {}).get('retries') or {}
+    budget = _budget.get()
+    with _lock:
+        delay = limiter.wait(budget['remaining'] if budget is not None else None, retry=retries.get('attempt', 1) > 1)
+        if delay and budget is not None:
+            budget['remaining'] -= delay
+            budget['waited'] += delay
+    if delay:
+        time.sleep(delay)
+
+def _needs_retry(response, attempts, caught_exception, **kwargs):
+    # 回傳 sleep 秒數表示要重試，None 表示不重試 (botocore needs-retry 事件的慣例)
+    if caught_exception is not None:
+        # 連線失敗、讀取逾時
+        if not isinstance(caught_exception, (EndpointError, HTTPClientError)):
+            return None
+        error = ('transient', type(caught_exception).__name__)
+    elif response is not None:
+        error = classify(response[0].status_code, response[1])
+    else:
+        error = None
+    if error is None:
+        if response is not None:
+            with _lock:
+                limiter.on_success()
+        return None
+
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1)))
+    budget = _budget.get()
+    with _lock:
+        if error[0] == 'throttle':
+            limiter.on_throttle()
+        if attempts >= RETRY_MAX_ATTEMPTS or (budget is not None and delay > budget['remaining']):
+            if budget is not None and error[0] == 'throttle':
+                budget['exhausted'] = error[1]
+            return None
+        if budget is not None:
+            budget['remaining'] -= delay
+            budget['retries'] += 1
+    return delay
+
+def install(client):
+    """
+    在 boto3 client 上掛限速與重試判斷，回傳同一個 client (resource 請傳 resource.meta.client)
+    client 需以 client_config() 建立，botocore 才不會自己再重試
+    """
+    client.meta.events.register('before-send', _before_send, unique_id='ticket-throttle-limit')
+    client.meta.events.register('needs-retry', _needs_retry, unique_id='ticket-throttle-retry')
+    return client
@@ -0,0 +1,185 @@
+import io
+import json
+import os
+import sys
+from urllib.parse import unquote_plus
+import boto3
+from botocore.exceptions import ClientError
+from PIL import Image, ImageOps
+from TicketTelemetry import instrument, start_request, finish_request
+# --- 設定區 ---
+S3_BUCKET_NAME = 'repair-work-order-system' # <--- 與 TicketAPIHandler 相同的 Bucket
+SOURCE_PREFIX = 'tickets/'        # S3 Event 只需要觸發這個 prefix
+THUMBNAIL_PREFIX = 'thumbnails/'  # 縮圖放在另一個 prefix，避免再次觸發 Worker
+
+# 縮圖尺寸 (長邊像素)，名稱與 TicketAPIHandler 的 THUMBNAIL_SIZES 相同
+THUMBNAIL_SIZES = {'small': 320, 'medium': 960}
+# 每個尺寸都輸出 WebP 與 JPEG (給不支援 WebP 的瀏覽器)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+# 縮圖 key 包含原圖 key，內容不會變，可以讓瀏覽器與 CDN 長期快取
+THUMBNAIL_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# ------------
+
+s3 = instrument(boto3.client('s3'))
+
+class UnreadableImage(ValueError):
+    """
+    不是圖片、檔案損毀或尺寸超過 Pillow 的上限：重試也不會成功
+    """
+
+def thumbnail_key(original_key, size_name, ext):
+    """
+    縮圖的 key：thumbnails/{size}/{原圖 key}.{ext}
+    例如 tickets/abc/1700000000_0_photo.jpg -> thumbnails/small/tickets/abc/1700000000_0_photo.jpg.webp
+    """
+    return f"{THUMBNAIL_PREFIX}{size_name}/{original_key}.{ext}"
+
+def render_thumbnails(data):
+    """
+    把原圖轉成所有尺寸與格式的縮圖，回傳 {(size_name, ext): bytes}
+    會依 EXIF 轉正 (手機照片常見)，原圖比尺寸小時不放大
+    """
+    # 只有解碼的錯誤視為壞檔 (UnidentifiedImageError 也是 OSError)
+    try:
+        with Image.open(io.BytesIO(data)) as original:
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise UnreadableImage(f"{type(e).__name__}: {e}")
+
+    results = {}
+    for size_name, max_side in THUMBNAIL_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        for ext, (pil_format, _, options) in THUMBNAIL_FORMATS.items():
+            # JPEG 不支援透明與調色盤，先轉成 RGB；WebP 保留透明
+            frame = resized
+            if pil_format == 'JPEG' and frame.mode != 'RGB':
+                frame = frame.convert('RGB')
+            elif pil_format == 'WEBP' and frame.mode not in ('RGB', 'RGBA'):
+                frame = frame.convert('RGBA')
+            buffer = io.BytesIO()
+            frame.save(buffer, format=pil_format, **options)
+            results[(size_name, ext)] = buffer.getvalue()
+    return results
+
+def process_image(bucket, key, s3_client=None):
+    """
+    產生一張原圖的所有縮圖並上傳，回傳大小報告
+    s3_client 可以換成任何有 get_object / put_object 的物件 (本機測試用)
+    """
+    s3_client = s3_client or s3
+    data = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    thumbnails = render_thumbnails(data)
+
+    sizes = {}
+    for (size_name, ext), body in thumbnails.items():
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=thumbnail_key(key, size_name, ext),
+            Body=body,
+            ContentType=THUMBNAIL_FORMATS[ext][1],
+            CacheControl=THUMBNAIL_CACHE_CONTROL
+        )
+        sizes[f"{size_name}.{ext}"] = len(body)
+
+    # 列表預設顯示 small.webp，省下的流量以它計算
+    default_size = sizes[f"{next(iter(THUMBNAIL_SIZES))}.webp"]
+    return {
+        'key': key,
+        'original_bytes': len(data),
+        'thumbnail_bytes': sizes,
+        'bytes_saved': len(data) - default_size
+    }
+
+def should_process(key):
+    return key.startswith(SOURCE_PREFIX) and not key.startswith(THUMBNAIL_PREFIX) and not key.endswith('/')
+
+def raise_for_retry(key, error, reports, failed):
+    """
+    S3 節流、逾時等暫時性錯誤：輸出指標後重新丟出，讓 Lambda 非同步呼叫自動重試整個 event
+    (API 已經把縮圖 URL 存進工單，略過的話這些 URL 會一直 404；已完成的縮圖重做結果相同)
+    """
+    print(f"Error generating thumbnails for {key}, will retry: {type(error).__name__}: {str(error)}")
+    finish_request(Processed=len(reports), Failures=len(failed) + 1, Retrying=True)
+    raise error
+
+def lambda_handler(event, context):
+    # S3 ObjectCreated 事件 (需在 Bucket 設定 Prefix: tickets/)
+    start_request('thumbnail')
+    reports = []
+    failed = []
+    for record in event.get('Records', []):
+        bucket = record['s3']['bucket']['name']
+        key = unquote_plus(record['s3']['object']['key']) # Event 內的 key 是 URL 編碼
+
+        if not should_process(key):
+            print(f"Skipping {key}")
+            continue
+
+        try:
+            report = process_image(bucket, key)
+        except UnreadableImage as e:
+            # 不是圖片或檔案損毀，重試也不會成功，記錄後略過
+            print(f"Skipping unreadable image {key}: {str(e)}")
+            failed.append(key)
+            continue
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise_for_retry(key, e, reports, failed)
+            # 原圖在處理前已被刪除
+            print(f"Skipping missing object {key}")
+            failed.append(key)
+            continue
+        except Exception as e:
+            raise_for_retry(key, e, reports, failed)
+
+        print("Thumbnail report:", json.dumps(report))
+        reports.append(report)
+
+    result = {
+        'processed': len(reports),
+        'failed': failed,
+        'bytes_saved': sum(report['bytes_saved'] for report in reports),
+        'reports': reports
+    }
+    finish_request(Processed=len(reports), Failures=len(failed), BytesSaved=result['bytes_saved'])
+    return result
+
+class LocalDirectoryS3:
+    """
+    以本機資料夾模擬 S3 (get_object / put_object)，方便不連 AWS 測試縮圖效果
+    Bucket 對應到資料夾，Key 對應到相對路徑
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def get_object(self, Bucket, Key):
+        with open(os.path.join(self.root, Bucket, Key), 'rb') as f:
+            return {'Body': io.BytesIO(f.read())}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = os.path.join(self.root, Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(Body)
+
+if __name__ == '__main__':
+    # 本機測試：python TicketThumbnailWorker.py <資料夾>
+    # 資料夾內的 {bucket}/tickets/... 圖片都會產生縮圖，並印出每張省下的位元組數
+    root = sys.argv[1] if len(sys.argv) > 1 else '.'
+    local_s3 = LocalDirectoryS3(root)
+    for bucket in sorted(os.listdir(root)):
+        bucket_dir = os.path.join(root, bucket)
+        for dirpath, _, filenames in os.walk(os.path.join(bucket_dir, SOURCE_PREFIX)):
+            for filename in sorted(filenames):
+                key = os.path.relpath(os.path.join(dirpath, filename), bucket_dir).replace(os.sep, '/')
+                if not should_process(key):
+                    continue
+                try:
+                    print(json.dumps(process_image(bucket, key, local_s3)))
+                except Exception as e:
+                    print(f"Error generating thumbnails for {key}: {str(e)}")
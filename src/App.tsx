@@ -6,7 +6,7 @@ import { NewPasswordPage } from './components/NewPasswordPage';
 import { ConfirmSignUpPage } from './components/ConfirmSignUpPage';
 import { Dashboard } from './components/Dashboard';
 import { Ticket, TicketStatus, PriorityLevel, TicketTagId } from './components/TicketCard';
-import { ticketService } from './services/ticketService';
+import { ticketService, TicketFilters, TicketStats } from './services/ticketService';
 
 function App() {
   const [isLoggedIn, setIsLoggedIn] = useState(false);
@@ -15,7 +15,12 @@ function App() {
   const [userName, setUserName] = useState('');
   const [isAdmin, setIsAdmin] = useState(false);
   const [tickets, setTickets] = useState<Ticket[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [watermark, setWatermark] = useState<string | null>(null);
+  const [filters, setFilters] = useState<TicketFilters>({});
+  const [stats, setStats] = useState<TicketStats | null>(null);
   const [isLoading, setIsLoading] = useState(false);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [pendingEmail, setPendingEmail] = useState('');
 
@@ -24,12 +29,12 @@ function App() {
     checkUser();
   }, []);
 
-  // Load tickets when logged in
+  // Load tickets when logged in (篩選條件改變時重新載入第一頁)
   useEffect(() => {
     if (isLoggedIn) {
       loadTickets();
     }
-  }, [isLoggedIn]);
+  }, [isLoggedIn, filters]);
 
   const checkUser = async () => {
     try {
@@ -56,14 +61,34 @@ function App() {
     }
   };
 
+  // 差異同步的起點：已載入工單中最新的異動時間 (以伺服器時間為準)，沒有工單時退回本機時間往前 1 分鐘
+  const latestChange = (items: Ticket[]): string => {
+    const times = items.map(t => t.updated_at || t.created_at).filter(Boolean).sort();
+    return times.length > 0
+      ? times[times.length - 1]
+      : new Date(Date.now() - 60000).toISOString().replace('Z', '');
+  };
+
+  const loadStats = async () => {
+    try {
+      setStats(await ticketService.getStats());
+    } catch (err) {
+      // 統計失敗時 Dashboard 改用已載入的工單計算
+      console.error('Error loading stats:', err);
+    }
+  };
+
+  // 只載入第一頁，其餘由「Load more」依 next_cursor 載入
   const loadTickets = async () => {
     try {
       setIsLoading(true);
       setError(null);
-      console.log('Fetching tickets...');
-      const data = await ticketService.getAllTickets();
-      console.log('Loaded tickets:', data);
-      setTickets(data);
+      console.log('Fetching tickets...', filters);
+      const [page] = await Promise.all([ticketService.getTickets(filters), loadStats()]);
+      console.log('Loaded tickets:', page.items.length);
+      setTickets(page.items);
+      setNextCursor(page.nextCursor);
+      setWatermark(latestChange(page.items));
     } catch (err) {
       const errorMessage = err instanceof Error ? err.message : 'Failed to load tickets';
       setError(errorMessage);
@@ -73,6 +98,66 @@ function App() {
     }
   };
 
+  const loadMoreTickets = async () => {
+    if (!nextCursor || isLoadingMore) {
+      return;
+    }
+    try {
+      setIsLoadingMore(true);
+      const page = await ticketService.getTickets(filters, nextCursor);
+      // 同步期間可能已經合併過同一張工單，以 ticket_id 去除重複
+      setTickets(current => {
+        const loaded = new Set(current.map(t => t.ticket_id));
+        return [...current, ...page.items.filter(t => !loaded.has(t.ticket_id))];
+      });
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      const errorMessage = err instanceof Error ? err.message : 'Failed to load more tickets';
+      setError(errorMessage);
+      console.error('Error loading more tickets:', err);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
+  // 篩選條件相同時保留原物件，避免重複載入
+  const handleFiltersChange = (next: TicketFilters) => {
+    setFilters(current => current.status === next.status && current.tag === next.tag ? current : next);
+  };
+
+  const matchesFilters = (ticket: Ticket) =>
+    (!filters.status || ticket.status === filters.status) &&
+    (!filters.tag || (ticket.tags?.includes(filters.tag) ?? false));
+
+  // 重新整理：以差異同步合併異動，不重新讀取已載入的分頁
+  const refreshTickets = async () => {
+    if (!watermark) {
+      return loadTickets();
+    }
+    try {
+      setError(null);
+      const [changes] = await Promise.all([ticketService.getChanges(watermark), loadStats()]);
+      if (changes.fullResync) {
+        return loadTickets();
+      }
+      setTickets(current => {
+        const removed = new Set([...changes.deleted, ...changes.changed.map(t => t.ticket_id)]);
+        // 比已載入最舊一筆還舊的工單屬於還沒載入的分頁，等使用者載入那一頁
+        const oldest = current.length > 0 ? current[current.length - 1].created_at : '';
+        const added = changes.changed.filter(t =>
+          matchesFilters(t) && (!nextCursor || t.created_at >= oldest || current.some(c => c.ticket_id === t.ticket_id))
+        );
+        return [...added, ...current.filter(t => !removed.has(t.ticket_id))]
+          .sort((a, b) => b.created_at.localeCompare(a.created_at));
+      });
+      setWatermark(changes.watermark);
+    } catch (err) {
+      const errorMessage = err instanceof Error ? err.message : 'Failed to refresh tickets';
+      setError(errorMessage);
+      console.error('Error refreshing tickets:', err);
+    }
+  };
+
   const handleLogin = async (email: string, password: string) => {
     try {
       setError(null);
@@ -170,6 +255,9 @@ function App() {
       setUserName('');
       setIsAdmin(false);
       setTickets([]);
+      setNextCursor(null);
+      setWatermark(null);
+      setStats(null);
       setView('login');
     } catch (err) {
       console.error('Logout failed', err);
@@ -219,9 +307,9 @@ function App() {
       
       console.log('Ticket created successfully:', result);
       
-      // 延遲一下再重新載入，確保 DynamoDB 已寫入
+      // 延遲一下再同步，確保 GSI 已更新
       await new Promise(resolve => setTimeout(resolve, 500));
-      await loadTickets();
+      await refreshTickets();
     } catch (err) {
       const errorMessage = err instanceof Error ? err.message : 'Failed to create ticket';
       setError(errorMessage);
@@ -360,8 +448,8 @@ function App() {
         </div>
       )}
       
-      {/* 載入中狀態 */}
-      {isLoading ? (
+      {/* 載入中狀態 (只有第一次載入顯示整頁；切換篩選時保留 Dashboard，篩選條件存在 Dashboard 內) */}
+      {isLoading && watermark === null ? (
         <div className="min-h-screen flex items-center justify-center">
           <div className="text-center">
             <div className="w-16 h-16 border-4 border-blue-500 border-t-transparent rounded-full animate-spin mx-auto mb-4"></div>
@@ -375,7 +463,12 @@ function App() {
           onUpdateTicketStatus={handleUpdateTicketStatus}
           onDeleteTicket={handleDeleteTicket}
           onEditTicket={handleEditTicket}
-          onRefresh={loadTickets}
+          onRefresh={refreshTickets}
+          onLoadMore={loadMoreTickets}
+          hasMore={!!nextCursor}
+          isLoadingMore={isLoadingMore}
+          stats={stats}
+          onFiltersChange={handleFiltersChange}
           onLogout={handleLogout}
           userEmail={userEmail}
           isAdmin={isAdmin}
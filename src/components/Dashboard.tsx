@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import { Plus, LogOut, User, Filter, Search, X, RefreshCw, ArrowUpDown, LayoutGrid, List, Clock, TrendingUp, Tag } from 'lucide-react';
 import { TicketCard, Ticket, TicketStatus, PriorityLevel, TicketTagId, TICKET_TAGS } from './TicketCard';
 import { CreateTicketModal } from './CreateTicketModal';
+import { TicketFilters, TicketStats } from '../services/ticketService';
 import { TicketDetailModal } from './TicketDetailModal';
 
 type SortOption = 'newest' | 'oldest' | 'priority' | 'title';
@@ -15,11 +16,16 @@ interface DashboardProps {
   onEditTicket?: (ticketId: string, updates: { title?: string; description?: string; images?: string[]; priority?: PriorityLevel; tags?: TicketTagId[] }, newImageFiles?: File[]) => Promise<void>;
   onLogout: () => void;
   onRefresh?: () => void;
+  onLoadMore?: () => void;
+  hasMore?: boolean;
+  isLoadingMore?: boolean;
+  stats?: TicketStats | null;
+  onFiltersChange?: (filters: TicketFilters) => void;
   userEmail: string;
   isAdmin?: boolean;
 }
 
-export function Dashboard({ tickets, onCreateTicket, onUpdateTicketStatus, onDeleteTicket, onEditTicket, onLogout, onRefresh, userEmail, isAdmin = false }: DashboardProps) {
+export function Dashboard({ tickets, onCreateTicket, onUpdateTicketStatus, onDeleteTicket, onEditTicket, onLogout, onRefresh, onLoadMore, hasMore = false, isLoadingMore = false, stats: serverStats, onFiltersChange, userEmail, isAdmin = false }: DashboardProps) {
   const [isCreateModalOpen, setIsCreateModalOpen] = useState(false);
   const [selectedTicket, setSelectedTicket] = useState<Ticket | null>(null);
   const [filterStatus, setFilterStatus] = useState<TicketStatus | 'All'>('All');
@@ -39,6 +45,14 @@ export function Dashboard({ tickets, onCreateTicket, onUpdateTicketStatus, onDel
     }
   }, [tickets]);
 
+  // 狀態與標籤改由後端篩選 (列表只載入一頁，不能只在畫面上篩選)
+  useEffect(() => {
+    onFiltersChange?.({
+      status: filterStatus === 'All' ? undefined : filterStatus,
+      tag: filterTag === 'All' ? undefined : filterTag,
+    });
+  }, [filterStatus, filterTag]);
+
   // 排序函數
   const sortTickets = (ticketList: Ticket[]): Ticket[] => {
     const priorityOrder: Record<PriorityLevel, number> = { 'High': 0, 'Medium': 1, 'Low': 2 };
@@ -79,7 +93,13 @@ export function Dashboard({ tickets, onCreateTicket, onUpdateTicketStatus, onDel
     return statusMatch && tagMatch && searchMatch;
   }));
 
-  const stats = {
+  // 優先使用後端統計 (GET /tickets?view=stats)；取不到時以已載入的工單計算
+  const stats = serverStats ? {
+    total: serverStats.total,
+    open: serverStats.by_status.Open || 0,
+    processing: serverStats.by_status.Processing || 0,
+    closed: serverStats.by_status.Closed || 0,
+  } : {
     total: tickets.length,
     open: tickets.filter(t => t.status === 'Open').length,
     processing: tickets.filter(t => t.status === 'Processing').length,
@@ -89,7 +109,9 @@ export function Dashboard({ tickets, onCreateTicket, onUpdateTicketStatus, onDel
   // 計算每個 Tag 的數量
   const tagStats = TICKET_TAGS.map(tag => ({
     ...tag,
-    count: tickets.filter(t => t.tags && t.tags.includes(tag.id)).length
+    count: serverStats
+      ? serverStats.by_tag[tag.id] || 0
+      : tickets.filter(t => t.tags && t.tags.includes(tag.id)).length
   }));
 
   const handleRefresh = async () => {
@@ -540,6 +562,20 @@ export function Dashboard({ tickets, onCreateTicket, onUpdateTicketStatus, onDel
             </div>
           </div>
         )}
+
+        {/* Load More：依 next_cursor 載入下一頁 */}
+        {hasMore && onLoadMore && (
+          <div className="flex justify-center mt-6">
+            <button
+              onClick={onLoadMore}
+              disabled={isLoadingMore}
+              className="flex items-center gap-2 px-6 py-2.5 bg-white border border-[#E2E8F0] rounded-lg text-[#334155] hover:bg-[#F1F5F9] transition-colors shadow-sm disabled:opacity-50"
+            >
+              {isLoadingMore && <RefreshCw className="w-4 h-4 animate-spin" />}
+              <span>{isLoadingMore ? 'Loading...' : 'Load more'}</span>
+            </button>
+          </div>
+        )}
       </main>
 
       {/* Create Ticket Modal */}
@@ -25,6 +25,7 @@ export interface Ticket {
   status: TicketStatus;
   priority: PriorityLevel;
   created_at: string;
+  updated_at?: string;
   images?: string[];
   tags?: TicketTagId[];
 }
@@ -1,5 +1,49 @@
 import { fetchAPI, API_ENDPOINTS } from '../config/api';
-import { Ticket, TicketStatus, PriorityLevel } from '../components/TicketCard';
+import { Ticket, TicketStatus, PriorityLevel, TicketTagId } from '../components/TicketCard';
+
+// 列表每頁筆數 (後端 MAX_PAGE_SIZE 為 100，一次只載入一頁)
+const PAGE_SIZE = 50;
+
+export interface TicketFilters {
+  status?: TicketStatus;
+  tag?: TicketTagId;
+}
+
+export interface TicketPage {
+  items: Ticket[];
+  nextCursor: string | null;
+}
+
+export interface TicketChanges {
+  changed: Ticket[];
+  deleted: string[];
+  watermark: string;
+  fullResync: boolean;
+}
+
+export interface TicketStats {
+  total: number;
+  by_status: Partial<Record<TicketStatus, number>>;
+  by_tag: Record<string, number>;
+}
+
+// 處理多種可能的回應格式
+function parseItems(data: any): Ticket[] {
+  if (Array.isArray(data)) {
+    // 直接是陣列: [...] (舊版 API 沒有分頁)
+    return data;
+  }
+  if (data.items && Array.isArray(data.items)) {
+    // 格式: { items: [...], next_cursor }
+    return data.items;
+  }
+  if (data.Items && Array.isArray(data.Items)) {
+    // 格式: { Items: [...] } (DynamoDB 預設)
+    return data.Items;
+  }
+  console.warn('[TicketService] Unknown data format:', data);
+  return [];
+}
 
 /**
  * Ticket API 服務層
@@ -7,39 +51,70 @@ import { Ticket, TicketStatus, PriorityLevel } from '../components/TicketCard';
  */
 export const ticketService = {
   /**
-   * 查詢所有工單
-   * GET /tickets
+   * 查詢一頁工單 (新的在前)
+   * GET /tickets?status=&limit=&next_cursor=，有標籤篩選時改用 GET /tickets?tags= (搜尋)
+   * 下一頁帶上前一頁回傳的 nextCursor，為 null 代表已經是最後一頁
    */
-  async getAllTickets(): Promise<Ticket[]> {
+  async getTickets(filters: TicketFilters = {}, cursor: string | null = null): Promise<TicketPage> {
     try {
-      const data = await fetchAPI(API_ENDPOINTS.tickets);
-      console.log('[TicketService] Raw API response:', data);
-
-      // 處理多種可能的回應格式
-      let items: Ticket[] = [];
-
-      if (Array.isArray(data)) {
-        // 直接是陣列: [...]
-        items = data;
-      } else if (data.items && Array.isArray(data.items)) {
-        // 格式: { items: [...] }
-        items = data.items;
-      } else if (data.Items && Array.isArray(data.Items)) {
-        // 格式: { Items: [...] } (DynamoDB 預設)
-        items = data.Items;
-      } else {
-        console.warn('[TicketService] Unknown data format:', data);
-        return [];
+      const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+      if (filters.tag) {
+        // 搜尋不支援 status，狀態由畫面篩選
+        params.set('tags', filters.tag);
+      } else if (filters.status) {
+        params.set('status', filters.status);
       }
-
+      if (cursor) {
+        params.set('next_cursor', cursor);
+      }
+      const data = await fetchAPI(`${API_ENDPOINTS.tickets}?${params.toString()}`);
+      const items = parseItems(data);
       console.log('[TicketService] Parsed tickets:', items.length);
-      return items;
+      return { items, nextCursor: Array.isArray(data) ? null : data.next_cursor ?? null };
     } catch (error) {
       console.error('[TicketService] Failed to load tickets:', error);
       throw error;
     }
   },
 
+  /**
+   * 差異同步：只取 since 之後新增、修改或刪除的工單
+   * GET /tickets?since={watermark}，has_more 時接著取，直到追上最新的異動
+   */
+  async getChanges(since: string): Promise<TicketChanges> {
+    try {
+      const changes: TicketChanges = { changed: [], deleted: [], watermark: since, fullResync: false };
+      let hasMore = true;
+
+      while (hasMore) {
+        const params = new URLSearchParams({ since: changes.watermark });
+        const data = await fetchAPI(`${API_ENDPOINTS.tickets}?${params.toString()}`);
+        if (data.full_resync) {
+          // since 超過刪除紀錄保留期限，需要重新載入列表
+          return { ...changes, fullResync: true };
+        }
+        changes.changed.push(...data.changed);
+        changes.deleted.push(...data.deleted);
+        changes.watermark = data.watermark;
+        hasMore = data.has_more;
+      }
+
+      console.log('[TicketService] Synced changes:', changes.changed.length, 'changed,', changes.deleted.length, 'deleted');
+      return changes;
+    } catch (error) {
+      console.error('[TicketService] Failed to sync tickets:', error);
+      throw error;
+    }
+  },
+
+  /**
+   * 統計資訊 (總數、各狀態與標籤的數量)，不需要載入所有工單
+   * GET /tickets?view=stats
+   */
+  async getStats(): Promise<TicketStats> {
+    return fetchAPI(`${API_ENDPOINTS.tickets}?view=stats`);
+  },
+
   /**
    * 查詢單筆工單詳情
    * GET /tickets/{ticket_id}